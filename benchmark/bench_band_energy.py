@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.wav_parser import WavInfo, compute_band_energy_dB, BAND_FRAME_LENGTH, BAND_HOP_LENGTH
+
+
+# band energy with one rfft per frame, for comparison
+def compute_band_energy_per_frame(data: np.ndarray, sr: int) -> np.ndarray:
+    window = np.hanning(BAND_FRAME_LENGTH)
+    power_spectrum = np.zeros(BAND_FRAME_LENGTH // 2 + 1)
+    for frame_begin in range(0, data.shape[0] - BAND_FRAME_LENGTH + 1, BAND_HOP_LENGTH):
+        for channel in range(data.shape[1]):
+            spectrum = np.fft.rfft(data[frame_begin:frame_begin + BAND_FRAME_LENGTH, channel] * window)
+            power_spectrum += np.abs(spectrum) ** 2
+    return power_spectrum
+
+
+# run func repeatedly, return min seconds
+def time_func(func, repeat: int) -> float:
+    costs = list[float]()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        costs.append(time.perf_counter() - start_time)
+    return min(costs)
+
+
+def print_cost(name: str, cost: float, minutes: float):
+    print("%-32s %8.1f ms  %8.1f ms/min of audio" % (name, cost * 1000, cost * 1000 / minutes))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=1.0)
+    parser.add_argument("--sr", type=int, default=48000)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = np.random.default_rng(0).standard_normal((int(args.minutes * 60 * args.sr), args.channels)) * 0.1
+    wav_info = WavInfo()
+    wav_info.data, wav_info.sr, wav_info.available = data, args.sr, True
+
+    print("%.1f min of %d Hz %d channel audio" % (args.minutes, args.sr, args.channels))
+    print_cost("dBFS + max dBFS", time_func(
+        lambda: (20 * np.log10(np.sqrt(np.mean(np.square(data), axis=0))), np.max(np.abs(data), axis=0)),
+        args.repeat,
+    ), args.minutes)
+    print_cost("band energy (batched rfft)", time_func(
+        lambda: compute_band_energy_dB(data, args.sr), args.repeat
+    ), args.minutes)
+    print_cost("band energy (rfft per frame)", time_func(
+        lambda: compute_band_energy_per_frame(data, args.sr), max(1, args.repeat // 2)
+    ), args.minutes)
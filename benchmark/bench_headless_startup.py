@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ENTRY_PATH = os.path.join(BASE_DIR, "check_wav_diff_gui.py")
+GUI_MODULES = ["PySide6", "qt_material", "view"]
+
+
+# run python command repeatedly, return wall time of every run in seconds
+def time_command(args: list[str], repeat: int) -> list[float]:
+    costs = list[float]()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=BASE_DIR, stdout=subprocess.DEVNULL, check=True)
+        costs.append(time.perf_counter() - start_time)
+    return costs
+
+
+def print_costs(name: str, costs: list[float]):
+    print("%-28s min %7.1f ms  avg %7.1f ms" % (name, min(costs) * 1000, sum(costs) / len(costs) * 1000))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    # gui modules must not be loaded by the headless entry
+    loaded_gui_modules = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import sys; sys.argv = ['check_wav_diff_gui.py', '--no_gui']; import check_wav_diff_gui; "
+            "print(','.join([m for m in sys.modules if m.split('.')[0] in %r]))" % GUI_MODULES
+        ],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    print("GUI modules loaded by headless entry: %s" % (loaded_gui_modules if len(loaded_gui_modules) > 0 else "none"))
+
+    # startup until args are parsed, before connecting to p4
+    print_costs("python (baseline)", time_command(["-c", "pass"], args.repeat))
+    print_costs("headless entry (--help)", time_command([ENTRY_PATH, "--help"], args.repeat))
+    print_costs("gui modules import", time_command(["-c", "import view.main"], args.repeat))
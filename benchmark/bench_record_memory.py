@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.p4 import FileChangeInfo
+from utils.diff_checker import FileDiffRecord, FileDiffRecordStore
+
+
+# FileChangeInfo and FileDiffRecord before __slots__, for comparison
+class DictFileChangeInfo(object):
+
+    def __init__(self, depot_path: str, action: str, file_type: str, rev: int):
+        self.depot_path = depot_path
+        self.action = action
+        self.file_type = file_type
+        self.rev = rev
+
+
+class DictFileDiffRecord(object):
+
+    def __init__(self, path: str):
+        self.path = path
+        self.prev_rev_id: int = -1
+        self.curr_rev_id: int = -1
+
+    version_forward = FileDiffRecord.version_forward
+    get_prev_rev_id = staticmethod(FileDiffRecord.get_prev_rev_id)
+
+
+# synthetic history: entry i changes path i % path_num, paths are new strings like results of p4
+def iter_history(entry_num: int, path_num: int):
+    revs = [0] * path_num
+    for entry_idx in range(entry_num):
+        path_idx = entry_idx % path_num
+        revs[path_idx] += 1
+        yield "//depot/Dev/Audio/Bank_%03d/Event_%07d.wav" % (path_idx % 500, path_idx), revs[path_idx]
+
+
+# build structure with build_func(history), return (structure, allocated bytes, seconds)
+def measure(build_func, entry_num: int, path_num: int):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = build_func(iter_history(entry_num, path_num))
+    cost = time.perf_counter() - start_time
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, allocated, cost
+
+
+def build_change_infos(info_class):
+    return lambda history: [info_class(path, "edit", "binary", rev) for path, rev in history]
+
+
+def build_record_map(record_class):
+    def build(history):
+        record_map = dict()
+        for path, rev in history:
+            if path not in record_map:
+                record_map[path] = record_class(path)
+            record_map[path].version_forward(FileChangeInfo(path, "edit", "binary", rev))
+        return record_map
+    return build
+
+
+def build_record_store(history):
+    store = FileDiffRecordStore()
+    for path, rev in history:
+        store.version_forward(FileChangeInfo(path, "edit", "binary", rev))
+    return store
+
+
+def print_result(name: str, entry_num: int, allocated: int, cost: float):
+    print("%-36s %8.1f MB  %6.1f B/entry  %6.2f s" % (name, allocated / 1e6, allocated / entry_num, cost))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000000, help="file actions in history")
+    parser.add_argument("--paths", type=int, default=250000, help="distinct depot paths")
+    args = parser.parse_args()
+
+    print("%d file actions of %d paths" % (args.entries, args.paths))
+    for name, build_func, entry_num in [
+        ("FileChangeInfo list (__dict__)", build_change_infos(DictFileChangeInfo), args.entries),
+        ("FileChangeInfo list (__slots__)", build_change_infos(FileChangeInfo), args.entries),
+        ("FileDiffRecord dict (__dict__)", build_record_map(DictFileDiffRecord), args.paths),
+        ("FileDiffRecord dict (__slots__)", build_record_map(FileDiffRecord), args.paths),
+        ("FileDiffRecordStore", build_record_store, args.paths),
+    ]:
+        result, allocated, cost = measure(build_func, args.entries, args.paths)
+        print_result(name, entry_num, allocated, cost)
+        del result
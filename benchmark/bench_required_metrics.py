@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.check_runner import get_check_rules
+from utils.diff_checker import DiffChecker
+
+
+# write wavs of some seconds like music and ambience loops, return their paths
+def write_wavs(output_dir: str, file_num: int, seconds: float, sr: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    paths = list[str]()
+    for file_idx in range(file_num):
+        path = os.path.join(output_dir, "loop_%04d.wav" % file_idx)
+        sf.write(path, rng.standard_normal((int(seconds * sr), 2)) * 0.1, sr, subtype="PCM_16")
+        paths.append(path)
+    return paths
+
+
+# load every wav with metrics required by rules of checker, return seconds
+def time_load(checker: DiffChecker, paths: list[str], repeat: int) -> float:
+    costs = list[float]()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for path in paths:
+            checker.load_wav(path).to_metrics()
+        costs.append(time.perf_counter() - start_time)
+    return min(costs)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--sr", type=int, default=48000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        paths = write_wavs(temp_dir, args.files, args.seconds, args.sr)
+        print("%d stereo wavs of %.0fs" % (len(paths), args.seconds))
+        all_cost = 0.0
+        for name, disabled_rules in [
+            ("all rules", []),
+            ("no band energy, true peak", ["resource_band_energy_diff_rule", "resource_true_peak_rule"]),
+            ("header rules only", [
+                "resource_band_energy_diff_rule", "resource_true_peak_rule",
+                "resource_dBFS_diff_rule", "resource_max_dBFS_diff_rule",
+            ]),
+        ]:
+            checker = DiffChecker()
+            checker.add_rules(get_check_rules(disabled_rules))
+            cost = time_load(checker, paths, args.repeat)
+            all_cost = cost if len(disabled_rules) == 0 else all_cost
+            print("%-28s %-40s %8.1f ms  %6.2fx" % (
+                name, ",".join(sorted(checker.required_metrics)), cost * 1000, all_cost / cost
+            ))
+    finally:
+        shutil.rmtree(temp_dir)
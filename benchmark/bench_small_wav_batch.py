@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.wav_parser import WavInfo, load_small_wavs
+
+
+# write sub-second mono and stereo wavs like UI and foley sounds, return their paths
+def write_small_wavs(output_dir: str, file_num: int, sr: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    paths = list[str]()
+    for file_idx in range(file_num):
+        frames = int(rng.integers(sr // 20, sr))
+        channels = 1 if file_idx % 3 == 0 else 2
+        path = os.path.join(output_dir, "sfx_%06d.wav" % file_idx)
+        sf.write(path, rng.standard_normal((frames, channels)) * 0.1, sr, subtype="PCM_16")
+        paths.append(path)
+    return paths
+
+
+# load and measure wavs one by one, same as loading without batch
+def load_one_by_one(paths: list[str]) -> list[WavInfo]:
+    wav_infos = [WavInfo(path) for path in paths]
+    for wav_info in wav_infos:
+        _ = wav_info.dBFS, wav_info.max_dBFS
+    return wav_infos
+
+
+# run func repeatedly, return min seconds
+def time_func(func, repeat: int) -> float:
+    costs = list[float]()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        costs.append(time.perf_counter() - start_time)
+    return min(costs)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--sr", type=int, default=48000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        paths = write_small_wavs(temp_dir, args.files, args.sr)
+
+        # batched metrics should equal metrics loaded one by one
+        batch_infos = load_small_wavs(paths)
+        single_infos = load_one_by_one(paths)
+        max_diff = max(
+            max(np.max(np.abs(b.dBFS - s.dBFS)), np.max(np.abs(b.max_dBFS - s.max_dBFS)))
+            for b, s in zip(batch_infos, single_infos)
+        )
+        print("%d wavs, max metrics diff of batch and one by one: %.2e dB" % (len(paths), max_diff))
+
+        single_cost = time_func(lambda: load_one_by_one(paths), args.repeat)
+        batch_cost = time_func(lambda: [
+            load_small_wavs(paths[batch_begin:batch_begin + args.batch_size])
+            for batch_begin in range(0, len(paths), args.batch_size)
+        ], args.repeat)
+        for name, cost in [("one by one", single_cost), ("batch of %d" % args.batch_size, batch_cost)]:
+            print("%-16s %8.1f ms  %8.1f files/s" % (name, cost * 1000, len(paths) / cost))
+        print("speedup %.2fx" % (single_cost / batch_cost))
+    finally:
+        shutil.rmtree(temp_dir)
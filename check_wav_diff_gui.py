@@ -1,16 +1,14 @@
 import os.path
 import sys
+import time
 import argparse
+from typing import Optional
 
-# import QCoreApplication
-from PySide6.QtCore import QCoreApplication
-from PySide6.QtWidgets import QApplication
-from qt_material import build_stylesheet
-
-from view.main import MainWindow
-from utils import p4
-from utils import diff_checker
+# gui modules (PySide6, qt_material, view) are imported in start_gui_app only,
+# console mode must start without loading them
+from utils import check_runner
 from utils.watch_setting import WatchSetting
+from utils.check_journal import CheckJournal
 
 
 BASE_CONFIG_PATH = "config.json"
@@ -19,15 +17,35 @@ USER_CONFIG_PATH = "user_config.json"
 
 def parse_args():
     parser = argparse.ArgumentParser()
+    parser.add_argument("command", type=str, nargs="?", choices=["merge", "index"],
+                        help="merge: merge shard results given by partial_paths into reports; "
+                             "index: build or update loudness index of watch item paths")
+    parser.add_argument("partial_paths", type=str, nargs="*", help="shard results to merge")
     parser.add_argument("--prev", type=str, required=False)
     parser.add_argument("--curr", type=str, required=False)
     parser.add_argument("--clean_mode", action="store_true")
     parser.add_argument("--no_gui", action="store_true")
+    parser.add_argument("--resume", action="store_true", help="skip files completed by an interrupted run")
+    parser.add_argument("--history", action="store_true",
+                        help="check every revision in range and find changes of loudness jumps, no gui")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="list changes and estimate cost of checking without fetching audio, no gui")
+    parser.add_argument("--daemon", action="store_true", help="keep checking new submitted changes, no gui")
+    parser.add_argument("--poll_interval", type=float, default=30.0, help="seconds between polls of daemon")
+    parser.add_argument("--serve", action="store_true", help="run local http api of checking, no gui")
+    parser.add_argument("--port", type=int, default=8765, help="port of local http api")
+    parser.add_argument("--shard", type=str, required=False,
+                        help="'i/N', check the i-th (0-based) of N parts of files and save a partial result, "
+                             "implies --no_gui")
 
     return parser.parse_args()
 
 
 def start_gui_app(ws: WatchSetting, watch_setting_save_path: str):
+    from PySide6.QtWidgets import QApplication
+    from qt_material import build_stylesheet
+    from view.main import MainWindow
+
     # init
     app = QApplication([])
     main_window = MainWindow(
@@ -47,25 +65,215 @@ def start_gui_app(ws: WatchSetting, watch_setting_save_path: str):
     sys.exit(app_thread)
 
 
-def start_console_app(ws: WatchSetting):
+def start_console_app(ws: WatchSetting, resume: bool = False, shard: Optional[str] = None):
+    shard_idx, shard_num = check_runner.parse_shard(shard) if shard is not None else (0, 1)
+    shard_ext = check_runner.get_shard_ext(shard_idx, shard_num, "") if shard is not None else ""
 
-    p4_client = MainWindow.create_p4_client(ws)
+    p4_client = check_runner.create_p4_client(ws)
+    loudness_index = check_runner.open_loudness_index(ws)
+    analysis_scheduler = check_runner.create_analysis_scheduler(ws)
     for watch_item in ws.watch_item_list:
         print("[Start]Start checking '%s'" % watch_item.name)
-        checker = MainWindow.create_checker(
+        item_start_time = time.perf_counter()
+
+        # check while listing changes, unless all records are needed first for sharding, reading from index,
+        # scheduling analysis by file sizes, or prefetching, or files of two branches are compared
+        stream_flag = shard is None and analysis_scheduler is None and len(ws.scratch_dir) == 0 and (
+            loudness_index is None or loudness_index.find_root(watch_item.path) is None
+        ) and len(watch_item.compare_path) == 0
+        checker = check_runner.create_checker(
             watch_item=watch_item,
             p4_client=p4_client,
-            check_rules=MainWindow.get_check_rules(),
+            check_rules=check_runner.get_check_rules(ws.disabled_rules),
             clean_mode=not ws.disable_clean_mode,
+            loudness_index=loudness_index,
+            load_changes_flag=not stream_flag,
+        )
+        checker.set_analysis_scheduler(analysis_scheduler)
+        checker.set_scratch_dir(ws.scratch_dir, ws.p4_parallel_sync_threads)
+        if len(watch_item.compare_path) > 0:
+            print("[Branch]%d file(s) of '%s' differ from '%s'" % (
+                len(checker), watch_item.path, watch_item.compare_path
+            ))
+        if shard is not None:
+            checker.apply_shard(shard_idx, shard_num)
+            print("[Shard]Shard %d/%d: %d of %d file(s)" % (
+                shard_idx, shard_num, len(checker), len(checker.record_order_map)
+            ))
+
+        # journal of completed files, reloaded when resuming
+        journal = CheckJournal(
+            check_runner.get_output_path(watch_item, ws.output_dir, ext=shard_ext + ".journal"),
+            resume=resume,
         )
-        for file_idx, file_path in checker.check(p4_client, yield_path_flag=True):
-            print("\r[Checking][%d/%d]%s" % (file_idx + 1, len(checker), file_path), end="")
-        output_path = MainWindow.save_checker_result(
+        if len(journal) > 0:
+            print("[Resume]%d file(s) completed before will be skipped" % len(journal))
+        checker.set_journal(journal)
+
+        if stream_flag:
+            for change_num, change_total, file_idx in check_runner.stream_check_changes(
+                checker, watch_item, p4_client
+            ):
+                if file_idx >= 0:
+                    print("\r[Checking][Change %d/%d][%d files]%s" % (
+                        change_num, change_total, file_idx + 1, checker.metrics_builder.columns["path"][file_idx]
+                    ), end="")
+        else:
+            for file_idx, file_path in checker.check(p4_client, yield_path_flag=True):
+                print("\r[Checking][%d/%d]%s" % (file_idx + 1, len(checker), file_path), end="")
+            if analysis_scheduler is not None:
+                print("\n[Analysis]%s" % analysis_scheduler.get_summary(), end="")
+        journal.close()
+        if shard is not None:
+            output_path = check_runner.save_checker_partial(
+                checker=checker,
+                watch_item=watch_item,
+                output_dir=ws.output_dir,
+                shard_idx=shard_idx,
+                shard_num=shard_num,
+            )
+            print("\n[End]Finish checking. Partial result saved to '%s'" % os.path.abspath(output_path))
+        else:
+            output_path = check_runner.save_checker_result(
+                checker=checker,
+                watch_item=watch_item,
+                output_dir=ws.output_dir,
+            )
+            print("\n[End]Finish checking. Result saved to '%s'" % os.path.abspath(output_path))
+        metrics_path = check_runner.save_checker_metrics(
             checker=checker,
             watch_item=watch_item,
             output_dir=ws.output_dir,
+            ext=shard_ext + ".parquet",
+        )
+        if len(metrics_path) > 0:
+            print("[End]Metrics saved to '%s'" % os.path.abspath(metrics_path))
+        check_runner.record_throughput(
+            ws.output_dir, time.perf_counter() - item_start_time, checker.fetched_rev_num, checker.fetched_byte_num
+        )
+
+    if loudness_index is not None:
+        loudness_index.close()
+    print("[P4]%s" % check_runner.get_throttle(ws).get_summary())
+
+
+def start_history_app(ws: WatchSetting):
+    from utils.diff_checker import WavMetricsCache
+
+    p4_client = check_runner.create_p4_client(ws)
+    loudness_index = check_runner.open_loudness_index(ws)
+    analysis_scheduler = check_runner.create_analysis_scheduler(ws)
+    # revs shared by watch items are loaded once
+    metrics_cache = WavMetricsCache()
+    for watch_item in ws.watch_item_list:
+        print("[Start]Start checking history of '%s'" % watch_item.name)
+        checker = check_runner.create_checker(
+            watch_item=watch_item,
+            p4_client=p4_client,
+            check_rules=list(),
+            loudness_index=loudness_index,
+            load_changes_flag=False,
+        )
+        checker.set_history_mode(True)
+        checker.set_metrics_cache(metrics_cache)
+        checker.set_analysis_scheduler(analysis_scheduler)
+        # every rev is listed from p4, index is used for metrics only
+        for change_num, change_total in checker.load_changes(
+            p4_client=p4_client,
+            base_dir=watch_item.path,
+            begin_stamp=watch_item.prev_stamp,
+            end_stamp=watch_item.curr_stamp,
+            file_ext=".wav",
+        ):
+            print("\r[Listing][Change %d/%d]" % (change_num, change_total), end="")
+        for done, total in checker.check_history(p4_client):
+            print("\r[Checking][%d/%d]" % (done, total), end="")
+        output_path = check_runner.save_history_result(checker, watch_item, ws.output_dir)
+        print("\n[End]%d loudness jump(s) found. Result saved to '%s'" % (
+            len(checker.history_jump_logs), os.path.abspath(output_path)
+        ))
+
+    if loudness_index is not None:
+        loudness_index.close()
+    print("[P4]%s" % check_runner.get_throttle(ws).get_summary())
+
+
+def start_dry_run_app(ws: WatchSetting, resume: bool = False):
+    p4_client = check_runner.create_p4_client(ws)
+    loudness_index = check_runner.open_loudness_index(ws)
+    estimates = list[check_runner.CheckEstimate]()
+    for watch_item in ws.watch_item_list:
+        # journal of the run to resume, opened read only
+        journal_path = check_runner.get_output_path(watch_item, ws.output_dir, ext=".journal")
+        journal = CheckJournal(journal_path, resume=True) if resume and os.path.exists(journal_path) else None
+        estimate = check_runner.estimate_check_cost(
+            watch_item, p4_client, ws.output_dir, loudness_index=loudness_index, journal=journal
         )
-        print("\n[End]Finish checking. Result saved to '%s'" % os.path.abspath(output_path))
+        if journal is not None:
+            journal.close()
+        estimates.append(estimate)
+        print("[Dry run]'%s': %s, changes listed in %.1fs" % (
+            watch_item.name, estimate.get_summary(), estimate.discovery_seconds
+        ))
+
+    if loudness_index is not None:
+        loudness_index.close()
+    check_seconds = [estimate.check_seconds for estimate in estimates]
+    if None in check_seconds:
+        print("[Dry run]No throughput recorded in '%s' yet, run a check to estimate time" % os.path.abspath(
+            os.path.join(ws.output_dir, check_runner.THROUGHPUT_FILE_NAME)
+        ))
+    else:
+        print("[Dry run]Estimated time %s by recorded throughput" % time.strftime(
+            "%H:%M:%S", time.gmtime(sum(check_seconds))
+        ))
+    print("[P4]%s" % check_runner.get_throttle(ws).get_summary())
+
+
+def start_index_app(ws: WatchSetting):
+    if len(ws.loudness_index_path) == 0:
+        ws.loudness_index_path = os.path.join(ws.output_dir, "loudness_index.db")
+    p4_client = check_runner.create_p4_client(ws)
+    loudness_index = check_runner.open_loudness_index(ws)
+    for watch_item in ws.watch_item_list:
+        print("[Index]Start indexing '%s'" % watch_item.path)
+        for done, total in check_runner.update_loudness_index(
+            loudness_index, watch_item.path, p4_client, clean_mode=not ws.disable_clean_mode
+        ):
+            print("\r[Index][%d/%d]" % (done, total), end="")
+        print("\n[Index]'%s' is indexed to change %d" % (
+            watch_item.path, loudness_index.get_last_change_id(watch_item.path)
+        ))
+    print("[Index]%d revision(s) in '%s'" % (len(loudness_index), os.path.abspath(ws.loudness_index_path)))
+    loudness_index.close()
+
+
+def start_merge_app(ws: WatchSetting, partial_paths: list[str]):
+    if len(partial_paths) == 0:
+        print("[Merge]No partial result given")
+        return
+    for output_path in check_runner.merge_partial_results(partial_paths, ws.output_dir):
+        print("[Merge]Result saved to '%s'" % os.path.abspath(output_path))
+
+
+def start_daemon_app(ws: WatchSetting, poll_interval: float):
+    from utils.watch_daemon import WatchDaemon
+
+    WatchDaemon(ws, poll_interval=poll_interval).run()
+
+
+def start_server_app(ws: WatchSetting, port: int):
+    from utils.check_server import create_check_server
+
+    server = create_check_server(ws, port=port)
+    print("[Server]Listening on http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[Server]Stopped")
+    finally:
+        server.server_close()
+        print("[P4]%s" % check_runner.get_throttle(ws).get_summary())
 
 
 if __name__ == '__main__':
@@ -86,8 +294,21 @@ if __name__ == '__main__':
             item.curr_stamp = args.curr
     watch_setting.disable_clean_mode = not args.clean_mode
 
-    if args.no_gui:
-        start_console_app(watch_setting)
+    if args.command == "merge":
+        start_merge_app(watch_setting, args.partial_paths)
+    elif args.command == "index":
+        start_index_app(watch_setting)
+    elif args.history:
+        start_history_app(watch_setting)
+    elif args.dry_run:
+        start_dry_run_app(watch_setting, resume=args.resume)
+    elif args.serve:
+        start_server_app(watch_setting, args.port)
+    elif args.daemon:
+        start_daemon_app(watch_setting, args.poll_interval)
+    elif args.no_gui or args.shard is not None:
+        # partial result of shard is saved by console mode only
+        start_console_app(watch_setting, resume=args.resume, shard=args.shard)
     else:
         start_gui_app(watch_setting, USER_CONFIG_PATH)
 
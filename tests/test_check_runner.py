@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from test_check_server import FakeP4, FakeP4Client
+from utils import check_runner
+from utils.watch_setting import WatchItem
+
+
+# files of two dirs changed by several changes, some get louder, one is deleted
+def create_fake_p4() -> FakeP4:
+    changes = dict[int, list[tuple[str, str, int, float]]]()
+    changes[1] = [("//depot/Audio/%s/f%d.wav" % (sub_dir, i), "add", 1, 0.1) for sub_dir in "ab" for i in range(6)]
+    changes[2] = [("//depot/Audio/a/f%d.wav" % i, "edit", 2, 0.1 + 0.1 * i) for i in range(0, 6, 2)]
+    changes[3] = [("//depot/Audio/b/f%d.wav" % i, "edit", 2, 0.5) for i in range(1, 6, 2)]
+    changes[4] = [("//depot/Audio/a/f1.wav", "delete", 2, 0.0), ("//depot/Audio/a/f2.wav", "edit", 3, 0.8)]
+    return FakeP4(changes)
+
+
+class ShardMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.p4_client = FakeP4Client(create_fake_p4())
+        self.watch_item = WatchItem("Audio", "//depot/Audio/", "2", "")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # check watch item, only records of shard are checked if shard is given
+    def run_check(self, shard_idx: int = 0, shard_num: int = 1):
+        checker = check_runner.create_checker(self.watch_item, self.p4_client, check_runner.get_check_rules())
+        checker.set_print_dir(self.temp_dir.name)
+        if shard_num > 1:
+            checker.apply_shard(shard_idx, shard_num)
+        for _ in checker.check(self.p4_client):
+            pass
+        return checker
+
+    def test_merged_shards_equal_unsharded(self):
+        output_dir = os.path.join(self.temp_dir.name, "output")
+        unsharded_path = check_runner.save_checker_result(self.run_check(), self.watch_item, output_dir)
+        with open(unsharded_path, "rb") as f:
+            unsharded_bytes = f.read()
+        os.remove(unsharded_path)
+
+        shard_num = 3
+        partial_paths = list[str]()
+        shard_file_num = 0
+        for shard_idx in range(shard_num):
+            checker = self.run_check(shard_idx, shard_num)
+            shard_file_num += len(checker)
+            partial_paths.append(check_runner.save_checker_partial(
+                checker, self.watch_item, output_dir, shard_idx, shard_num
+            ))
+        self.assertEqual(shard_file_num, len(self.run_check()))
+
+        # partials are merged in any order
+        merged_paths = check_runner.merge_partial_results(list(reversed(partial_paths)), output_dir)
+        self.assertEqual(merged_paths, [unsharded_path])
+        with open(merged_paths[0], "rb") as f:
+            self.assertEqual(f.read(), unsharded_bytes)
+        self.assertIn(b"//depot/Audio/", unsharded_bytes)
+
+    def test_merge_rejects_duplicate_shard(self):
+        output_dir = os.path.join(self.temp_dir.name, "output")
+        partial_path = check_runner.save_checker_partial(self.run_check(0, 2), self.watch_item, output_dir, 0, 2)
+        with self.assertRaises(ValueError):
+            check_runner.merge_partial_results([partial_path, partial_path], output_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
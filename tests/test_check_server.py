@@ -0,0 +1,137 @@
+import os
+import sys
+import threading
+import contextlib
+import unittest
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.p4 import P4Client
+from utils.watch_setting import WatchItem
+from utils.check_server import CheckJobQueue, ServerCheckJob
+
+
+JOB_TIMEOUT = 30.0
+SAMPLE_RATE = 8000
+
+
+# in memory depot answering the p4 commands of a check, revs are printed as sine wavs
+class FakeP4(object):
+
+    def __init__(self, changes: dict[int, list[tuple[str, str, int, float]]]):
+        # change id -> [(depot path, action, rev id, amplitude)]
+        self.changes = changes
+        self.client = "fake_client"
+        self.commands = list[str]()
+
+    @contextlib.contextmanager
+    def at_exception_level(self, level: int):
+        yield
+
+    def run(self, cmd: str, *args) -> list:
+        self.commands.append(cmd)
+        if cmd == "changes":
+            begin_id = int(args[list(args).index("-e") + 1]) if "-e" in args else 0
+            return [
+                {"change": str(change_id)} for change_id in sorted(self.changes, reverse=True) if change_id >= begin_id
+            ]
+        if cmd == "describe":
+            change_id = int(args[-1])
+            files = self.changes[change_id]
+            return [{
+                "change": str(change_id),
+                "user": "user",
+                "client": self.client,
+                "time": str(1678939200 + change_id),
+                "desc": "change %d" % change_id,
+                "depotFile": [depot_path for depot_path, _, _, _ in files],
+                "action": [action for _, action, _, _ in files],
+                "type": ["binary"] * len(files),
+                "rev": [str(rev_id) for _, _, rev_id, _ in files],
+            }]
+        if cmd == "print":
+            local_path = args[list(args).index("-o") + 1]
+            depot_path, rev_id = args[-1].split("#")
+            for files in self.changes.values():
+                for file_path, action, file_rev_id, amplitude in files:
+                    if file_path == depot_path and file_rev_id == int(rev_id) and action != "delete":
+                        t = np.arange(SAMPLE_RATE // 4) / SAMPLE_RATE
+                        sf.write(local_path, amplitude * np.sin(2 * np.pi * 440 * t), SAMPLE_RATE)
+            return []
+        raise ValueError("Unexpected p4 command: %s" % cmd)
+
+
+class FakeP4Client(P4Client):
+
+    # no connection, commands are answered by fake p4
+    def __init__(self, fake_p4: FakeP4):
+        self.p4 = fake_p4
+        self.throttle = None
+        self.change_cache = None
+
+
+class CheckJobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        # a.wav is 14dB louder in change 2, b.wav keeps its volume
+        self.fake_p4 = FakeP4({
+            1: [("//depot/Audio/a.wav", "add", 1, 0.1), ("//depot/Audio/b.wav", "add", 1, 0.2)],
+            2: [("//depot/Audio/a.wav", "edit", 2, 0.5), ("//depot/Audio/b.wav", "edit", 2, 0.2)],
+        })
+        # workers wait until the test releases them, so submitted jobs stay in flight
+        self.worker_released = threading.Event()
+        self.job_queue = CheckJobQueue(p4_client_factory=self.create_p4_client, max_workers=1)
+
+    def tearDown(self):
+        self.worker_released.set()
+        self.job_queue.shutdown()
+
+    def create_p4_client(self) -> P4Client:
+        self.worker_released.wait(JOB_TIMEOUT)
+        return FakeP4Client(self.fake_p4)
+
+    # block until job is done
+    def wait_job(self, job: ServerCheckJob):
+        version = job.version
+        while not job.is_done:
+            new_version = job.wait_update(version, JOB_TIMEOUT)
+            self.assertNotEqual(new_version, version, "Job %s timed out" % job.job_id)
+            version = new_version
+
+    def test_submit_dedup_and_result(self):
+        watch_item = WatchItem("Audio", "//depot/Audio/", "2", "")
+        job, created_flag = self.job_queue.submit(watch_item)
+        self.assertTrue(created_flag)
+
+        # identical in-flight job is returned instead of a new one
+        same_job, created_flag = self.job_queue.submit(WatchItem("Audio Again", "//depot/Audio/", "2", ""))
+        self.assertIs(same_job, job)
+        self.assertFalse(created_flag)
+        other_job, created_flag = self.job_queue.submit(WatchItem("Audio", "//depot/Audio/", "1", ""))
+        self.assertIsNot(other_job, job)
+        self.assertTrue(created_flag)
+
+        self.worker_released.set()
+        self.wait_job(job)
+        self.assertEqual(job.status, ServerCheckJob.STATUS_FINISHED, job.error)
+        self.assertEqual(len(job.result["files"]), 2)
+        dBFS_log = job.result["log"].split("[Resource dBFS diff too large]")[1].split("\n\n")[0]
+        self.assertIn("//depot/Audio/a.wav", dBFS_log)
+        self.assertNotIn("//depot/Audio/b.wav", dBFS_log)
+
+        # revs are printed, workspace is never synced
+        self.assertIn("print", self.fake_p4.commands)
+        self.assertNotIn("sync", self.fake_p4.commands)
+
+        # finished job is not deduplicated
+        self.wait_job(other_job)
+        new_job, created_flag = self.job_queue.submit(watch_item)
+        self.assertIsNot(new_job, job)
+        self.assertTrue(created_flag)
+
+
+if __name__ == '__main__':
+    unittest.main()
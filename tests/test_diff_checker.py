@@ -0,0 +1,183 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from test_check_server import FakeP4, FakeP4Client
+from utils import check_runner, diff_checker
+from utils.p4 import FileChangeInfo
+from utils.diff_checker import DiffChecker, FileDiffRecord, FileDiffRecordStore
+
+
+class FileDiffRecordStoreTest(unittest.TestCase):
+
+    def test_records_round_trip(self):
+        records = [
+            FileDiffRecord("//depot/Audio/a.wav"),
+            FileDiffRecord("//depot/Audio/b.wav"),
+            FileDiffRecord("//depot/Audio/Sub/a.wav"),
+            FileDiffRecord("//depot/Main/Audio/c.wav", "//depot/Release/Audio/c.wav"),
+            FileDiffRecord("//depot/root.wav"),
+        ]
+        for rev_id, record in enumerate(records):
+            record.prev_rev_id = rev_id
+            record.curr_rev_id = rev_id + 2
+        store = FileDiffRecordStore.from_records(records)
+
+        self.assertEqual(len(store), len(records))
+        self.assertEqual(list(store.keys()), [record.path for record in records])
+        for record, (path, stored_record) in zip(records, store.items()):
+            self.assertEqual(path, record.path)
+            self.assertEqual(stored_record.path, record.path)
+            self.assertEqual(stored_record.prev_path, record.prev_path)
+            self.assertEqual(stored_record.prev_rev_id, record.prev_rev_id)
+            self.assertEqual(stored_record.curr_rev_id, record.curr_rev_id)
+            self.assertEqual(stored_record.get_side_revs(), record.get_side_revs())
+            self.assertIn(record.path, store)
+
+        # stored records copied into another store keep their paths and revs
+        copied_store = FileDiffRecordStore.from_records(reversed(list(store.values())))
+        self.assertEqual(list(copied_store.keys()), [record.path for record in reversed(records)])
+        self.assertEqual(
+            [record.get_side_revs() for record in copied_store.values()],
+            [record.get_side_revs() for record in reversed(records)],
+        )
+
+    def test_dir_ids_and_names(self):
+        store = FileDiffRecordStore()
+        store["//depot/Audio/a.wav"] = FileDiffRecord("//depot/Audio/a.wav")
+        store["//depot/Audio/b.wav"] = FileDiffRecord("//depot/Audio/b.wav")
+        store["//depot/Audio/Sub/a.wav"] = FileDiffRecord("//depot/Audio/Sub/a.wav")
+        store["//depot/Audio/c.wav"] = FileDiffRecord("//depot/Audio/c.wav")
+
+        # files of the same dir share the dir, files of the same name in different dirs do not share records
+        self.assertEqual(store.dirs, ["//depot/Audio/", "//depot/Audio/Sub/"])
+        self.assertEqual(list(store.dir_ids), [0, 0, 1, 0])
+        self.assertEqual(store.names, ["a.wav", "b.wav", "a.wav", "c.wav"])
+        self.assertEqual(store.get_idx("//depot/Audio/Sub/a.wav"), 2)
+        self.assertEqual(store.get_idx("//depot/Audio/a.wav"), 0)
+        self.assertEqual(store.get_idx("//depot/Audio/Sub/b.wav"), -1)
+        self.assertEqual(store.get_idx("//depot/Other/a.wav"), -1)
+        self.assertNotIn("//depot/Audio/Sub/b.wav", store)
+        with self.assertRaises(KeyError):
+            _ = store["//depot/Other/a.wav"]
+
+        # setting a stored path again updates its record
+        record = FileDiffRecord("//depot/Audio/Sub/a.wav", "//depot/Release/Sub/a.wav")
+        record.prev_rev_id, record.curr_rev_id = 3, 5
+        store[record.path] = record
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store[record.path].get_side_revs(), [("//depot/Release/Sub/a.wav", 3), (record.path, 5)])
+        store[record.path] = FileDiffRecord(record.path)
+        self.assertEqual(store[record.path].prev_path, record.path)
+
+    def test_version_forward(self):
+        store = FileDiffRecordStore()
+        stored_record = None
+        records = dict[str, FileDiffRecord]()
+        for depot_path, rev_id in [
+            ("//depot/Audio/a.wav", 3), ("//depot/Audio/Sub/a.wav", 1), ("//depot/Audio/a.wav", 5),
+            ("//depot/Audio/a.wav", 2), ("//depot/Audio/Sub/a.wav", 4),
+        ]:
+            file_change_info = FileChangeInfo(depot_path, "edit", "binary", rev_id)
+            store.version_forward(file_change_info)
+            if depot_path not in records:
+                records[depot_path] = FileDiffRecord(depot_path)
+            records[depot_path].version_forward(file_change_info)
+        for path, record in records.items():
+            stored_record = store[path]
+            self.assertEqual(stored_record.get_side_revs(), record.get_side_revs())
+
+        # record views write revs into store
+        stored_record.curr_rev_id = 9
+        self.assertEqual(store["//depot/Audio/Sub/a.wav"].curr_rev_id, 9)
+
+    def test_wav_infos_of_stored_records(self):
+        fake_p4 = FakeP4({
+            1: [("//depot/Audio/a.wav", "add", 1, 0.1), ("//depot/Audio/Sub/a.wav", "add", 1, 0.2)],
+            2: [("//depot/Audio/a.wav", "edit", 2, 0.5), ("//depot/Audio/Sub/a.wav", "edit", 2, 0.2)],
+        })
+        p4_client = FakeP4Client(fake_p4)
+        checker = DiffChecker()
+        records = [FileDiffRecord("//depot/Audio/a.wav"), FileDiffRecord("//depot/Audio/Sub/a.wav")]
+        for record in records:
+            record.prev_rev_id, record.curr_rev_id = 1, 2
+        store = FileDiffRecordStore.from_records(records)
+
+        with tempfile.TemporaryDirectory() as print_dir:
+            checker.set_print_dir(print_dir)
+            wav_info_pairs = checker.load_wavs_of_records(p4_client, list(store.values()))
+            expected_pairs = checker.load_wavs_of_records(p4_client, records)
+        for stored_record, wav_info_pair, expected_pair in zip(store.values(), wav_info_pairs, expected_pairs):
+            for (depot_path, rev_id), wav_info, expected_wav_info in zip(
+                stored_record.get_side_revs(), wav_info_pair, expected_pair
+            ):
+                self.assertTrue(wav_info.available)
+                self.assertEqual((wav_info.depot_path, wav_info.rev_id), (depot_path, rev_id))
+                self.assertEqual(list(wav_info.dBFS), list(expected_wav_info.dBFS))
+        # a.wav got louder, Sub/a.wav did not
+        self.assertGreater(wav_info_pairs[0][1].dBFS[0], wav_info_pairs[0][0].dBFS[0] + 10)
+        self.assertAlmostEqual(wav_info_pairs[1][1].dBFS[0], wav_info_pairs[1][0].dBFS[0], places=3)
+
+
+class StreamCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        # changes are listed from new to old, so files are first seen in another order than record order
+        changes = dict[int, list[tuple[str, str, int, float]]]()
+        changes[1] = [("//depot/Audio/f%d.wav" % i, "add", 1, 0.1) for i in range(8)]
+        changes[2] = [("//depot/Audio/f%d.wav" % i, "edit", 2, 0.1 + 0.1 * i) for i in range(7, 0, -2)]
+        changes[3] = [("//depot/Audio/Sub/g%d.wav" % i, "add", 1, 0.3) for i in range(3)]
+        changes[4] = [("//depot/Audio/f2.wav", "edit", 2, 0.6), ("//depot/Audio/Sub/g1.wav", "delete", 2, 0.0)]
+        changes[5] = [("//depot/Audio/f0.wav", "edit", 2, 0.05), ("//depot/Audio/f7.wav", "edit", 3, 0.1)]
+        self.p4_client = FakeP4Client(FakeP4(changes))
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_checker(self) -> DiffChecker:
+        checker = DiffChecker()
+        checker.add_rules(check_runner.get_check_rules())
+        checker.set_print_dir(self.temp_dir.name)
+        return checker
+
+    # records, metrics rows, rule logs and log of a finished check
+    @staticmethod
+    def get_results(checker: DiffChecker) -> tuple:
+        return (
+            [record.get_side_revs() for record in checker.file_diff_record_map.values()],
+            [checker.metrics_builder.get_row(row_idx) for row_idx in range(len(checker.metrics_builder))],
+            checker.file_rule_logs,
+            checker.get_log(),
+        )
+
+    def test_stream_check_order(self):
+        checker = self.create_checker()
+        for _ in checker.load_changes(self.p4_client, "//depot/Audio/", "", "", ".wav"):
+            pass
+        for _ in checker.check(self.p4_client):
+            pass
+        expected_results = self.get_results(checker)
+        self.assertEqual(len(checker), 11)
+        self.assertIn("//depot/Audio/f7.wav", expected_results[3])
+
+        # one batch, and batches smaller than the change set
+        for batch_size in [diff_checker.CHECK_BATCH_SIZE, 3]:
+            with mock.patch.object(diff_checker, "CHECK_BATCH_SIZE", batch_size):
+                checker = self.create_checker()
+                checked_file_idxs = [
+                    file_idx
+                    for _, _, file_idx in checker.stream_check(self.p4_client, "//depot/Audio/", "", "", ".wav")
+                    if file_idx >= 0
+                ]
+            self.assertEqual(sorted(checked_file_idxs), list(range(11)))
+            self.assertEqual(self.get_results(checker), expected_results)
+
+
+if __name__ == '__main__':
+    unittest.main()
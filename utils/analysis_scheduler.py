@@ -0,0 +1,74 @@
+# schedule analysis of files against a memory budget
+# jobs are fetched one by one in the calling thread (p4 client is not shared between threads),
+# then analysed in worker threads, a job holds its estimated memory from fetching until it is analysed
+# the largest pending job starts first to reduce tail latency, while it waits for memory,
+# the smallest pending jobs fill the capacity it can not use
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable
+
+
+class AnalysisScheduler(object):
+
+    def __init__(self, worker_num: int = 2, memory_budget: int = 2 << 30):
+        self.worker_num = max(1, worker_num)
+        self.memory_budget = memory_budget
+        self.used_memory = 0
+        self.fill_memory = 0        # memory of running jobs started to fill capacity
+        self.peak_used_memory = 0
+
+    # job fits in the remaining budget, a job larger than the whole budget runs alone
+    def _fits(self, memory: int) -> bool:
+        return self.used_memory + memory <= self.memory_budget or self.used_memory == 0
+
+    # small job may start while the largest job waits, if the largest job still fits when other jobs finish
+    def _fits_beside(self, memory: int, waiting_memory: int) -> bool:
+        return self._fits(memory) and self.fill_memory + memory + waiting_memory <= self.memory_budget
+
+    # job_memories[i]: estimated memory of job i, in bytes
+    # fetch_func(job idx) -> fetched data, called in this thread
+    # analyse_func(job idx, fetched data) -> result, called in worker threads
+    # yield (job idx, result) in completion order
+    def run(
+        self,
+        job_memories: list[int],
+        fetch_func: Callable[[int], any],
+        analyse_func: Callable[[int, any], any],
+    ):
+        pending_jobs = deque(sorted(range(len(job_memories)), key=lambda job_idx: -job_memories[job_idx]))
+        # future -> (job idx, started to fill capacity)
+        running_jobs = dict[Future, tuple[int, bool]]()
+        self.used_memory = 0
+        self.fill_memory = 0
+        self.peak_used_memory = 0
+
+        with ThreadPoolExecutor(max_workers=self.worker_num) as executor:
+            while len(pending_jobs) > 0 or len(running_jobs) > 0:
+                # fetched jobs waiting for workers are bounded, so fetching does not run far ahead of analysis
+                job_idx, fill_flag = -1, False
+                if len(pending_jobs) > 0 and len(running_jobs) < self.worker_num * 2:
+                    if self._fits(job_memories[pending_jobs[0]]):
+                        job_idx = pending_jobs.popleft()
+                    elif self._fits_beside(job_memories[pending_jobs[-1]], job_memories[pending_jobs[0]]):
+                        job_idx, fill_flag = pending_jobs.pop(), True
+
+                if job_idx >= 0:
+                    self.used_memory += job_memories[job_idx]
+                    self.fill_memory += job_memories[job_idx] if fill_flag else 0
+                    self.peak_used_memory = max(self.peak_used_memory, self.used_memory)
+                    fetched = fetch_func(job_idx)
+                    running_jobs[executor.submit(analyse_func, job_idx, fetched)] = (job_idx, fill_flag)
+                    done_futures = [future for future in running_jobs if future.done()]
+                else:
+                    done_futures, _ = wait(running_jobs, return_when=FIRST_COMPLETED)
+
+                for future in done_futures:
+                    done_job_idx, done_fill_flag = running_jobs.pop(future)
+                    self.used_memory -= job_memories[done_job_idx]
+                    self.fill_memory -= job_memories[done_job_idx] if done_fill_flag else 0
+                    yield done_job_idx, future.result()
+
+    def get_summary(self) -> str:
+        return "%d worker(s), peak estimated memory %.1f MB of %.1f MB budget" % (
+            self.worker_num, self.peak_used_memory / 1e6, self.memory_budget / 1e6
+        )
@@ -1,19 +1,38 @@
+import time
+from typing import Optional
+
 from PySide6.QtCore import QThread, Signal
 
 
+# 分阶段进度，task_worker yield此类型时更新当前阶段进度，不作为task结果发送
+class TaskProgress(object):
+
+    def __init__(self, phase: str, done: int, total: int):
+        self.phase = phase      # 阶段名，如"Listing changes"
+        self.done = done
+        self.total = total
+
+    @property
+    def progress(self) -> float:
+        return min(self.done / self.total, 1.0) if self.total > 0 else 0.0
+
+
 class AsyncTaskThread(QThread):
     signal_load_progress = Signal(float)    # emit当前进度，0.0-1.0
-    signal_task_single_result = Signal(list)       # emit一次task结果
+    signal_phase_progress = Signal(str, int, int)      # emit当前阶段进度(阶段名, 完成数, 总数)
+    signal_task_batch_result = Signal(list)       # emit一批task结果，list中每项为一次yield的数据
     signal_load_finish = Signal()
 
     def __init__(
         self,
         task_worker,    # python generator, 每次yield一行数据
         task_args: list,    # task_worker参数
-        task_length: int,   # 任务长度，用于emit进度信息
+        task_length: int,   # 任务长度，用于emit进度信息，task_worker yield过TaskProgress后忽略
         on_progress=None,       # progress更新响应
-        on_task_result=None,    # task单次结果响应
+        on_phase_progress=None,     # 阶段进度更新响应
+        on_task_result=None,    # task批量结果响应
         on_finish=None,         # 完成响应
+        emit_interval: float = 0.1,     # 最小emit间隔(秒)，期间的结果合并为一批发送
         parent=None
     ):
         super(AsyncTaskThread, self).__init__(parent)
@@ -21,17 +40,31 @@ class AsyncTaskThread(QThread):
         self.task_worker = task_worker
         self.task_args = task_args
         self.task_length = task_length
+        self.emit_interval = emit_interval
+
+        # 待发送的结果
+        self.pending_results = list()
+        self.pending_phase_progress: Optional[TaskProgress] = None
+        self.last_emit_time = 0.0
+
+        # 任务状态
+        self.cancelled = False      # 任务被cancel中断
+        self.error: Optional[Exception] = None      # 任务抛出的异常
 
         # 信号connect
         self.progress_emit_flag = False
+        self.phase_progress_emit_flag = False
         self.task_result_emit_flag = False
         self.finish_emit_flag = False
         if on_progress:
             self.progress_emit_flag = True
             self.signal_load_progress.connect(on_progress)
+        if on_phase_progress:
+            self.phase_progress_emit_flag = True
+            self.signal_phase_progress.connect(on_phase_progress)
         if on_task_result:
             self.task_result_emit_flag = True
-            self.signal_task_single_result.connect(on_task_result)
+            self.signal_task_batch_result.connect(on_task_result)
         if on_finish:
             self.finish_emit_flag = True
             self.signal_load_finish.connect(on_finish)
@@ -40,31 +73,65 @@ class AsyncTaskThread(QThread):
         # progress更新signal
         curr_progress = 0.0
         progress_step = 1.0 / (self.task_length + 1e-6)
-        progress_update_step = 0.05
-        prev_progress = curr_progress - progress_update_step
+        phase_reported = False      # yield过TaskProgress后进度只取阶段进度，结果行不再推进进度
+
+        task_generator = self.task_worker(*self.task_args)
+        try:
+            for data in task_generator:
+                if isinstance(data, TaskProgress):
+                    # 阶段进度
+                    curr_progress = data.progress
+                    self.pending_phase_progress = data
+                    phase_reported = True
+                else:
+                    if not phase_reported:
+                        curr_progress += progress_step
 
-        for data in self.task_worker(*self.task_args):
+                    # 缓存task result
+                    if data is not None:    # 返回单个None时不发送
+                        self.pending_results.append(data)
 
-            # progress更新
-            if self.progress_emit_flag:
-                curr_progress += progress_step
-                if curr_progress - prev_progress > progress_update_step - 1e-6:
-                    prev_progress = curr_progress
-                    self.signal_load_progress.emit(curr_progress)
+                # 按时间间隔合并emit
+                if time.perf_counter() - self.last_emit_time >= self.emit_interval:
+                    self.flush(curr_progress)
 
-            # emit task result
-            self.send_data(data)
+                # 协作式cancel，在两次yield之间中断
+                if self.isInterruptionRequested():
+                    self.cancelled = True
+                    break
+        except Exception as e:
+            print("[AsyncTask]Task failed: %s" % e)
+            self.error = e
+        finally:
+            task_generator.close()
 
+        self.flush(curr_progress)
         self.end_task()
 
-    # signal_task_single_result emit一次data
+    # 请求cancel任务，任务在下一次yield后结束
+    def cancel(self):
+        self.requestInterruption()
+
+    # emit缓存的task结果与当前进度
+    def flush(self, curr_progress: float):
+        self.last_emit_time = time.perf_counter()
+        if self.progress_emit_flag:
+            self.signal_load_progress.emit(min(curr_progress, 1.0))
+        if self.pending_phase_progress is not None:
+            if self.phase_progress_emit_flag:
+                phase_progress = self.pending_phase_progress
+                self.signal_phase_progress.emit(phase_progress.phase, phase_progress.done, phase_progress.total)
+            self.pending_phase_progress = None
+        if len(self.pending_results) > 0:
+            self.send_data(self.pending_results)
+            self.pending_results = list()
+
+    # signal_task_batch_result emit一批data
     def send_data(self, data: list):
         if self.task_result_emit_flag:
-            if data is not None:    # 返回单个None时不发送
-                self.signal_task_single_result.emit(data)
+            self.signal_task_batch_result.emit(data)
 
     # emit signal_load_finish信号
     def end_task(self):
         if self.finish_emit_flag:
             self.signal_load_finish.emit()
-
@@ -0,0 +1,94 @@
+# persistent cache of immutable p4 data, shared by all p4 clients in this process
+# - describe of submitted changes: change id -> zlib compressed json of the fields read by ChangeList
+# - time stamp -> id of the last change submitted at or before it, for time stamps in the past
+import json
+import zlib
+import atexit
+import sqlite3
+import threading
+from typing import Optional
+
+
+# fields of p4 describe dict read by ChangeList
+DESCRIBE_FIELDS = ("change", "time", "status", "depotFile", "action", "type", "rev")
+
+
+class ChangeCache(object):
+
+    def __init__(self, path: str, commit_interval: int = 100):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.uncommitted_num = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS describes (
+                change INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS time_stamps (
+                time_stamp TEXT PRIMARY KEY,
+                change INTEGER NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    # cached p4 describe dict of change, None if not cached
+    def get_describe(self, change_id: int) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM describes WHERE change = ?", (change_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row is not None else None
+
+    # cache p4 describe dict, only submitted change is cached
+    def put_describe(self, p4_change_dict: dict):
+        if p4_change_dict.get("status") != "submitted":
+            return
+        data = zlib.compress(json.dumps(
+            {field: p4_change_dict[field] for field in DESCRIBE_FIELDS if field in p4_change_dict},
+            separators=(",", ":"),
+        ).encode("utf-8"))
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO describes VALUES (?, ?)", (int(p4_change_dict["change"]), data)
+            )
+            self._commit_later()
+
+    # cached change id of time stamp, None if not cached
+    def get_time_stamp_change(self, time_stamp: str) -> Optional[int]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT change FROM time_stamps WHERE time_stamp = ?", (time_stamp,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    # time stamp should be in the past, changes submitted later have larger ids and do not affect the result
+    def put_time_stamp_change(self, time_stamp: str, change_id: int):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO time_stamps VALUES (?, ?)", (time_stamp, change_id))
+            self._commit_later()
+
+    def _commit_later(self):
+        self.uncommitted_num += 1
+        if self.uncommitted_num >= self.commit_interval:
+            self.conn.commit()
+            self.uncommitted_num = 0
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+            self.uncommitted_num = 0
+
+
+# cache path -> cache
+_cache_registry = dict[str, ChangeCache]()
+_cache_registry_lock = threading.Lock()
+
+
+# get shared cache of path, flushed when process exits
+def get_change_cache(path: str) -> ChangeCache:
+    with _cache_registry_lock:
+        if path not in _cache_registry:
+            _cache_registry[path] = ChangeCache(path)
+            atexit.register(_cache_registry[path].flush)
+        return _cache_registry[path]
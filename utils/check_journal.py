@@ -0,0 +1,63 @@
+import os
+import json
+from typing import Union
+
+from utils.wav_parser import WavInfo
+
+
+# append-only journal of checked files, one json line per file:
+# {"path": depot path, "prev_rev": int, "curr_rev": int, "prev": metrics, "curr": metrics}
+# metrics are produced by WavInfo.to_metrics
+class CheckJournal(object):
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.entries = dict[str, dict]()
+
+        # load completed entries, or start a new journal
+        if resume and os.path.exists(path):
+            self._load()
+        else:
+            dir_path = os.path.dirname(path)
+            if len(dir_path) > 0 and not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            open(path, "w").close()
+
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be broken if the process was killed while writing
+                    continue
+                self.entries[entry["path"]] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    # get loaded wav infos of given file revs, None if not completed
+    def get(self, depot_path: str, prev_rev_id: int, curr_rev_id: int) -> Union[tuple[WavInfo, WavInfo], None]:
+        entry = self.entries.get(depot_path)
+        if entry is None or entry["prev_rev"] != prev_rev_id or entry["curr_rev"] != curr_rev_id:
+            return None
+        return WavInfo.from_metrics(entry["prev"]), WavInfo.from_metrics(entry["curr"])
+
+    # record a completed file
+    def append(self, depot_path: str, prev_wav_info: WavInfo, curr_wav_info: WavInfo):
+        entry = {
+            "path": depot_path,
+            "prev_rev": prev_wav_info.rev_id,
+            "curr_rev": curr_wav_info.rev_id,
+            "prev": prev_wav_info.to_metrics(),
+            "curr": curr_wav_info.to_metrics(),
+        }
+        self.entries[depot_path] = entry
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,511 @@
+# helpers to run checks of watch items, shared by gui and console mode
+# this module must not import Qt, so console mode starts without loading gui modules
+import os
+import re
+import json
+import time
+from typing import Optional
+from collections import OrderedDict
+
+from utils import p4
+from utils.p4 import P4Client
+from utils.p4_throttle import P4Throttle, get_p4_throttle
+from utils.loudness_index import LoudnessIndex
+from utils.analysis_scheduler import AnalysisScheduler
+from utils.change_cache import ChangeCache, get_change_cache
+from utils.check_journal import CheckJournal
+from utils.watch_setting import WatchSetting, WatchItem
+from utils.wav_parser import METRIC_HEADER, METRIC_DBFS, METRIC_MAX_DBFS, METRIC_BAND_ENERGY, METRIC_TRUE_PEAK
+from utils.diff_checker import DiffChecker, CheckRule, \
+    resource_dBFS_diff_rule, resource_max_dBFS_diff_rule, resource_channel_diff_rule, resource_changed_rule, \
+    resource_band_energy_diff_rule, resource_true_peak_rule
+
+
+THROUGHPUT_FILE_NAME = "throughput.json"
+THROUGHPUT_RUN_NUM = 20     # recent runs kept in throughput file
+
+
+def create_p4_client(watch_setting: WatchSetting) -> P4Client:
+    p4_client = P4Client(
+        port=p4.P4_SERVER if watch_setting.p4_server is None else watch_setting.p4_server,
+        workspace_name=p4.P4_WORKSPACE_NAME
+        if watch_setting.p4_workspace_name is None
+        else watch_setting.p4_workspace_name,
+    )
+    p4_client.set_throttle(get_throttle(watch_setting))
+    p4_client.set_change_cache(open_change_cache(watch_setting, p4_client.p4.port))
+    return p4_client
+
+
+# change cache shared by all p4 clients of watch setting
+# change ids are only unique on one server, so the default cache file is named by server port
+def open_change_cache(watch_setting: WatchSetting, p4_port: str = "") -> ChangeCache:
+    cache_path = watch_setting.change_cache_path
+    if len(cache_path) == 0:
+        port_name = re.sub(r"[^0-9A-Za-z.]+", "_", p4_port).strip("_")
+        cache_path = os.path.join(
+            watch_setting.output_dir, "change_cache_%s.db" % port_name if len(port_name) > 0 else "change_cache.db"
+        )
+    cache_dir = os.path.dirname(cache_path)
+    if len(cache_dir) > 0 and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return get_change_cache(cache_path)
+
+
+# throttle shared by all p4 clients of the server of watch setting
+def get_throttle(watch_setting: WatchSetting) -> P4Throttle:
+    return get_p4_throttle(
+        port=p4.P4_SERVER if watch_setting.p4_server is None else watch_setting.p4_server,
+        max_commands_per_sec=watch_setting.p4_max_commands_per_sec,
+        max_bytes_per_sec=watch_setting.p4_max_bytes_per_sec,
+        max_concurrency=watch_setting.p4_max_concurrency,
+    )
+
+
+# scheduler of parallel analysis of watch setting, None if files are analysed in checking thread
+def create_analysis_scheduler(watch_setting: WatchSetting) -> Optional[AnalysisScheduler]:
+    if watch_setting.analysis_worker_num <= 1:
+        return None
+    return AnalysisScheduler(
+        worker_num=watch_setting.analysis_worker_num,
+        memory_budget=int(watch_setting.analysis_memory_budget_mb * 1024 * 1024),
+    )
+
+
+# check rules except disabled ones, given by rule names (e.g. "resource_band_energy_diff_rule")
+# only metrics required by enabled rules are computed, see DiffChecker.required_metrics
+def get_check_rules(disabled_rules: Optional[list[str]] = None) -> list[CheckRule]:
+    check_rules = [
+        CheckRule(
+            resource_dBFS_diff_rule,
+            "[Resource dBFS diff too large]\nPrev dBFS,Curr dBFS,Path",
+            [METRIC_HEADER, METRIC_DBFS],
+        ),
+        CheckRule(
+            resource_max_dBFS_diff_rule,
+            "[Resource max dBFS diff too large]\nPrev max dBFS,Curr max dBFS,Path",
+            [METRIC_HEADER, METRIC_MAX_DBFS],
+        ),
+        CheckRule(
+            resource_true_peak_rule,
+            "[Resource true peak over ceiling]\nPrev true peak dBTP,Curr true peak dBTP,Path",
+            [METRIC_HEADER, METRIC_TRUE_PEAK],
+        ),
+        CheckRule(
+            resource_band_energy_diff_rule,
+            "[Resource band energy diff too large]\nBand Hz,Prev band dB,Curr band dB,Path",
+            [METRIC_HEADER, METRIC_BAND_ENERGY],
+        ),
+        CheckRule(
+            resource_channel_diff_rule,
+            "[Resource channel num changed]\nPrev channel num,Curr channel num,Path",
+            [METRIC_HEADER],
+        ),
+        CheckRule(
+            resource_changed_rule,
+            "[Resource changed]\nAction,OldRev,NewRev,Path",
+            [METRIC_HEADER],
+        ),
+    ]
+    if disabled_rules is None:
+        return check_rules
+    unknown_rules = set(disabled_rules) - set([check_rule.name for check_rule in check_rules])
+    if len(unknown_rules) > 0:
+        print("[WARNING]Unknown disabled rule(s): %s" % ", ".join(sorted(unknown_rules)))
+    return [check_rule for check_rule in check_rules if check_rule.name not in disabled_rules]
+
+
+def create_checker(
+    watch_item: WatchItem,
+    p4_client: P4Client,
+    check_rules: list[CheckRule],
+    clean_mode: bool = False,
+    loudness_index: Optional[LoudnessIndex] = None,
+    load_changes_flag: bool = True,
+) -> DiffChecker:
+    # build checker
+    checker = DiffChecker(clean_mode=clean_mode)
+    checker.add_rules(check_rules)
+    checker.set_loudness_index(loudness_index)
+
+    # forward with all change list
+    if load_changes_flag:
+        for _ in load_checker_changes(checker, watch_item, p4_client):
+            pass
+
+    return checker
+
+
+# list changes of watch item and check files while listing, see DiffChecker.stream_check
+# yield (listed change num, total change num, checked file idx or -1)
+def stream_check_changes(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    p4_client: P4Client,
+):
+    yield from checker.stream_check(
+        p4_client=p4_client,
+        base_dir=watch_item.path,
+        begin_stamp=watch_item.prev_stamp,
+        end_stamp=watch_item.curr_stamp,
+        file_ext=".wav"
+    )
+
+
+# list changes of watch item into checker, yield (listed change num, total change num)
+# if loudness index of checker covers watch item, only changes after the index are listed to update the index
+# if watch item has compare path, files differing between the two branches are loaded instead of changes
+def load_checker_changes(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    p4_client: P4Client,
+):
+    if len(watch_item.compare_path) > 0:
+        load_checker_branch_diff(checker, watch_item, p4_client)
+        yield 1, 1
+        return
+
+    loudness_index = checker.loudness_index
+    index_root = loudness_index.find_root(watch_item.path) if loudness_index is not None else None
+    if index_root is not None:
+        yield from update_loudness_index(loudness_index, index_root, p4_client, checker.clean_mode)
+        checker.load_changes_from_index(
+            p4_client=p4_client,
+            loudness_index=loudness_index,
+            base_dir=watch_item.path,
+            begin_stamp=watch_item.prev_stamp,
+            end_stamp=watch_item.curr_stamp,
+            file_ext=".wav",
+        )
+        return
+
+    yield from checker.load_changes(
+        p4_client=p4_client,
+        base_dir=watch_item.path,
+        begin_stamp=watch_item.prev_stamp,
+        end_stamp=watch_item.curr_stamp,
+        file_ext=".wav"
+    )
+
+
+# load files differing between compare path at prev stamp and path at curr stamp into checker
+# return num of identical files skipped
+def load_checker_branch_diff(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    p4_client: P4Client,
+) -> int:
+    return checker.load_branch_diff(
+        p4_client=p4_client,
+        base_dir=watch_item.path,
+        compare_dir=watch_item.compare_path,
+        prev_stamp=watch_item.prev_stamp,
+        curr_stamp=watch_item.curr_stamp,
+        file_ext=".wav",
+    )
+
+
+# loudness index of watch setting, None if not enabled
+def open_loudness_index(watch_setting: WatchSetting) -> Optional[LoudnessIndex]:
+    if len(watch_setting.loudness_index_path) == 0:
+        return None
+    index_dir = os.path.dirname(watch_setting.loudness_index_path)
+    if len(index_dir) > 0 and not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    return LoudnessIndex(watch_setting.loudness_index_path)
+
+
+# index changes of base_dir after the last indexed change, yield (done, total)
+def update_loudness_index(
+    loudness_index: LoudnessIndex,
+    base_dir: str,
+    p4_client: P4Client,
+    clean_mode: bool = False,
+):
+    loader = DiffChecker(clean_mode=clean_mode)
+    yield from loudness_index.update(
+        p4_client=p4_client,
+        base_dir=base_dir,
+        load_wav_func=lambda depot_path, rev_id: loader.load_wav_of_rev(p4_client, depot_path, rev_id),
+        file_ext=".wav",
+    )
+
+
+# output file path of watch item, named by watch item name and stamps
+def get_output_path(watch_item: WatchItem, output_dir: str, ext: str = ".csv") -> str:
+    return os.path.join(output_dir, "%s_prev_%s_curr_%s%s" % (
+        watch_item.name,
+        watch_item.prev_stamp.replace(":", "_").replace("/", "_"),
+        watch_item.curr_stamp.replace(":", "_").replace("/", "_"),
+        ext,
+    ))
+
+
+def save_checker_result(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    output_dir: str,
+) -> str:
+    # output result
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_path = get_output_path(watch_item, output_dir)
+    with open(output_path, "w") as f:
+        print(checker.get_log(), file=f)
+
+    return output_path
+
+
+# save loudness jumps and loudness of every rev found by DiffChecker.check_history, named like the result csv
+def save_history_result(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    output_dir: str,
+) -> str:
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_path = get_output_path(watch_item, output_dir, ext="_history.csv")
+    with open(output_path, "w") as f:
+        if len(checker.history_jump_logs) > 0:
+            print("[Resource loudness jump]", file=f)
+            print("Change,Prev rev,Curr rev,Prev dBFS,Curr dBFS,Prev max dBFS,Curr max dBFS,Path", file=f)
+            print("\n".join(checker.history_jump_logs) + "\n", file=f)
+        print("[Resource loudness history]\nPath,Rev,Change,dBFS,Max dBFS", file=f)
+        for path, points in checker.history_points.items():
+            for point in points:
+                print("%s,#%d,%s,%s,%s" % (
+                    path, point.rev_id, point.change_id if point.change_id > 0 else "",
+                    "%.2f" % point.dBFS if point.available else "", "%.2f" % point.max_dBFS if point.available else "",
+                ), file=f)
+
+    return output_path
+
+
+# save per-file metrics of checker as a parquet table, named like the result csv
+# return empty string if metrics are not available
+def save_checker_metrics(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    output_dir: str,
+    ext: str = ".parquet",
+) -> str:
+    if checker.metrics_builder is None:
+        return ""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_path = get_output_path(watch_item, output_dir, ext=ext)
+    try:
+        checker.metrics_builder.write(output_path)
+    except ImportError:
+        print("[WARNING]pyarrow is not installed, metrics export is skipped.")
+        return ""
+
+    return output_path
+
+
+# parse shard arg "i/N" to (i, N), i is 0-based
+def parse_shard(shard_str: str) -> tuple[int, int]:
+    try:
+        shard_idx, shard_num = [int(v) for v in shard_str.split("/")]
+    except ValueError:
+        raise ValueError("Invalid shard: '%s', should be like '0/4'" % shard_str)
+    if shard_num <= 0 or not 0 <= shard_idx < shard_num:
+        raise ValueError("Invalid shard: '%s', index should be in [0, %d)" % (shard_str, shard_num))
+    return shard_idx, shard_num
+
+
+# ext of per-shard output files, e.g. ".shard_0_of_4.jsonl"
+def get_shard_ext(shard_idx: int, shard_num: int, ext: str) -> str:
+    return ".shard_%d_of_%d%s" % (shard_idx, shard_num, ext)
+
+
+# save result of one shard as json lines to be merged by merge_partial_results
+# first line is header of watch item, shard and rules, then one line per checked file:
+# {"idx": record index of unsharded run, "path", "prev_rev", "curr_rev", "logs": {rule name: log line}}
+def save_checker_partial(
+    checker: DiffChecker,
+    watch_item: WatchItem,
+    output_dir: str,
+    shard_idx: int,
+    shard_num: int,
+) -> str:
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_path = get_output_path(watch_item, output_dir, ext=get_shard_ext(shard_idx, shard_num, ".jsonl"))
+    with open(output_path, "w", encoding="utf-8") as f:
+        header = OrderedDict()
+        header["watch_item"] = watch_item.to_dict()
+        header["shard"] = shard_idx
+        header["shard_num"] = shard_num
+        header["rules"] = [{"name": rule.name, "log_header": rule.log_header} for rule in checker.check_rules]
+        f.write(json.dumps(header) + "\n")
+
+        builder = checker.metrics_builder
+        for row_idx, file_diff_record in enumerate(checker.file_diff_record_map.values()):
+            f.write(json.dumps({
+                "idx": checker.get_record_order(row_idx, file_diff_record.path),
+                "path": file_diff_record.path,
+                "prev_rev": builder.columns["prev_rev"][row_idx],
+                "curr_rev": builder.columns["curr_rev"][row_idx],
+                "logs": checker.file_rule_logs[row_idx],
+            }, separators=(",", ":")) + "\n")
+
+    return output_path
+
+
+# merge shard results saved by save_checker_partial into the report of save_checker_result
+# partials of different watch items or stamps are merged separately, return saved report paths
+def merge_partial_results(partial_paths: list[str], output_dir: str) -> list[str]:
+    # (name, prev stamp, curr stamp) -> [header, shard idx set, file entries]
+    groups = OrderedDict()
+    for partial_path in partial_paths:
+        with open(partial_path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            watch_item = WatchItem(**header["watch_item"])
+            group_key = (watch_item.name, watch_item.prev_stamp, watch_item.curr_stamp)
+            if group_key not in groups:
+                groups[group_key] = [header, set[int](), list[dict]()]
+            group_header, shard_idx_set, file_entries = groups[group_key]
+            if header["shard_num"] != group_header["shard_num"] or header["rules"] != group_header["rules"]:
+                raise ValueError("Partial '%s' is not from the same run as other partials" % partial_path)
+            if header["shard"] in shard_idx_set:
+                raise ValueError("Shard %d of '%s' is given twice" % (header["shard"], watch_item.name))
+            shard_idx_set.add(header["shard"])
+            for line in f:
+                file_entries.append(json.loads(line))
+
+    output_paths = list[str]()
+    for header, shard_idx_set, file_entries in groups.values():
+        watch_item = WatchItem(**header["watch_item"])
+        missing_shards = sorted(set(range(header["shard_num"])) - shard_idx_set)
+        if len(missing_shards) > 0:
+            print("[WARNING]Shard(s) %s of '%s' are missing, merged result is incomplete." % (
+                ", ".join([str(shard_idx) for shard_idx in missing_shards]), watch_item.name
+            ))
+
+        # refill rule logs in the order of unsharded run
+        checker = DiffChecker()
+        rule_map = OrderedDict()
+        for rule_info in header["rules"]:
+            rule_map[rule_info["name"]] = CheckRule(lambda prev_wav_info, curr_wav_info: None, rule_info["log_header"])
+        checker.add_rules(list(rule_map.values()))
+        file_entries.sort(key=lambda entry: entry["idx"])
+        for entry in file_entries:
+            for rule_name, rule in rule_map.items():
+                if rule_name in entry["logs"]:
+                    rule.log_info.append(entry["logs"][rule_name])
+
+        output_paths.append(save_checker_result(checker, watch_item, output_dir))
+
+    return output_paths
+
+
+# throughput of finished checks, recorded in output dir as a list of recent runs:
+# {"seconds": run time of watch item, "revs": fetched rev num, "bytes": fetched bytes, "time": finish time}
+def load_throughput(output_dir: str) -> list[dict]:
+    throughput_path = os.path.join(output_dir, THROUGHPUT_FILE_NAME)
+    if not os.path.exists(throughput_path):
+        return list[dict]()
+    try:
+        with open(throughput_path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return list[dict]()
+
+
+# record run time and fetched revs of a finished check, a run without fetching tells nothing about throughput
+def record_throughput(output_dir: str, seconds: float, rev_num: int, byte_num: int):
+    if rev_num == 0:
+        return
+    runs = load_throughput(output_dir)
+    runs.append({
+        "seconds": round(seconds, 3),
+        "revs": rev_num,
+        "bytes": byte_num,
+        "time": time.strftime("%Y/%m/%d:%H:%M:%S"),
+    })
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(os.path.join(output_dir, THROUGHPUT_FILE_NAME), "w") as f:
+        json.dump(runs[-THROUGHPUT_RUN_NUM:], f, indent=4)
+
+
+# estimated seconds of checking rev_num revs of byte_num bytes, None if no throughput is recorded
+# recorded rev rate and byte rate both give an estimate, the larger one is taken
+def estimate_check_time(output_dir: str, rev_num: int, byte_num: int) -> Optional[float]:
+    runs = load_throughput(output_dir)
+    if len(runs) == 0:
+        return None
+    seconds = sum([run["seconds"] for run in runs])
+    run_rev_num = sum([run["revs"] for run in runs])
+    run_byte_num = sum([run["bytes"] for run in runs])
+    return max(
+        rev_num * seconds / run_rev_num,
+        byte_num * seconds / run_byte_num if run_byte_num > 0 else 0.0,
+    )
+
+
+# cost of checking a watch item, estimated from change discovery without fetching audio
+class CheckEstimate(object):
+
+    def __init__(self, watch_item: WatchItem):
+        self.watch_item = watch_item
+        self.file_num = 0
+        self.fetch_rev_num = 0
+        self.fetch_byte_num = 0
+        self.journal_hit_num = 0        # revs of files completed by an interrupted run, skipped when resuming
+        self.index_hit_num = 0          # revs read from loudness index
+        self.discovery_seconds = 0.0
+        self.check_seconds: Optional[float] = None
+
+    def get_summary(self) -> str:
+        return "%d file(s), %d revision(s) to fetch (%.1f MB), cache hits: %d journal, %d index" % (
+            self.file_num, self.fetch_rev_num, self.fetch_byte_num / 1e6, self.journal_hit_num, self.index_hit_num
+        )
+
+
+# list changes of watch item and estimate cost of checking them, no audio is fetched and loudness index is not updated
+# journal: journal of the run to resume, None if not resuming
+def estimate_check_cost(
+    watch_item: WatchItem,
+    p4_client: P4Client,
+    output_dir: str,
+    loudness_index: Optional[LoudnessIndex] = None,
+    journal: Optional[CheckJournal] = None,
+) -> CheckEstimate:
+    estimate = CheckEstimate(watch_item)
+    start_time = time.perf_counter()
+    checker = create_checker(watch_item, p4_client, check_rules=list[CheckRule](), load_changes_flag=False)
+    if len(watch_item.compare_path) > 0:
+        load_checker_branch_diff(checker, watch_item, p4_client)
+    else:
+        for _ in checker.load_changes(
+            p4_client=p4_client,
+            base_dir=watch_item.path,
+            begin_stamp=watch_item.prev_stamp,
+            end_stamp=watch_item.curr_stamp,
+            file_ext=".wav"
+        ):
+            pass
+    estimate.discovery_seconds = time.perf_counter() - start_time
+
+    fetch_revs = list[tuple[str, int]]()
+    for path, file_diff_record in checker.file_diff_record_map.items():
+        estimate.file_num += 1
+        depot_revs = [(depot_path, rev_id) for depot_path, rev_id in file_diff_record.get_side_revs() if rev_id > 0]
+        if journal is not None and \
+                journal.get(path, file_diff_record.prev_rev_id, file_diff_record.curr_rev_id) is not None:
+            estimate.journal_hit_num += len(depot_revs)
+            continue
+        for depot_path, rev_id in depot_revs:
+            if loudness_index is not None and loudness_index.get_metrics(depot_path, rev_id) is not None:
+                estimate.index_hit_num += 1
+            else:
+                fetch_revs.append((depot_path, rev_id))
+
+    # deleted revs have no size and are not fetched
+    file_sizes = p4_client.get_file_sizes(fetch_revs) if len(fetch_revs) > 0 else dict()
+    estimate.fetch_rev_num = len(file_sizes)
+    estimate.fetch_byte_num = sum(file_sizes.values())
+    estimate.check_seconds = estimate_check_time(output_dir, estimate.fetch_rev_num, estimate.fetch_byte_num)
+    return estimate
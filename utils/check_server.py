@@ -0,0 +1,361 @@
+# optional local http/json api of checking, this module must not import Qt
+#
+# POST   /jobs              body: WatchItem dict {"name", "path", "prev_stamp", "curr_stamp", "compare_path"}
+#                           -> 202 job status, identical in-flight job is returned instead of a new one
+# GET    /jobs              -> status of all jobs
+# GET    /jobs/<id>         -> job status, with "result" when finished
+# GET    /jobs/<id>/events  -> streamed json lines of job status until job is done
+# DELETE /jobs/<id>         -> cancel job
+import json
+import tempfile
+import threading
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Optional
+
+from utils import check_runner
+from utils.p4 import P4Client
+from utils.watch_setting import WatchSetting, WatchItem
+from utils.diff_checker import DiffChecker, WavMetricsCache
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_PENDING_JOBS = 64
+MAX_FINISHED_JOBS = 256
+
+
+# checking job submitted by http request
+class ServerCheckJob(object):
+
+    STATUS_PENDING = "Pending"
+    STATUS_RUNNING = "Checking"
+    STATUS_CANCELLED = "Cancelled"
+    STATUS_FAILED = "Failed"
+    STATUS_FINISHED = "Finished"
+
+    def __init__(self, job_id: str, watch_item: WatchItem):
+        self.job_id = job_id
+        self.watch_item = watch_item
+        self.status = self.STATUS_PENDING
+        self.phase = ""
+        self.done = 0
+        self.total = 0
+        self.error = ""
+        self.result: Optional[dict] = None
+        self.cancel_requested = False
+
+        # notified on every status or progress update
+        self.condition = threading.Condition()
+        self.version = 0
+
+    # identical jobs share one key
+    @property
+    def key(self) -> tuple[str, str, str, str]:
+        watch_item = self.watch_item
+        return watch_item.path, watch_item.prev_stamp, watch_item.curr_stamp, watch_item.compare_path
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in [self.STATUS_CANCELLED, self.STATUS_FAILED, self.STATUS_FINISHED]
+
+    def update(self, status: Optional[str] = None, phase: Optional[str] = None, done: int = 0, total: int = 0):
+        with self.condition:
+            if status is not None:
+                self.status = status
+            if phase is not None:
+                self.phase = phase
+                self.done = done
+                self.total = total
+            self.version += 1
+            self.condition.notify_all()
+
+    # block until job is updated after given version or timeout, return current version
+    def wait_update(self, version: int, timeout: float) -> int:
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def to_dict(self, with_result: bool = False) -> dict:
+        job_dict = {
+            "job_id": self.job_id,
+            "watch_item": self.watch_item.to_dict(),
+            "status": self.status,
+            "phase": self.phase,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+        }
+        if with_result and self.result is not None:
+            job_dict["result"] = self.result
+        return job_dict
+
+
+# bounded worker pool running ServerCheckJob, each worker thread has its own p4 connection
+class CheckJobQueue(object):
+
+    def __init__(
+        self,
+        p4_client_factory: Callable[[], P4Client],
+        clean_mode: bool = False,
+        max_workers: int = 2,
+        max_pending_jobs: int = MAX_PENDING_JOBS,
+        disabled_rules: Optional[list[str]] = None,
+    ):
+        self.p4_client_factory = p4_client_factory
+        self.clean_mode = clean_mode
+        self.disabled_rules = disabled_rules
+        self.max_pending_jobs = max_pending_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="CheckJob")
+        self.metrics_cache = WavMetricsCache()
+
+        self.jobs = OrderedDict[str, ServerCheckJob]()
+        self.lock = threading.Lock()
+        self.job_id_counter = itertools.count(1)
+        self.thread_local = threading.local()
+
+    # submit job of watch item, return (job, False) if an identical job is pending or running
+    # return (None, False) if the queue is full
+    def submit(self, watch_item: WatchItem) -> tuple[Optional[ServerCheckJob], bool]:
+        with self.lock:
+            key = (watch_item.path, watch_item.prev_stamp, watch_item.curr_stamp, watch_item.compare_path)
+            pending_num = 0
+            for job in self.jobs.values():
+                if job.is_done:
+                    continue
+                if job.key == key and not job.cancel_requested:
+                    return job, False
+                pending_num += 1
+            if pending_num >= self.max_pending_jobs:
+                return None, False
+
+            job = ServerCheckJob(str(next(self.job_id_counter)), watch_item)
+            self.jobs[job.job_id] = job
+            self._prune_finished_jobs()
+        self.executor.submit(self.run_job, job)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[ServerCheckJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list[ServerCheckJob]:
+        with self.lock:
+            return list(self.jobs.values())
+
+    # pending job is cancelled at once, running job stops after its current file
+    def cancel(self, job: ServerCheckJob):
+        job.cancel_requested = True
+        job.update(status=ServerCheckJob.STATUS_CANCELLED if job.status == ServerCheckJob.STATUS_PENDING else None)
+
+    def shutdown(self):
+        for job in self.list_jobs():
+            self.cancel(job)
+        self.executor.shutdown(wait=True)
+
+    def _prune_finished_jobs(self):
+        finished_ids = [job_id for job_id, job in self.jobs.items() if job.is_done]
+        for job_id in finished_ids[:max(0, len(finished_ids) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    # p4 connection of current worker thread, created on first use and kept for later jobs
+    def _get_p4_client(self) -> P4Client:
+        p4_client = getattr(self.thread_local, "p4_client", None)
+        if p4_client is None:
+            p4_client = self.p4_client_factory()
+            self.thread_local.p4_client = p4_client
+        return p4_client
+
+    # run in worker thread
+    def run_job(self, job: ServerCheckJob):
+        if job.cancel_requested:
+            job.update(status=ServerCheckJob.STATUS_CANCELLED)
+            return
+        job.update(status=ServerCheckJob.STATUS_RUNNING)
+
+        try:
+            p4_client = self._get_p4_client()
+            checker = DiffChecker(clean_mode=self.clean_mode)
+            checker.add_rules(check_runner.get_check_rules(self.disabled_rules))
+            checker.set_metrics_cache(self.metrics_cache)
+
+            # revs are printed into a dir of the job, jobs of workers never share local files
+            with tempfile.TemporaryDirectory(prefix="check_job_") as print_dir:
+                checker.set_print_dir(print_dir)
+
+                for done, total in check_runner.load_checker_changes(checker, job.watch_item, p4_client):
+                    job.update(phase="Listing changes", done=done, total=total)
+                    if job.cancel_requested:
+                        job.update(status=ServerCheckJob.STATUS_CANCELLED)
+                        return
+
+                job.update(phase="Checking", done=0, total=len(checker))
+                for file_idx, _ in checker.check(p4_client, yield_path_flag=True):
+                    job.update(phase="Checking", done=file_idx + 1, total=len(checker))
+                    if job.cancel_requested:
+                        job.update(status=ServerCheckJob.STATUS_CANCELLED)
+                        return
+
+                job.result = {
+                    "log": checker.get_log(),
+                    "files": [
+                        checker.metrics_builder.get_row(row_idx) for row_idx in range(len(checker.metrics_builder))
+                    ],
+                }
+                job.update(status=ServerCheckJob.STATUS_FINISHED)
+        except Exception as e:
+            print("[CheckServer]Job %s failed: %s" % (job.job_id, e))
+            job.error = str(e)
+            job.update(status=ServerCheckJob.STATUS_FAILED)
+
+
+class CheckRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    server: "CheckServer"
+
+    # keep console quiet, one line per request is too noisy for streamed progress
+    def log_message(self, format: str, *args):
+        pass
+
+    def send_json(self, code: int, obj: any):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code: int, message: str):
+        self.send_json(code, {"error": message})
+
+    # split "/jobs/<id>/<action>" to ("<id>", "<action>")
+    def parse_job_path(self) -> Optional[tuple[str, str]]:
+        parts = [part for part in self.path.split("?")[0].split("/") if len(part) > 0]
+        if len(parts) == 0 or parts[0] != "jobs" or len(parts) > 3:
+            return None
+        return (parts[1] if len(parts) > 1 else ""), (parts[2] if len(parts) > 2 else "")
+
+    def do_POST(self):
+        if self.parse_job_path() != ("", ""):
+            self.send_error_json(404, "Not found")
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            item_dict = json.loads(body)
+            watch_item = WatchItem()
+            watch_item.from_dict(item_dict)
+        except (ValueError, TypeError, AttributeError):
+            self.send_error_json(400, "Body should be a WatchItem json object")
+            return
+        if len(watch_item.path) == 0:
+            self.send_error_json(400, "WatchItem path is empty")
+            return
+
+        job, created_flag = self.server.job_queue.submit(watch_item)
+        if job is None:
+            self.send_error_json(503, "Job queue is full")
+            return
+        job_dict = job.to_dict()
+        job_dict["deduplicated"] = not created_flag
+        self.send_json(202, job_dict)
+
+    def do_GET(self):
+        job_path = self.parse_job_path()
+        if job_path is None:
+            self.send_error_json(404, "Not found")
+            return
+        job_id, action = job_path
+        if len(job_id) == 0:
+            self.send_json(200, [job.to_dict() for job in self.server.job_queue.list_jobs()])
+            return
+
+        job = self.server.job_queue.get(job_id)
+        if job is None or action not in ["", "events"]:
+            self.send_error_json(404, "Not found")
+        elif action == "events":
+            self.stream_job_events(job)
+        else:
+            self.send_json(200, job.to_dict(with_result=True))
+
+    def do_DELETE(self):
+        job_path = self.parse_job_path()
+        job = self.server.job_queue.get(job_path[0]) if job_path is not None and job_path[1] == "" else None
+        if job is None:
+            self.send_error_json(404, "Not found")
+            return
+        self.server.job_queue.cancel(job)
+        self.send_json(200, job.to_dict())
+
+    # stream job status as chunked json lines until job is done, the last line has the result
+    def stream_job_events(self, job: ServerCheckJob):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        version = -1
+        try:
+            while True:
+                curr_version = job.wait_update(version, timeout=self.server.event_interval)
+                is_done = job.is_done
+                if curr_version != version or is_done:
+                    self.write_chunk((json.dumps(job.to_dict(with_result=is_done)) + "\n").encode("utf-8"))
+                    version = curr_version
+                if is_done:
+                    break
+                # merge fast updates, at most one line per event interval
+                self.server.sleep_event_interval()
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # client stopped listening, job keeps running
+            self.close_connection = True
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class CheckServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        job_queue: CheckJobQueue,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        event_interval: float = 0.2,
+    ):
+        super(CheckServer, self).__init__((host, port), CheckRequestHandler)
+        self.job_queue = job_queue
+        self.event_interval = event_interval
+        self.stop_event = threading.Event()
+
+    def sleep_event_interval(self):
+        self.stop_event.wait(self.event_interval)
+
+    def server_close(self):
+        self.stop_event.set()
+        super(CheckServer, self).server_close()
+        self.job_queue.shutdown()
+
+
+# create server of watch setting, p4_client_factory can be replaced to run against another p4 backend
+def create_check_server(
+    watch_setting: WatchSetting,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    p4_client_factory: Optional[Callable[[], P4Client]] = None,
+) -> CheckServer:
+    if p4_client_factory is None:
+        p4_client_factory = lambda: check_runner.create_p4_client(watch_setting)
+    job_queue = CheckJobQueue(
+        p4_client_factory=p4_client_factory,
+        clean_mode=not watch_setting.disable_clean_mode,
+        max_workers=watch_setting.max_concurrent_checks,
+        disabled_rules=watch_setting.disabled_rules,
+    )
+    return CheckServer(job_queue, host=host, port=port)
@@ -1,23 +1,45 @@
+import io
 import os
+import zlib
+import shutil
+import tempfile
+import threading
+from array import array
 import numpy as np
-from typing import Callable, Union
+from collections import OrderedDict
+from typing import Callable, Optional, Union
 
 from utils.version import is_release
-from utils.wav_parser import WavInfo
+from utils.wav_parser import WavInfo, OCTAVE_BAND_CENTERS, load_small_wavs
+from utils.wav_parser import METRIC_HEADER, METRIC_DBFS, METRIC_MAX_DBFS, ALL_METRICS
 from utils.p4 import P4Client, ChangeList, FileChangeInfo
+from utils.check_journal import CheckJournal
+from utils.metrics_export import MetricsColumnBuilder
+from utils.loudness_index import LoudnessIndex
+from utils.analysis_scheduler import AnalysisScheduler
 
 
 CLEAN_MODE = True
 DBFS_DIFF_THRESHOLD = 3.0
 LUFS_DIFF_THRESHOLD = 3.0
 MAX_DBFS_DIFF_THRESHOLD = 3.0
+TRUE_PEAK_CEILING_DB = -1.0         # true peak above ceiling may clip after resampling at runtime
+BAND_ENERGY_DIFF_THRESHOLD = 6.0
+BAND_ENERGY_FLOOR_DB = -80.0       # bands below floor in both versions are ignored
+ANALYSIS_MEMORY_PER_FILE_BYTE = 6   # estimated analysis memory per byte of wav file, content + decoded + temp
+HISTORY_METRICS = {METRIC_HEADER, METRIC_DBFS, METRIC_MAX_DBFS}   # metrics of every rev in history mode
+CHECK_BATCH_SIZE = 64               # records loaded and checked in one batch, small wavs of a batch are decoded at once
 
 
 # file diff among versions
+# prev rev is of prev_path, which is path itself unless files of two branches are compared
 class FileDiffRecord(object):
 
-    def __init__(self, path: str):
+    __slots__ = ("path", "prev_path", "prev_rev_id", "curr_rev_id")
+
+    def __init__(self, path: str, prev_path: Optional[str] = None):
         self.path = path
+        self.prev_path = path if prev_path is None else prev_path
         self.prev_rev_id: int = -1
         self.curr_rev_id: int = -1
 
@@ -33,20 +55,208 @@ class FileDiffRecord(object):
     def get_prev_rev_id(rev_id: int) -> int:
         return rev_id - 1 if rev_id > 0 else 0
 
+    # [(prev path, prev rev id), (path, curr rev id)]
+    def get_side_revs(self) -> list[tuple[str, int]]:
+        return [(self.prev_path, self.prev_rev_id), (self.path, self.curr_rev_id)]
+
+
+# FileDiffRecord stored in FileDiffRecordStore, reads and writes revs in columns of store
+class StoredFileDiffRecord(object):
+
+    __slots__ = ("_store", "_idx")
+
+    def __init__(self, store: "FileDiffRecordStore", idx: int):
+        self._store = store
+        self._idx = idx
+
+    @property
+    def path(self) -> str:
+        return self._store.get_path(self._idx)
+
+    @property
+    def prev_path(self) -> str:
+        return self._store.get_prev_path(self._idx)
+
+    @property
+    def prev_rev_id(self) -> int:
+        return self._store.prev_rev_ids[self._idx]
+
+    @prev_rev_id.setter
+    def prev_rev_id(self, rev_id: int):
+        self._store.prev_rev_ids[self._idx] = rev_id
+
+    @property
+    def curr_rev_id(self) -> int:
+        return self._store.curr_rev_ids[self._idx]
+
+    @curr_rev_id.setter
+    def curr_rev_id(self, rev_id: int):
+        self._store.curr_rev_ids[self._idx] = rev_id
+
+    version_forward = FileDiffRecord.version_forward
+    get_prev_rev_id = staticmethod(FileDiffRecord.get_prev_rev_id)
+    get_side_revs = FileDiffRecord.get_side_revs
+
+
+# compact map of depot path -> FileDiffRecord, in insertion order
+# a path is stored as id of its dir in a dir table and its file name, files of a dir are looked up by name,
+# so the dir part (most of a depot path) is stored once per dir instead of once per file
+# revs are stored in int32 columns, prev paths are only stored if not the path (files of two branches are compared)
+# records got from the store are views of the columns, so changes of them are kept
+class FileDiffRecordStore(object):
+
+    def __init__(self):
+        # dir paths with trailing "/", dir path -> dir id, and file name -> record idx of every dir
+        self.dirs = list[str]()
+        self.dir_idx_map = dict[str, int]()
+        self.name_idx_maps = list[dict[str, int]]()
+        # columns of records
+        self.dir_ids = array("i")
+        self.names = list[str]()
+        self.prev_rev_ids = array("i")
+        self.curr_rev_ids = array("i")
+        # record idx -> prev path, for records whose prev path is not path
+        self.prev_path_map = dict[int, str]()
+
+    # build store with records in given order
+    @classmethod
+    def from_records(cls, records) -> "FileDiffRecordStore":
+        store = cls()
+        for record in records:
+            store[record.path] = record
+        return store
+
+    # (dir path with trailing "/", file name)
+    @staticmethod
+    def split_path(path: str) -> tuple[str, str]:
+        name_begin = path.rfind("/") + 1
+        return path[:name_begin], path[name_begin:]
+
+    # record idx of path, -1 if not stored
+    def get_idx(self, path: str) -> int:
+        dir_path, name = self.split_path(path)
+        dir_id = self.dir_idx_map.get(dir_path)
+        return -1 if dir_id is None else self.name_idx_maps[dir_id].get(name, -1)
+
+    def get_path(self, idx: int) -> str:
+        return self.dirs[self.dir_ids[idx]] + self.names[idx]
+
+    def get_prev_path(self, idx: int) -> str:
+        prev_path = self.prev_path_map.get(idx)
+        return self.get_path(idx) if prev_path is None else prev_path
+
+    # record idx of path, record is added with revs -1 if path is not stored
+    def _get_or_add_idx(self, path: str) -> int:
+        # split_path inlined, called for every file action when loading changes
+        name_begin = path.rfind("/") + 1
+        dir_path, name = path[:name_begin], path[name_begin:]
+        dir_id = self.dir_idx_map.get(dir_path)
+        if dir_id is not None:
+            idx = self.name_idx_maps[dir_id].get(name)
+            if idx is not None:
+                return idx
+        else:
+            dir_id = len(self.dirs)
+            self.dir_idx_map[dir_path] = dir_id
+            self.dirs.append(dir_path)
+            self.name_idx_maps.append(dict[str, int]())
+        idx = len(self.names)
+        self.name_idx_maps[dir_id][name] = idx
+        self.dir_ids.append(dir_id)
+        self.names.append(name)
+        self.prev_rev_ids.append(-1)
+        self.curr_rev_ids.append(-1)
+        return idx
+
+    # forward record of file change like FileDiffRecord.version_forward, record is added if path is not stored
+    def version_forward(self, file_change_info: FileChangeInfo):
+        idx = self._get_or_add_idx(file_change_info.depot_path)
+        rev_id = file_change_info.rev
+        prev_rev_id = self.prev_rev_ids[idx]
+        if prev_rev_id == -1 or rev_id <= prev_rev_id:
+            self.prev_rev_ids[idx] = FileDiffRecord.get_prev_rev_id(rev_id)
+        if rev_id > self.curr_rev_ids[idx]:
+            self.curr_rev_ids[idx] = rev_id
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, path: str) -> bool:
+        return self.get_idx(path) >= 0
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, path: str) -> StoredFileDiffRecord:
+        idx = self.get_idx(path)
+        if idx < 0:
+            raise KeyError(path)
+        return StoredFileDiffRecord(self, idx)
+
+    # copy revs of record into store
+    def __setitem__(self, path: str, record: Union[FileDiffRecord, StoredFileDiffRecord]):
+        idx = self._get_or_add_idx(path)
+        if record.prev_path == path:
+            self.prev_path_map.pop(idx, None)
+        else:
+            self.prev_path_map[idx] = record.prev_path
+        self.prev_rev_ids[idx] = record.prev_rev_id
+        self.curr_rev_ids[idx] = record.curr_rev_id
+
+    def keys(self):
+        return (self.get_path(idx) for idx in range(len(self.names)))
+
+    def values(self):
+        return (StoredFileDiffRecord(self, idx) for idx in range(len(self.names)))
+
+    def items(self):
+        return ((self.get_path(idx), StoredFileDiffRecord(self, idx)) for idx in range(len(self.names)))
+
+
+# loudness of one revision of a file in history mode
+class FileRevisionPoint(object):
+
+    __slots__ = ("rev_id", "change_id", "dBFS", "max_dBFS", "available")
+
+    # change_id is 0 for the rev before range
+    def __init__(self, rev_id: int, change_id: int, wav_info: WavInfo):
+        self.rev_id = rev_id
+        self.change_id = change_id
+        self.available = wav_info.available
+        self.dBFS = float(np.mean(wav_info.dBFS)) if wav_info.available else WavInfo.MIN_VOLUME_DB
+        self.max_dBFS = float(np.max(wav_info.max_dBFS)) if wav_info.available else WavInfo.MIN_VOLUME_DB
+
 
 # given a check function to check prev and curr wav info
 # if check function return a not None value, then log the info
+# required_metrics: metrics read by check function (see METRIC_* of wav_parser), None if unknown to require all
 class CheckRule(object):
 
-    def __init__(self, check_func: Callable[[WavInfo, WavInfo], any], log_header: str):
+    def __init__(
+        self,
+        check_func: Callable[[WavInfo, WavInfo], any],
+        log_header: str,
+        required_metrics: Optional[list[str]] = None,
+    ):
         self.check_func = check_func
         self.log_header = log_header
+        self.required_metrics = list(ALL_METRICS) if required_metrics is None else required_metrics
         self.log_info = list[str]()
 
-    def check(self, prev_wav_info: WavInfo, curr_wav_info: WavInfo):
-        result = self.check_func(prev_wav_info, curr_wav_info)
+    @property
+    def name(self) -> str:
+        return self.check_func.__name__
+
+    # return True if the rule is hit
+    def check(self, prev_wav_info: WavInfo, curr_wav_info: WavInfo) -> bool:
+        return self.log_result(self.check_func(prev_wav_info, curr_wav_info))
+
+    # log result of check function, which may be called in another thread, return True if the rule is hit
+    def log_result(self, result: any) -> bool:
         if result is not None:
             self.log_info.append(str(result))
+            return True
+        return False
 
     def get_log(self) -> str:
         if len(self.log_info) == 0:
@@ -54,67 +264,787 @@ class CheckRule(object):
         return "\n".join([self.log_header] + self.log_info)
 
 
+# shard index of depot path, stable across processes and machines
+def get_shard_of_path(depot_path: str, shard_num: int) -> int:
+    return zlib.crc32(depot_path.encode("utf-8")) % shard_num
+
+
+# lru cache of extracted wav metrics, keyed by depot path and rev
+# submitted revisions never change, so cached metrics can be reused across checks
+# the cache may be shared by checkers running in different threads
+class WavMetricsCache(object):
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._metrics)
+
+    def get(self, depot_path: str, rev_id: int) -> Optional[WavInfo]:
+        with self._lock:
+            metrics = self._metrics.get((depot_path, rev_id))
+            if metrics is None:
+                return None
+            self._metrics.move_to_end((depot_path, rev_id))
+        return WavInfo.from_metrics(metrics)
+
+    def put(self, wav_info: WavInfo):
+        metrics = wav_info.to_metrics()
+        with self._lock:
+            self._metrics[(wav_info.depot_path, wav_info.rev_id)] = metrics
+            self._metrics.move_to_end((wav_info.depot_path, wav_info.rev_id))
+            while len(self._metrics) > self.max_size:
+                self._metrics.popitem(last=False)
+
+
 # run check rules with file diff records
 class DiffChecker(object):
 
     def __init__(self, clean_mode: bool = CLEAN_MODE):
-        self.file_diff_record_map = dict[str, FileDiffRecord]()
+        self.file_diff_record_map = FileDiffRecordStore()
         self.check_rules = list[CheckRule]()
+        # metrics computed for every loaded wav, union of metrics required by rules, all metrics without rules
+        self.required_metrics = set(ALL_METRICS)
         self.clean_mode = clean_mode
+        self.journal: Optional[CheckJournal] = None
+        self.metrics_builder: Optional[MetricsColumnBuilder] = None
+        self.metrics_cache: Optional[WavMetricsCache] = None
+        self.loudness_index: Optional[LoudnessIndex] = None
+        self.analysis_scheduler: Optional[AnalysisScheduler] = None
+        # root dir of scratch clients of bulk prefetch, empty to sync files one by one into workspace
+        self.scratch_dir = ""
+        self.prefetch_parallel_threads = 0
+        self.scratch_client_names = list[str]()
+        # (depot path, rev id) -> local path of prefetched revs
+        self.prefetched_paths = dict[tuple[str, int], str]()
+        # dir that revs are printed into instead of syncing into workspace, empty to sync into workspace
+        # checkers sharing a workspace should have their own print dir, or they race on the same local files
+        self.print_dir = ""
+        self.printed_paths = dict[tuple[str, int], str]()
+        self._printed_num = 0
+        # history mode: depot path -> [(rev id, change id)] of every rev in range, None if not in history mode
+        self.file_rev_changes: Optional[dict[str, list[tuple[int, int]]]] = None
+        # results of check_history, depot path -> loudness of every rev, and log lines of loudness jumps
+        self.history_points = dict[str, list[FileRevisionPoint]]()
+        self.history_jump_logs = list[str]()
+        # revs synced from p4 and their bytes, for recording throughput
+        self.fetched_rev_num = 0
+        self.fetched_byte_num = 0
+        # rule name -> log line of every checked file, in check order
+        self.file_rule_logs = list[dict[str, str]]()
+        # depot path -> record index before sharding, None if not sharded
+        self.record_order_map: Optional[dict[str, int]] = None
+        self._rule_log_begin_nums = list[int]()
 
     # add check rules
     def add_rules(self, check_rules: list[CheckRule]):
         self.check_rules.extend(check_rules)
+        self.required_metrics = {METRIC_HEADER}.union(
+            *[check_rule.required_metrics for check_rule in self.check_rules]
+        )
+
+    # keep every rev of files in range for check_history, set before loading changes
+    def set_history_mode(self, history_mode: bool):
+        self.file_rev_changes = dict[str, list[tuple[int, int]]]() if history_mode else None
 
     # forward with change list
     def version_forward(self, change_list: ChangeList):
         for file_change_info in change_list.file_change_list:
-            if file_change_info.depot_path not in self.file_diff_record_map:
-                # build new record
-                self.file_diff_record_map[file_change_info.depot_path] = FileDiffRecord(file_change_info.depot_path)
+            self.file_version_forward(file_change_info)
+            if self.file_rev_changes is not None:
+                self.file_rev_changes.setdefault(file_change_info.depot_path, []).append(
+                    (file_change_info.rev, change_list.id)
+                )
+
+    # forward with one file change
+    def file_version_forward(self, file_change_info: FileChangeInfo):
+        # new record is built if not stored
+        self.file_diff_record_map.version_forward(file_change_info)
+
+    # list changes of base_dir in stamp range and forward records with them in change id order
+    # yield (listed change num, total change num) while listing
+    def load_changes(
+        self,
+        p4_client: P4Client,
+        base_dir: str,
+        begin_stamp: str = "",
+        end_stamp: str = "",
+        file_ext: str = "",
+    ):
+        change_lists = list[ChangeList]()
+        for change_idx, change_total, change_list in p4_client.iter_changes_of_dir(
+            base_dir=base_dir,
+            begin_stamp=begin_stamp,
+            end_stamp=end_stamp,
+            file_ext=file_ext,
+        ):
+            if change_list is not None:
+                change_lists.append(change_list)
+            yield change_idx + 1, change_total
+
+        change_lists.sort(key=lambda c: c.id)
+        for change_list in change_lists:
+            self.version_forward(change_list)
+
+    # forward records with file changes of loudness index instead of listing changes on p4
+    # the index should cover end stamp, see LoudnessIndex.update
+    # time stamps are resolved to change ids by p4 server, so the range has the same changes as load_changes
+    def load_changes_from_index(
+        self,
+        p4_client: P4Client,
+        loudness_index: LoudnessIndex,
+        base_dir: str,
+        begin_stamp: str = "",
+        end_stamp: str = "",
+        file_ext: str = "",
+    ):
+        for file_change_info in loudness_index.get_file_changes(
+            base_dir=base_dir,
+            begin_id=p4_client.get_change_id_of_stamp(begin_stamp),
+            end_id=p4_client.get_change_id_of_stamp(end_stamp, end_flag=True),
+            file_ext=file_ext,
+        ):
+            self.file_version_forward(file_change_info)
+
+    # build records of files differing between two branches, files are matched by path relative to branch dir
+    # prev side is compare_dir before prev_stamp, curr side is base_dir before curr_stamp, empty stamp means head,
+    # stamps select revs as in range mode, see P4Client.get_file_digests
+    # both sides are listed by one fstat each, pairs of the same digest are skipped without fetching,
+    # a file on one side only is compared with rev 0 of the other side
+    # return num of identical pairs skipped
+    def load_branch_diff(
+        self,
+        p4_client: P4Client,
+        base_dir: str,
+        compare_dir: str,
+        prev_stamp: str = "",
+        curr_stamp: str = "",
+        file_ext: str = "",
+    ) -> int:
+        base_dir = base_dir.replace("\\", "/").rstrip("/") + "/"
+        compare_dir = compare_dir.replace("\\", "/").rstrip("/") + "/"
+        # relative path -> (rev id, digest)
+        prev_digests = {
+            depot_path[len(compare_dir):]: rev_digest
+            for depot_path, rev_digest in p4_client.get_file_digests(
+                compare_dir, prev_stamp, file_ext, begin_flag=True
+            ).items()
+        }
+        curr_digests = {
+            depot_path[len(base_dir):]: rev_digest
+            for depot_path, rev_digest in p4_client.get_file_digests(base_dir, curr_stamp, file_ext).items()
+        }
+
+        identical_num = 0
+        for relative_path in sorted(set(prev_digests) | set(curr_digests)):
+            prev_rev_id, prev_digest = prev_digests.get(relative_path, (0, ""))
+            curr_rev_id, curr_digest = curr_digests.get(relative_path, (0, ""))
+            if prev_rev_id > 0 and curr_rev_id > 0 and len(curr_digest) > 0 and prev_digest == curr_digest:
+                identical_num += 1
+                continue
+            file_diff_record = FileDiffRecord(base_dir + relative_path, compare_dir + relative_path)
+            file_diff_record.prev_rev_id = prev_rev_id
+            file_diff_record.curr_rev_id = curr_rev_id
+            self.file_diff_record_map[file_diff_record.path] = file_diff_record
+        return identical_num
+
+    # set scheduler of parallel analysis, None to load and check records batch by batch
+    def set_analysis_scheduler(self, analysis_scheduler: Optional[AnalysisScheduler]):
+        self.analysis_scheduler = analysis_scheduler
+
+    # set root dir of scratch clients, revs to be fetched are prefetched into them in bulk when checking
+    # empty to sync files one by one into workspace
+    def set_scratch_dir(self, scratch_dir: str, parallel_threads: int = 0):
+        self.scratch_dir = scratch_dir
+        self.prefetch_parallel_threads = parallel_threads
+
+    # set dir that revs are printed into, a printed file is removed once loaded
+    # empty to sync files into workspace
+    def set_print_dir(self, print_dir: str):
+        self.print_dir = print_dir
+
+    # sync all revs to be fetched by checking records into scratch clients, one sync and one where per client
+    # prev and curr revs of a file have the same local path in one client, so they are synced into two clients
+    # files are kept until release_prefetch, scratch dir should have space of all fetched revs
+    def prefetch(self, p4_client: P4Client, file_diff_records: list[FileDiffRecord]):
+        side_revs = [list[tuple[str, int]](), list[tuple[str, int]]()]
+        for file_diff_record in file_diff_records:
+            if self._get_journal_wav_infos(file_diff_record) is not None:
+                continue
+            for side_revs_of_side, (depot_path, rev_id) in zip(side_revs, file_diff_record.get_side_revs()):
+                if self.get_wav_of_rev_without_fetch(depot_path, rev_id) is None:
+                    side_revs_of_side.append((depot_path, rev_id))
+
+        depots = sorted(set([depot_path[2:].split("/")[0] for depot_revs in side_revs for depot_path, _ in depot_revs]))
+        for side, depot_revs in zip(["prev", "curr"], side_revs):
+            if len(depot_revs) == 0:
+                continue
+            client_name = "%s_scratch_%s_%d" % (p4_client.p4.client, side, os.getpid())
+            p4_client.save_scratch_client(client_name, os.path.abspath(os.path.join(self.scratch_dir, side)), depots)
+            self.scratch_client_names.append(client_name)
+            with p4_client.use_client(client_name):
+                self.prefetched_paths.update(p4_client.sync_files_of_revs(depot_revs, self.prefetch_parallel_threads))
+        for local_path in self.prefetched_paths.values():
+            self.fetched_rev_num += 1
+            self.fetched_byte_num += os.path.getsize(local_path)
+
+    # sync revs of history into scratch clients, the i-th rev to be fetched of every file goes into the i-th client,
+    # so revs of one file do not share a local path, one sync and one where per client
+    # files are kept until release_prefetch
+    def prefetch_history(self, p4_client: P4Client, history_revs: list[list[tuple[str, int]]]):
+        layer_revs = list[list[tuple[str, int]]]()
+        for depot_revs in history_revs:
+            for layer_idx, depot_rev in enumerate(depot_revs):
+                if layer_idx >= len(layer_revs):
+                    layer_revs.append(list[tuple[str, int]]())
+                layer_revs[layer_idx].append(depot_rev)
 
-            # forward record
-            self.file_diff_record_map[file_change_info.depot_path].version_forward(file_change_info)
+        depots = sorted(set([
+            depot_path[2:].split("/")[0] for depot_revs in history_revs for depot_path, _ in depot_revs
+        ]))
+        for layer_idx, depot_revs in enumerate(layer_revs):
+            client_name = "%s_scratch_history%d_%d" % (p4_client.p4.client, layer_idx, os.getpid())
+            p4_client.save_scratch_client(
+                client_name, os.path.abspath(os.path.join(self.scratch_dir, "history%d" % layer_idx)), depots
+            )
+            self.scratch_client_names.append(client_name)
+            with p4_client.use_client(client_name):
+                self.prefetched_paths.update(p4_client.sync_files_of_revs(depot_revs, self.prefetch_parallel_threads))
+
+    # remove prefetched files and scratch clients
+    def release_prefetch(self, p4_client: P4Client):
+        for client_name in self.scratch_client_names:
+            p4_client.delete_scratch_client(client_name)
+        self.scratch_client_names = list[str]()
+        self.prefetched_paths = dict[tuple[str, int], str]()
+
+    # local path of rev, prefetched, printed into print dir or synced into workspace, empty if not synced
+    def _fetch_rev(self, p4_client: P4Client, depot_path: str, rev_id: int) -> str:
+        local_path = self.prefetched_paths.get((depot_path, rev_id))
+        if local_path is not None:
+            return local_path
+        if len(self.print_dir) > 0:
+            # unique file name per fetch, ext is kept for soundfile
+            self._printed_num += 1
+            local_path = os.path.join(
+                self.print_dir, "%d%s" % (self._printed_num, os.path.splitext(depot_path)[1])
+            )
+            if not p4_client.print_file_of_rev(depot_path, rev_id, local_path):
+                return ""
+            self.printed_paths[(depot_path, rev_id)] = local_path
+        else:
+            local_path = p4_client.sync_file_of_rev(depot_path, rev_id)
+        if len(local_path) > 0 and os.path.exists(local_path):
+            self.fetched_rev_num += 1
+            self.fetched_byte_num += os.path.getsize(local_path)
+        return local_path
+
+    # clean or restore local file of depot path in workspace, printed file is removed
+    # prefetched files are removed by release_prefetch
+    def _release_rev(self, p4_client: P4Client, depot_path: str, rev_id: int):
+        if (depot_path, rev_id) in self.prefetched_paths:
+            return
+        printed_path = self.printed_paths.pop((depot_path, rev_id), None)
+        if printed_path is not None:
+            if os.path.exists(printed_path):
+                os.remove(printed_path)
+            return
+        if self.clean_mode:
+            p4_client.sync_file_of_rev(depot_path, 0)   # version 0 will clean local file
+        else:
+            p4_client.sync_file_of_rev(depot_path)
+
+    # set loudness index, metrics of indexed revisions are read from it instead of fetching wav
+    def set_loudness_index(self, loudness_index: Optional[LoudnessIndex]):
+        self.loudness_index = loudness_index
+
+    # keep records of one shard only, call after all changes are loaded
+    # record index of the unsharded run is kept to merge shard results in the same order
+    def apply_shard(self, shard_idx: int, shard_num: int):
+        self.record_order_map = {path: idx for idx, path in enumerate(self.file_diff_record_map)}
+        self.file_diff_record_map = FileDiffRecordStore.from_records(
+            record for path, record in self.file_diff_record_map.items()
+            if get_shard_of_path(path, shard_num) == shard_idx
+        )
+
+    # index of record in the unsharded order
+    def get_record_order(self, record_idx: int, depot_path: str) -> int:
+        return record_idx if self.record_order_map is None else self.record_order_map[depot_path]
+
+    # set cache of wav metrics shared between checkers
+    def set_metrics_cache(self, metrics_cache: Optional[WavMetricsCache]):
+        self.metrics_cache = metrics_cache
 
     # load wav info of given rev id
     def load_wav_of_rev(self, p4_client: P4Client, depot_path: str, rev_id: int) -> WavInfo:
+        return self.load_wavs_of_revs(p4_client, [(depot_path, rev_id)])[0]
+
+    # wav info of rev got without fetching (metrics cache, loudness index, no content), None if not got
+    # cached or indexed metrics missing a required metric are not used, the rev is fetched instead
+    def get_wav_of_rev_without_fetch(self, depot_path: str, rev_id: int) -> Optional[WavInfo]:
         wav_info = None
-        if rev_id <= 0:
+        if self.metrics_cache is not None:
+            wav_info = self.metrics_cache.get(depot_path, rev_id)
+            if wav_info is not None and not wav_info.has_metrics(self.required_metrics):
+                wav_info = None
+        if wav_info is None and self.loudness_index is not None:
+            # rev 0 is not indexed, it has no content
+            wav_info = self.loudness_index.get_metrics(depot_path, rev_id) if rev_id > 0 else WavInfo()
+            if wav_info is not None and not wav_info.has_metrics(self.required_metrics):
+                wav_info = None
+        if wav_info is None and rev_id <= 0:
             wav_info = WavInfo()
+        if wav_info is not None:
+            wav_info.depot_path = depot_path
+            wav_info.rev_id = rev_id
+        return wav_info
 
-        local_path = p4_client.sync_file_of_rev(depot_path, rev_id)
-        if len(local_path) == 0 or not os.path.exists(local_path):
-            wav_info = WavInfo()
+    # header only if no required metric needs decoded data
+    def is_header_only(self) -> bool:
+        return self.required_metrics <= {METRIC_HEADER}
+
+    # wav info of a wav file (local path or content) with required metrics computed and decoded data released
+    def load_wav(self, wav_file: Union[str, bytes]) -> WavInfo:
+        if self.is_header_only():
+            if isinstance(wav_file, bytes):
+                return WavInfo.from_header(io.BytesIO(wav_file))
+            return WavInfo.from_header(wav_file, wav_file)
+        wav_info = WavInfo.from_bytes(wav_file) if isinstance(wav_file, bytes) else WavInfo(wav_file)
+        wav_info.compute_metrics(self.required_metrics)
+        return wav_info
+
+    # load wav infos of (depot path, rev id), depot paths should be different as they share one local path per file
+    # fetched revs are synced first, then small wavs are decoded in one batch (see load_small_wavs),
+    # and local files are cleaned at last, only headers are read if no required metric needs decoded data
+    def load_wavs_of_revs(self, p4_client: P4Client, depot_revs: list[tuple[str, int]]) -> list[WavInfo]:
+        wav_infos = [self.get_wav_of_rev_without_fetch(depot_path, rev_id) for depot_path, rev_id in depot_revs]
+        fetch_idxs = [idx for idx, wav_info in enumerate(wav_infos) if wav_info is None]
+        local_paths = [self._fetch_rev(p4_client, *depot_revs[idx]) for idx in fetch_idxs]
 
         # wav file exist, try to load wav
-        if wav_info is None:
-            try:
-                wav_info = WavInfo(local_path)
-            except Exception as e:
-                print("\n[Load wav]Failed to load wav info of %s#%d" % (depot_path, rev_id))
-                print(e)
-                wav_info = WavInfo()
-            finally:
-                if self.clean_mode:
-                    p4_client.sync_file_of_rev(depot_path, 0)   # version 0 will clean local file
-                else:
-                    p4_client.sync_file_of_rev(depot_path)
+        synced = [len(local_path) > 0 and os.path.exists(local_path) for local_path in local_paths]
+        small_wav_infos = iter(load_small_wavs(
+            [local_path for local_path, is_synced in zip(local_paths, synced) if is_synced]
+        ) if not self.is_header_only() else [None] * sum(synced))
+        for idx, local_path, is_synced in zip(fetch_idxs, local_paths, synced):
+            depot_path, rev_id = depot_revs[idx]
+            wav_info = next(small_wav_infos) if is_synced else WavInfo()
+            if wav_info is not None:
+                wav_info.compute_metrics(self.required_metrics)
+            else:
+                try:
+                    wav_info = self.load_wav(local_path)
+                except Exception as e:
+                    print("\n[Load wav]Failed to load wav info of %s#%d" % (depot_path, rev_id))
+                    print(e)
+                    wav_info = WavInfo()
 
-        # set version info
-        wav_info.depot_path = depot_path
-        wav_info.rev_id = rev_id
+            # set version info
+            wav_info.depot_path = depot_path
+            wav_info.rev_id = rev_id
+            wav_infos[idx] = wav_info
 
-        return wav_info
+            # only loaded wav is cached, a failed sync may succeed next time
+            if self.metrics_cache is not None and wav_info.available:
+                self.metrics_cache.put(wav_info)
 
-    # run checker
+        for idx, is_synced in zip(fetch_idxs, synced):
+            if is_synced:
+                self._release_rev(p4_client, *depot_revs[idx])
+
+        return wav_infos
+
+    # set journal of completed files
+    # files already in the journal are not loaded again when checking
+    def set_journal(self, journal: Optional[CheckJournal]):
+        self.journal = journal
+
+    # load prev and curr wav info of record, from journal if completed before
+    def load_wav_of_record(self, p4_client: P4Client, file_diff_record: FileDiffRecord) -> tuple[WavInfo, WavInfo]:
+        return self.load_wavs_of_records(p4_client, [file_diff_record])[0]
+
+    # load prev and curr wav infos of records, revs of one side are loaded in one batch
+    def load_wavs_of_records(
+        self,
+        p4_client: P4Client,
+        file_diff_records: list[FileDiffRecord],
+    ) -> list[tuple[WavInfo, WavInfo]]:
+        wav_info_pairs = [self._get_journal_wav_infos(file_diff_record) for file_diff_record in file_diff_records]
+
+        load_idxs = [record_idx for record_idx, pair in enumerate(wav_info_pairs) if pair is None]
+        prev_wav_infos = self.load_wavs_of_revs(p4_client, [
+            file_diff_records[idx].get_side_revs()[0] for idx in load_idxs
+        ])
+        curr_wav_infos = self.load_wavs_of_revs(p4_client, [
+            file_diff_records[idx].get_side_revs()[1] for idx in load_idxs
+        ])
+        for record_idx, prev_wav_info, curr_wav_info in zip(load_idxs, prev_wav_infos, curr_wav_infos):
+            wav_info_pairs[record_idx] = (prev_wav_info, curr_wav_info)
+            if self.journal is not None:
+                self.journal.append(file_diff_records[record_idx].path, prev_wav_info, curr_wav_info)
+
+        return wav_info_pairs
+
+    # prev and curr wav infos of record completed in journal, None if not completed or without required metrics
+    def _get_journal_wav_infos(self, file_diff_record: FileDiffRecord) -> Optional[tuple[WavInfo, WavInfo]]:
+        if self.journal is None:
+            return None
+        journal_wav_infos = self.journal.get(
+            file_diff_record.path, file_diff_record.prev_rev_id, file_diff_record.curr_rev_id
+        )
+        if journal_wav_infos is None or \
+                not all([wav_info.has_metrics(self.required_metrics) for wav_info in journal_wav_infos]):
+            return None
+        for wav_info, (depot_path, rev_id) in zip(journal_wav_infos, file_diff_record.get_side_revs()):
+            wav_info.depot_path, wav_info.rev_id = depot_path, rev_id
+        return journal_wav_infos
+
+    # run checker, records are checked in batches of CHECK_BATCH_SIZE, or by analysis scheduler if set
+    # revs to be fetched are prefetched into scratch clients first if scratch dir is set
     def check(self, p4_client: P4Client, yield_path_flag: bool = False) -> list:
+        self._begin_check()
+        if len(self.scratch_dir) > 0:
+            self.prefetch(p4_client, list(self.file_diff_record_map.values()))
+        try:
+            if self.analysis_scheduler is not None:
+                yield from self._scheduled_check(p4_client, yield_path_flag)
+            else:
+                yield from self._batch_check(p4_client, yield_path_flag)
+        finally:
+            if len(self.scratch_dir) > 0:
+                self.release_prefetch(p4_client)
+
+    # check records batch by batch in this thread
+    def _batch_check(self, p4_client: P4Client, yield_path_flag: bool = False):
+        file_diff_records = list[FileDiffRecord]()
         for file_idx, file_diff_record in enumerate(self.file_diff_record_map.values()):
-            prev_wav_info = self.load_wav_of_rev(p4_client, file_diff_record.path, file_diff_record.prev_rev_id)
-            curr_wav_info = self.load_wav_of_rev(p4_client, file_diff_record.path, file_diff_record.curr_rev_id)
-            for check_rule in self.check_rules:
-                check_rule.check(prev_wav_info, curr_wav_info)
+            file_diff_records.append(file_diff_record)
+            if len(file_diff_records) < CHECK_BATCH_SIZE and file_idx + 1 < len(self.file_diff_record_map):
+                continue
+            self._check_records(p4_client, file_diff_records)
             if yield_path_flag:
-                yield [file_idx, file_diff_record.path]
+                for batch_idx, checked_record in enumerate(file_diff_records):
+                    yield [file_idx + 1 - len(file_diff_records) + batch_idx, checked_record.path]
+            file_diff_records = list[FileDiffRecord]()
+
+    # list changes of base_dir in stamp range and check files while listing
+    # changes are listed from new to old, so the first seen rev of a file is its curr rev,
+    # and prev rev is its head rev before begin stamp, a file is checked when it is first seen
+    # records and results are reordered as load_changes + check when listing finished
+    # yield (listed change num, total change num, checked file idx or -1)
+    def stream_check(
+        self,
+        p4_client: P4Client,
+        base_dir: str,
+        begin_stamp: str = "",
+        end_stamp: str = "",
+        file_ext: str = "",
+    ):
+        self._begin_check()
+        prev_rev_map = p4_client.get_file_revs_before(base_dir, begin_stamp, file_ext)
+        change_lists = list[ChangeList]()
+        change_total = 0
+        # first seen records not checked yet
+        file_diff_records = list[FileDiffRecord]()
+        for change_idx, change_total, change_list in p4_client.iter_changes_of_dir(
+            base_dir=base_dir,
+            begin_stamp=begin_stamp,
+            end_stamp=end_stamp,
+            file_ext=file_ext,
+        ):
+            if change_list is not None:
+                change_lists.append(change_list)
+                for file_change_info in change_list.file_change_list:
+                    if file_change_info.depot_path in self.file_diff_record_map:
+                        continue
+                    file_diff_record = FileDiffRecord(file_change_info.depot_path)
+                    file_diff_record.prev_rev_id = prev_rev_map.get(file_change_info.depot_path, 0)
+                    file_diff_record.curr_rev_id = file_change_info.rev
+                    self.file_diff_record_map[file_diff_record.path] = file_diff_record
+                    file_diff_records.append(file_diff_record)
+                    if len(file_diff_records) >= CHECK_BATCH_SIZE:
+                        self._check_records(p4_client, file_diff_records)
+                        for file_idx in range(len(self.file_diff_record_map) - len(file_diff_records), len(self)):
+                            yield change_idx + 1, change_total, file_idx
+                        file_diff_records = list[FileDiffRecord]()
+            yield change_idx + 1, change_total, -1
+
+        # check the last batch
+        if len(file_diff_records) > 0:
+            self._check_records(p4_client, file_diff_records)
+            for file_idx in range(len(self.file_diff_record_map) - len(file_diff_records), len(self)):
+                yield change_total, change_total, file_idx
+
+        # record order of load_changes: first seen in change id order
+        change_lists.sort(key=lambda c: c.id)
+        record_order_map = dict[str, int]()
+        for change_list in change_lists:
+            for file_change_info in change_list.file_change_list:
+                if file_change_info.depot_path not in record_order_map:
+                    record_order_map[file_change_info.depot_path] = len(record_order_map)
+        checked_paths = list(self.file_diff_record_map.keys())
+        self._reorder_results(sorted(range(len(checked_paths)), key=lambda i: record_order_map[checked_paths[i]]))
+
+    # check records by analysis scheduler, yielded file idx is the checked file num - 1 as files finish out of order
+    # files are fetched in this thread with their content kept in memory, then decoded and checked in workers,
+    # memory of a record is estimated by sizes of its fetched revs, results are reordered to record order at last
+    def _scheduled_check(self, p4_client: P4Client, yield_path_flag: bool = False):
+        file_diff_records = [
+            FileDiffRecord(path, stored_record.prev_path) for path, stored_record in self.file_diff_record_map.items()
+        ]
+        for file_diff_record, stored_record in zip(file_diff_records, self.file_diff_record_map.values()):
+            file_diff_record.prev_rev_id = stored_record.prev_rev_id
+            file_diff_record.curr_rev_id = stored_record.curr_rev_id
+
+        # [prev, curr] wav infos got without fetching, None if to be fetched
+        known_wav_infos = list[list[Optional[WavInfo]]]()
+        journal_flags = list[bool]()
+        for file_diff_record in file_diff_records:
+            journal_wav_infos = self._get_journal_wav_infos(file_diff_record)
+            journal_flags.append(journal_wav_infos is not None)
+            if journal_wav_infos is not None:
+                known_wav_infos.append(list(journal_wav_infos))
+            else:
+                known_wav_infos.append([
+                    self.get_wav_of_rev_without_fetch(depot_path, rev_id)
+                    for depot_path, rev_id in file_diff_record.get_side_revs()
+                ])
+
+        fetch_revs = [
+            depot_rev
+            for file_diff_record, wav_infos in zip(file_diff_records, known_wav_infos)
+            for depot_rev, wav_info in zip(file_diff_record.get_side_revs(), wav_infos)
+            if wav_info is None
+        ]
+        file_sizes = p4_client.get_file_sizes(fetch_revs) if len(fetch_revs) > 0 else dict()
+        job_memories = [
+            sum([
+                file_sizes.get(depot_rev, 0) * ANALYSIS_MEMORY_PER_FILE_BYTE
+                for depot_rev, wav_info in zip(file_diff_record.get_side_revs(), wav_infos)
+                if wav_info is None
+            ])
+            for file_diff_record, wav_infos in zip(file_diff_records, known_wav_infos)
+        ]
+
+        # content of [prev, curr] revs to be fetched, None if not fetched or not synced
+        def fetch_record(record_idx: int) -> list[Optional[bytes]]:
+            file_diff_record = file_diff_records[record_idx]
+            contents = [None, None]
+            for side_idx, (depot_path, rev_id) in enumerate(file_diff_record.get_side_revs()):
+                if known_wav_infos[record_idx][side_idx] is not None:
+                    continue
+                local_path = self._fetch_rev(p4_client, depot_path, rev_id)
+                if len(local_path) > 0 and os.path.exists(local_path):
+                    with open(local_path, "rb") as f:
+                        contents[side_idx] = f.read()
+                    self._release_rev(p4_client, depot_path, rev_id)
+            return contents
+
+        # wav infos and check results of record, required metrics are computed here
+        def analyse_record(record_idx: int, contents: list[Optional[bytes]]) -> tuple[WavInfo, WavInfo, list]:
+            file_diff_record = file_diff_records[record_idx]
+            wav_infos = list[WavInfo]()
+            for side_idx, (depot_path, rev_id) in enumerate(file_diff_record.get_side_revs()):
+                wav_info = known_wav_infos[record_idx][side_idx]
+                if wav_info is None:
+                    wav_info = WavInfo()
+                    if contents[side_idx] is not None:
+                        try:
+                            wav_info = self.load_wav(contents[side_idx])
+                        except Exception as e:
+                            print("\n[Load wav]Failed to load wav info of %s#%d" % (depot_path, rev_id))
+                            print(e)
+                    wav_info.depot_path = depot_path
+                    wav_info.rev_id = rev_id
+                    wav_info.compute_metrics(self.required_metrics)
+                    if self.metrics_cache is not None and wav_info.available:
+                        self.metrics_cache.put(wav_info)
+                wav_infos.append(wav_info)
+            prev_wav_info, curr_wav_info = wav_infos
+            return prev_wav_info, curr_wav_info, [
+                check_rule.check_func(prev_wav_info, curr_wav_info) for check_rule in self.check_rules
+            ]
+
+        checked_records = list[FileDiffRecord]()
+        for record_idx, (prev_wav_info, curr_wav_info, results) in self.analysis_scheduler.run(
+            job_memories, fetch_record, analyse_record
+        ):
+            file_diff_record = file_diff_records[record_idx]
+            if self.journal is not None and not journal_flags[record_idx]:
+                self.journal.append(file_diff_record.path, prev_wav_info, curr_wav_info)
+            verdicts = [check_rule.log_result(result) for check_rule, result in zip(self.check_rules, results)]
+            self.metrics_builder.append(file_diff_record.path, prev_wav_info, curr_wav_info, verdicts)
+            self.file_rule_logs.append({
+                check_rule.name: check_rule.log_info[-1]
+                for check_rule, verdict in zip(self.check_rules, verdicts) if verdict
+            })
+            checked_records.append(file_diff_record)
+            if yield_path_flag:
+                yield [len(checked_records) - 1, file_diff_record.path]
+
+        # records in check order, then reorder all to record order
+        checked_idx_map = {
+            file_diff_record.path: checked_idx for checked_idx, file_diff_record in enumerate(checked_records)
+        }
+        self.file_diff_record_map = FileDiffRecordStore.from_records(checked_records)
+        self._reorder_results([checked_idx_map[file_diff_record.path] for file_diff_record in file_diff_records])
+
+    # history mode: load every rev of files in range from the rev before range, and find loudness jumps
+    # a jump is a dBFS or max dBFS change over threshold between two available revs next to each other,
+    # logged with the change submitting the later rev
+    # revs are prefetched into scratch clients in bulk if scratch dir is set, otherwise printed one by one into
+    # a temp dir, so revs of one file do not share a local path,
+    # metrics cache and loudness index are used, and files are analysed by analysis scheduler if set
+    # yield (done file num, total file num)
+    def check_history(self, p4_client: P4Client):
+        # [(depot path, [(rev id, change id)])] in record order
+        file_histories = list[tuple[str, list[tuple[int, int]]]]()
+        for path, file_diff_record in self.file_diff_record_map.items():
+            rev_changes = sorted(self.file_rev_changes.get(path, []))
+            if file_diff_record.prev_rev_id > 0:
+                rev_changes.insert(0, (file_diff_record.prev_rev_id, 0))
+            file_histories.append((path, rev_changes))
+
+        # known wav infos without levels, e.g. read headers only, are fetched again
+        known_wav_infos = [
+            [self.get_wav_of_rev_without_fetch(path, rev_id) for rev_id, _ in rev_changes]
+            for path, rev_changes in file_histories
+        ]
+        known_wav_infos = [
+            [wav_info if wav_info is None or wav_info.has_metrics(HISTORY_METRICS) else None for wav_info in wav_infos]
+            for wav_infos in known_wav_infos
+        ]
+        fetch_revs = [
+            (path, rev_id)
+            for (path, rev_changes), wav_infos in zip(file_histories, known_wav_infos)
+            for (rev_id, _), wav_info in zip(rev_changes, wav_infos) if wav_info is None
+        ]
+        file_sizes = p4_client.get_file_sizes(fetch_revs) if len(fetch_revs) > 0 else dict()
+        job_memories = [
+            ANALYSIS_MEMORY_PER_FILE_BYTE * sum([
+                file_sizes.get((path, rev_id), 0)
+                for (rev_id, _), wav_info in zip(rev_changes, wav_infos) if wav_info is None
+            ])
+            for (path, rev_changes), wav_infos in zip(file_histories, known_wav_infos)
+        ]
+        print_dir = tempfile.mkdtemp(prefix="history_")
+        prefetch_flag = len(self.scratch_dir) > 0
+        if prefetch_flag:
+            try:
+                self.prefetch_history(p4_client, [
+                    [(path, rev_id) for (rev_id, _), wav_info in zip(rev_changes, wav_infos) if wav_info is None]
+                    for (path, rev_changes), wav_infos in zip(file_histories, known_wav_infos)
+                ])
+            except BaseException:
+                self.release_prefetch(p4_client)
+                shutil.rmtree(print_dir, ignore_errors=True)
+                raise
+
+        # content of every rev to be fetched, None if known, not synced or not printed
+        def fetch_history(file_idx: int) -> list[Optional[bytes]]:
+            path, rev_changes = file_histories[file_idx]
+            contents = list[Optional[bytes]]()
+            for (rev_id, _), wav_info in zip(rev_changes, known_wav_infos[file_idx]):
+                if wav_info is not None:
+                    contents.append(None)
+                    continue
+                if prefetch_flag:
+                    local_path = self.prefetched_paths.get((path, rev_id))
+                    if local_path is None:
+                        contents.append(None)
+                        continue
+                else:
+                    local_path = os.path.join(print_dir, "%d_%d.wav" % (file_idx, rev_id))
+                    if not p4_client.print_file_of_rev(path, rev_id, local_path):
+                        contents.append(None)
+                        continue
+                with open(local_path, "rb") as f:
+                    contents.append(f.read())
+                if not prefetch_flag:
+                    os.remove(local_path)
+                self.fetched_rev_num += 1
+                self.fetched_byte_num += len(contents[-1])
+            return contents
+
+        def analyse_history(file_idx: int, contents: list[Optional[bytes]]) -> list[FileRevisionPoint]:
+            path, rev_changes = file_histories[file_idx]
+            points = list[FileRevisionPoint]()
+            for (rev_id, change_id), wav_info, content in zip(rev_changes, known_wav_infos[file_idx], contents):
+                if wav_info is None:
+                    wav_info = WavInfo()
+                    if content is not None:
+                        try:
+                            wav_info = WavInfo.from_bytes(content)
+                            wav_info.compute_metrics(HISTORY_METRICS)
+                        except Exception as e:
+                            print("\n[Load wav]Failed to load wav info of %s#%d" % (path, rev_id))
+                            print(e)
+                    wav_info.depot_path = path
+                    wav_info.rev_id = rev_id
+                    if self.metrics_cache is not None and wav_info.available:
+                        self.metrics_cache.put(wav_info)
+                points.append(FileRevisionPoint(rev_id, change_id, wav_info))
+            return points
+
+        if self.analysis_scheduler is not None:
+            file_results = self.analysis_scheduler.run(job_memories, fetch_history, analyse_history)
+        else:
+            file_results = (
+                (file_idx, analyse_history(file_idx, fetch_history(file_idx)))
+                for file_idx in range(len(file_histories))
+            )
+        points_of_files = [None] * len(file_histories)
+        try:
+            for done_num, (file_idx, points) in enumerate(file_results):
+                points_of_files[file_idx] = points
+                yield done_num + 1, len(file_histories)
+        finally:
+            shutil.rmtree(print_dir, ignore_errors=True)
+            if prefetch_flag:
+                self.release_prefetch(p4_client)
+
+        self.history_points = dict[str, list[FileRevisionPoint]]()
+        self.history_jump_logs = list[str]()
+        for (path, _), points in zip(file_histories, points_of_files):
+            self.history_points[path] = points
+            available_points = [point for point in points if point.available]
+            for prev_point, curr_point in zip(available_points[:-1], available_points[1:]):
+                if abs(curr_point.dBFS - prev_point.dBFS) >= DBFS_DIFF_THRESHOLD or \
+                        abs(curr_point.max_dBFS - prev_point.max_dBFS) >= MAX_DBFS_DIFF_THRESHOLD:
+                    self.history_jump_logs.append("%d,#%d,#%d,%.2f,%.2f,%.2f,%.2f,%s" % (
+                        curr_point.change_id, prev_point.rev_id, curr_point.rev_id,
+                        prev_point.dBFS, curr_point.dBFS, prev_point.max_dBFS, curr_point.max_dBFS, path,
+                    ))
+
+    def _begin_check(self):
+        self.metrics_builder = MetricsColumnBuilder([check_rule.name for check_rule in self.check_rules])
+        self.file_rule_logs = list[dict[str, str]]()
+        self._rule_log_begin_nums = [len(check_rule.log_info) for check_rule in self.check_rules]
+
+    # check records and append their results in order
+    def _check_records(self, p4_client: P4Client, file_diff_records: list[FileDiffRecord]):
+        wav_info_pairs = self.load_wavs_of_records(p4_client, file_diff_records)
+        for file_diff_record, (prev_wav_info, curr_wav_info) in zip(file_diff_records, wav_info_pairs):
+            verdicts = [check_rule.check(prev_wav_info, curr_wav_info) for check_rule in self.check_rules]
+            self.metrics_builder.append(file_diff_record.path, prev_wav_info, curr_wav_info, verdicts)
+            self.file_rule_logs.append({
+                check_rule.name: check_rule.log_info[-1]
+                for check_rule, verdict in zip(self.check_rules, verdicts) if verdict
+            })
+
+    # reorder records and results of current check, new_order[i] is the current idx of the i-th record
+    def _reorder_results(self, new_order: list[int]):
+        records = list(self.file_diff_record_map.values())
+        self.file_diff_record_map = FileDiffRecordStore.from_records(records[i] for i in new_order)
+        self.metrics_builder.reorder(new_order)
+        self.file_rule_logs = [self.file_rule_logs[i] for i in new_order]
+        for check_rule, begin_num in zip(self.check_rules, self._rule_log_begin_nums):
+            check_rule.log_info[begin_num:] = [
+                file_rule_log[check_rule.name] for file_rule_log in self.file_rule_logs
+                if check_rule.name in file_rule_log
+            ]
 
     def __len__(self):
         return len(self.file_diff_record_map)
@@ -168,6 +1098,40 @@ def resource_max_dBFS_diff_rule(prev_wav_info: WavInfo, curr_wav_info: WavInfo)
     return None
 
 
+# resource true peak over ceiling rule, log files whose true peak rises above ceiling
+def resource_true_peak_rule(prev_wav_info: WavInfo, curr_wav_info: WavInfo) -> Union[str, None]:
+    if not prev_wav_info.available or not curr_wav_info.available:
+        return None
+    if prev_wav_info.true_peak_dB is None or curr_wav_info.true_peak_dB is None:
+        return None
+
+    prev_true_peak = float(np.max(prev_wav_info.true_peak_dB))
+    curr_true_peak = float(np.max(curr_wav_info.true_peak_dB))
+    if curr_true_peak > TRUE_PEAK_CEILING_DB >= prev_true_peak:
+        return "%.2f,%.2f,%s" % (prev_true_peak, curr_true_peak, curr_wav_info.depot_path)
+    return None
+
+
+# resource band energy diff rule, log the band with the largest diff
+def resource_band_energy_diff_rule(prev_wav_info: WavInfo, curr_wav_info: WavInfo) -> Union[str, None]:
+    if not prev_wav_info.available or not curr_wav_info.available:
+        return None
+    prev_band_energy = prev_wav_info.band_energy_dB
+    curr_band_energy = curr_wav_info.band_energy_dB
+    if prev_band_energy is None or curr_band_energy is None:
+        return None
+
+    band_diff = np.abs(curr_band_energy - prev_band_energy)
+    band_diff[np.maximum(prev_band_energy, curr_band_energy) < BAND_ENERGY_FLOOR_DB] = 0.0
+    band_idx = int(np.argmax(band_diff))
+    if band_diff[band_idx] >= BAND_ENERGY_DIFF_THRESHOLD:
+        return "%g,%.2f,%.2f,%s" % (
+            OCTAVE_BAND_CENTERS[band_idx], prev_band_energy[band_idx], curr_band_energy[band_idx],
+            curr_wav_info.depot_path,
+        )
+    return None
+
+
 # resource channel diff rule
 def resource_channel_diff_rule(prev_wav_info: WavInfo, curr_wav_info: WavInfo) -> Union[str, None]:
     if not prev_wav_info.available or not curr_wav_info.available:
@@ -0,0 +1,179 @@
+# local sqlite index of wav metrics of every revision under indexed paths
+# built once by walking the change history, then updated with changes submitted after the last indexed change
+# metrics are produced by WavInfo.to_metrics
+import json
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+from utils.p4 import P4Client, ChangeList, FileChangeInfo
+from utils.wav_parser import WavInfo
+
+
+# file actions without content, metrics of these revisions are not fetched
+DELETE_ACTIONS = ("delete", "move/delete", "purge", "archive")
+FAILED_METRICS = ""     # metrics of revision failed to load, loaded again by next update
+
+
+class LoudnessIndex(object):
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS roots (
+                base_dir TEXT PRIMARY KEY,
+                file_ext TEXT NOT NULL,
+                last_change INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS revisions (
+                path TEXT NOT NULL,
+                rev INTEGER NOT NULL,
+                change INTEGER NOT NULL,
+                time INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                metrics TEXT NOT NULL,
+                PRIMARY KEY (path, rev)
+            );
+            CREATE INDEX IF NOT EXISTS revisions_change ON revisions (change);
+        """)
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # last indexed change id of base_dir, -1 if base_dir is not indexed
+    def get_last_change_id(self, base_dir: str) -> int:
+        with self.lock:
+            row = self.conn.execute("SELECT last_change FROM roots WHERE base_dir = ?", (base_dir,)).fetchone()
+        return row[0] if row is not None else -1
+
+    # indexed root covering depot path (the root dir itself or a path under it), None if not indexed
+    def find_root(self, depot_path: str) -> Optional[str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT base_dir FROM roots").fetchall()
+        roots = [
+            row[0] for row in rows
+            if depot_path.rstrip("/") == row[0].rstrip("/") or depot_path.startswith(row[0].rstrip("/") + "/")
+        ]
+        return max(roots, key=len) if len(roots) > 0 else None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM revisions").fetchone()[0]
+
+    def get_metrics(self, depot_path: str, rev_id: int) -> Optional[WavInfo]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT metrics FROM revisions WHERE path = ? AND rev = ?", (depot_path, rev_id)
+            ).fetchone()
+        return WavInfo.from_metrics(json.loads(row[0])) if row is not None and row[0] != FAILED_METRICS else None
+
+    # index changes of base_dir submitted after the last indexed change
+    # load_wav_func(depot path, rev id) loads wav info of a revision
+    # revisions failed to load (e.g. sync error) are kept as file changes without metrics,
+    # and loaded again by the next update, checking fetches them meanwhile
+    # yield (done, total) of listing changes, then of indexing changes
+    def update(
+        self,
+        p4_client: P4Client,
+        base_dir: str,
+        load_wav_func: Callable[[str, int], WavInfo],
+        file_ext: str = ".wav",
+        commit_interval: int = 100,
+    ):
+        last_change_id = self.get_last_change_id(base_dir)
+        if last_change_id < 0:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO roots (base_dir, file_ext, last_change) VALUES (?, ?, ?)", (base_dir, file_ext, 0)
+                )
+                self.conn.commit()
+            last_change_id = 0
+        self._reload_failed_revisions(base_dir, load_wav_func)
+
+        # p4 lists changes from new to old, index from old to new so that last_change always means a complete prefix
+        change_lists = list[ChangeList]()
+        for change_idx, change_total, change_list in p4_client.iter_changes_of_dir(
+            base_dir=base_dir,
+            begin_stamp=str(last_change_id + 1),
+            file_ext=file_ext,
+        ):
+            if change_list is not None:
+                change_lists.append(change_list)
+            yield change_idx + 1, change_total
+        change_lists.sort(key=lambda c: c.id)
+
+        for change_idx, change_list in enumerate(change_lists):
+            rows = list[tuple]()
+            for file_change_info in change_list.file_change_list:
+                if self.get_metrics(file_change_info.depot_path, file_change_info.rev) is not None:
+                    continue
+                if file_change_info.action in DELETE_ACTIONS:
+                    metrics = json.dumps(WavInfo().to_metrics(), separators=(",", ":"))
+                else:
+                    wav_info = load_wav_func(file_change_info.depot_path, file_change_info.rev)
+                    metrics = json.dumps(wav_info.to_metrics(), separators=(",", ":")) \
+                        if wav_info.available else FAILED_METRICS
+                rows.append((
+                    file_change_info.depot_path, file_change_info.rev, change_list.id, change_list.time,
+                    file_change_info.action, metrics,
+                ))
+
+            with self.lock:
+                self.conn.executemany("INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self.conn.execute("UPDATE roots SET last_change = ? WHERE base_dir = ?", (change_list.id, base_dir))
+                if (change_idx + 1) % commit_interval == 0 or change_idx + 1 == len(change_lists):
+                    self.conn.commit()
+            yield change_idx + 1, len(change_lists)
+
+    # load revisions failed by last updates of base_dir again, revisions still failed are kept failed
+    def _reload_failed_revisions(self, base_dir: str, load_wav_func: Callable[[str, int], WavInfo]):
+        with self.lock:
+            failed_revs = self.conn.execute(
+                "SELECT path, rev FROM revisions WHERE metrics = ? AND substr(path, 1, ?) = ?",
+                (FAILED_METRICS, len(base_dir), base_dir),
+            ).fetchall()
+        for depot_path, rev_id in failed_revs:
+            wav_info = load_wav_func(depot_path, rev_id)
+            if not wav_info.available:
+                continue
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE revisions SET metrics = ? WHERE path = ? AND rev = ?",
+                    (json.dumps(wav_info.to_metrics(), separators=(",", ":")), depot_path, rev_id),
+                )
+        with self.lock:
+            self.conn.commit()
+
+    # file changes of indexed revisions in change id range, in change order and file order of change
+    # begin id is inclusive, end id is exclusive like p4.P4Client.iter_changes_of_dir,
+    # time stamps are resolved to ids by P4Client.get_change_id_of_stamp first
+    def get_file_changes(
+        self,
+        base_dir: str,
+        begin_id: str = "",
+        end_id: str = "",
+        file_ext: str = "",
+    ) -> list[FileChangeInfo]:
+        conditions = ["substr(path, 1, ?) = ?"]
+        params = [len(base_dir), base_dir]
+        for change_id, id_condition in [(begin_id, "change >= ?"), (end_id, "change < ?")]:
+            if len(change_id) == 0:
+                continue
+            if not change_id.isdigit():
+                raise ValueError("Invalid change id: '%s'" % change_id)
+            conditions.append(id_condition)
+            params.append(int(change_id))
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, action, rev FROM revisions WHERE %s ORDER BY change, rowid" % " AND ".join(conditions),
+                params,
+            ).fetchall()
+        return [
+            FileChangeInfo(path, action, "", rev)
+            for path, action, rev in rows if path.endswith(file_ext)
+        ]
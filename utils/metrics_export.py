@@ -0,0 +1,90 @@
+from utils.wav_parser import WavInfo
+
+
+# build per-file metrics columns while checking, then write them as one columnar table
+# one row per checked file, per-channel metrics are stored as list columns
+class MetricsColumnBuilder(object):
+
+    # column name -> pyarrow type name
+    SIDE_COLUMNS = [
+        ("rev", "int32"),
+        ("available", "bool_"),
+        ("channels", "int16"),
+        ("sr", "int32"),
+        ("duration", "float64"),
+        ("dBFS", "list_float32"),               # empty if not available
+        ("max_dBFS", "list_float32"),           # empty if not available
+        ("band_energy_dB", "list_float32"),     # empty if not available
+        ("true_peak_dB", "list_float32"),       # empty if not available
+    ]
+
+    def __init__(self, rule_names: list[str]):
+        self.rule_names = rule_names
+        self.columns = dict[str, list]()
+        self.columns["path"] = list[str]()
+        for side in ["prev", "curr"]:
+            for col_name, _ in self.SIDE_COLUMNS:
+                self.columns["%s_%s" % (side, col_name)] = list()
+        for rule_name in rule_names:
+            self.columns["rule_%s" % rule_name] = list[bool]()
+
+    def __len__(self):
+        return len(self.columns["path"])
+
+    # append one checked file
+    def append(self, depot_path: str, prev_wav_info: WavInfo, curr_wav_info: WavInfo, verdicts: list[bool]):
+        self.columns["path"].append(depot_path)
+        for side, wav_info in [("prev", prev_wav_info), ("curr", curr_wav_info)]:
+            self.columns["%s_rev" % side].append(wav_info.rev_id)
+            self.columns["%s_available" % side].append(wav_info.available)
+            self.columns["%s_channels" % side].append(wav_info.channels)
+            self.columns["%s_sr" % side].append(wav_info.sr)
+            self.columns["%s_duration" % side].append(wav_info.duration)
+            # metrics of unavailable wav are computed as silence, they are not exported
+            for metric_name in ["dBFS", "max_dBFS", "band_energy_dB", "true_peak_dB"]:
+                values = getattr(wav_info, metric_name) if wav_info.available else None
+                self.columns["%s_%s" % (side, metric_name)].append(
+                    [float(v) for v in values] if values is not None else []
+                )
+        for rule_name, verdict in zip(self.rule_names, verdicts):
+            self.columns["rule_%s" % rule_name].append(verdict)
+
+    # reorder rows, new_order[i] is the current idx of the i-th row
+    def reorder(self, new_order: list[int]):
+        for col_name, column in self.columns.items():
+            self.columns[col_name] = [column[row_idx] for row_idx in new_order]
+
+    # get one row as dict of column name -> value
+    def get_row(self, row_idx: int) -> dict:
+        return {col_name: column[row_idx] for col_name, column in self.columns.items()}
+
+    # build pyarrow table
+    def to_table(self):
+        import pyarrow as pa
+
+        type_map = {
+            "int16": pa.int16(),
+            "int32": pa.int32(),
+            "float64": pa.float64(),
+            "bool_": pa.bool_(),
+            "list_float32": pa.list_(pa.float32()),
+        }
+        fields = [pa.field("path", pa.string())]
+        for side in ["prev", "curr"]:
+            for col_name, type_name in self.SIDE_COLUMNS:
+                fields.append(pa.field("%s_%s" % (side, col_name), type_map[type_name]))
+        for rule_name in self.rule_names:
+            fields.append(pa.field("rule_%s" % rule_name, pa.bool_()))
+
+        arrays = [pa.array(self.columns[field.name], type=field.type) for field in fields]
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+    # write table to parquet (*.parquet) or arrow ipc file (other ext)
+    def write(self, path: str):
+        table = self.to_table()
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path)
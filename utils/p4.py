@@ -1,22 +1,43 @@
 import re
 import os
-from typing import Union
+import sys
+import functools
+import contextlib
+import datetime
+from typing import Optional, Union
 from P4 import P4, P4Exception
 
+from utils.p4_throttle import P4Throttle
+from utils.change_cache import ChangeCache
+
 
 P4_SERVER = ""
 P4_WORKSPACE_NAME = ""
 TIME_STAMP_REGEX = re.compile(r"\d{1,4}/\d{1,2}/\d{1,2}:\d{1,2}:\d{1,2}:\d{1,2}")
-P4_WORKSPACE_ROOT, curr_base = os.path.split(os.getcwd())
-while curr_base != "Dev" and len(curr_base) > 0 and len(P4_WORKSPACE_ROOT) > 0:
-    P4_WORKSPACE_ROOT, curr_base = os.path.split(P4_WORKSPACE_ROOT)
-if curr_base != "Dev":
-    P4_WORKSPACE_ROOT = ""
+TIME_STAMP_FORMAT = "%Y/%m/%d:%H:%M:%S"
+CHANGES_PAGE_SIZE = 200
+FILE_SPECS_PER_COMMAND = 100    # file specs given to one command, keeps command line short
+# resolved change id of time stamp is cached only if the stamp is older than this, covers time zone difference to server
+TIME_STAMP_CACHE_DELAY = datetime.timedelta(days=1)
+
+
+# default workspace root: parent of the "Dev" dir containing cwd, empty if not found
+# resolved on first use instead of at import time
+@functools.lru_cache(maxsize=1)
+def get_p4_workspace_root() -> str:
+    workspace_root, curr_base = os.path.split(os.getcwd())
+    while curr_base != "Dev" and len(curr_base) > 0 and len(workspace_root) > 0:
+        workspace_root, curr_base = os.path.split(workspace_root)
+    if curr_base != "Dev":
+        workspace_root = ""
+    return workspace_root
 
 
 # file change info in change list of p4
 class FileChangeInfo(object):
 
+    __slots__ = ("depot_path", "action", "file_type", "rev")
+
     def __init__(
         self,
         depot_path: str,
@@ -24,17 +45,21 @@ class FileChangeInfo(object):
         file_type: str,
         rev: int,
     ):
-        self.depot_path = depot_path
-        self.action = action
-        self.file_type = file_type
+        # paths, actions and types repeat across changes, share one string object for each
+        self.depot_path = sys.intern(depot_path)
+        self.action = sys.intern(action)
+        self.file_type = sys.intern(file_type)
         self.rev = rev
 
 
 # change list info of p4
 class ChangeList(object):
 
+    __slots__ = ("id", "time", "file_change_list")
+
     def __init__(self, p4_change_dict: dict):
         self.id: int = -1
+        self.time: int = 0      # submit time, seconds since epoch
         # self.status = ""
         self.file_change_list = list[FileChangeInfo]()
 
@@ -45,6 +70,7 @@ class ChangeList(object):
 
     def _parse_p4_change_dict(self, p4_change_dict: dict):
         self.id = int(p4_change_dict["change"])
+        self.time = int(p4_change_dict.get("time", 0))
         # self.status = p4_change_dict["status"]
         for file_idx in range(len(p4_change_dict["depotFile"])):
             self.file_change_list.append(
@@ -82,8 +108,11 @@ class P4Client(object):
         password: str = "",
         workspace_name: str = P4_WORKSPACE_NAME,
         charset: str = "utf8",
-        workspace_root: str = P4_WORKSPACE_ROOT,
+        workspace_root: Optional[str] = None,
     ):
+        if workspace_root is None:
+            workspace_root = get_p4_workspace_root()
+
         self.p4 = P4()
         self.p4.port = port
         self.p4.user = user
@@ -91,19 +120,41 @@ class P4Client(object):
         self.p4.client = workspace_name
         self.p4.charset = charset
         self.p4.connect()
+        self.throttle: Optional[P4Throttle] = None
+        self.change_cache: Optional[ChangeCache] = None
         if len(workspace_name) == 0 and len(workspace_root) > 0:
             # workspace name is empty, get workspace name by workspace root
             self._set_workspace_info(workspace_root)
 
+    # close connection to server, e.g. when a job owning the client ends
+    def disconnect(self):
+        if self.p4.connected():
+            self.p4.disconnect()
+
+    # set throttle shared by clients of the same server, None to run commands without limit
+    def set_throttle(self, throttle: Optional[P4Throttle]):
+        self.throttle = throttle
+
+    # set cache of submitted change describes and time stamps, None to always ask server
+    def set_change_cache(self, change_cache: Optional[ChangeCache]):
+        self.change_cache = change_cache
+
+    # run p4 command through throttle
+    def run(self, *args) -> list:
+        if self.throttle is None:
+            return self.p4.run(*args)
+        with self.throttle.command(args[0] if len(args) > 0 else ""):
+            return self.p4.run(*args)
+
     # set self._client.client info
     # get workspace name by workspace root
     def _set_workspace_info(self, workspace_root: str) -> None:
         # get current(default) client info
-        curr_client_info = self.p4.run("info")[0]
+        curr_client_info = self.run("info")[0]
         curr_host = curr_client_info["clientHost"]  # current computer name
 
         # get info of all user clients
-        user_client_infos = self.p4.run("clients", "--me")
+        user_client_infos = self.run("clients", "--me")
         for client_info in user_client_infos:
             if client_info["Host"] == curr_host:
                 # is client on current computer
@@ -121,6 +172,21 @@ class P4Client(object):
         end_stamp: str = "",
         file_ext: str = ""
     ) -> list[ChangeList]:
+        change_lists = list[ChangeList]()
+        for _, _, change_list in self.iter_changes_of_dir(base_dir, begin_stamp, end_stamp, file_ext):
+            if change_list is not None:
+                change_lists.append(change_list)
+        return change_lists
+
+    # yield (change idx, change total num, change list) for every change in stamp range
+    # change list is None if it has no file matched with base_dir and file_ext
+    def iter_changes_of_dir(
+        self,
+        base_dir: str,
+        begin_stamp: str = "",
+        end_stamp: str = "",
+        file_ext: str = ""
+    ):
         # turn stamp to id or time
         begin_id, end_id, begin_time, end_time = "", "", "", ""
         if len(begin_stamp) > 0:
@@ -138,8 +204,22 @@ class P4Client(object):
             else:
                 raise ValueError("Invalid end stamp: '%s'" % end_stamp)
 
+        # with change cache, time is resolved to change id, so that the same range lists the same changes
+        # changes submitted at or after begin time: id > last change before begin time
+        # changes submitted at or before end time: id < last change at end time + 1
+        if self.change_cache is not None:
+            if len(begin_time) > 0:
+                begin_datetime = datetime.datetime.strptime(begin_time, TIME_STAMP_FORMAT)
+                begin_id = str(self.get_change_id_of_time(
+                    (begin_datetime - datetime.timedelta(seconds=1)).strftime(TIME_STAMP_FORMAT)
+                ) + 1)
+                begin_time = ""
+            if len(end_time) > 0:
+                end_id = str(self.get_change_id_of_time(end_time) + 1)
+                end_time = ""
+
         # get change list
-        return self._get_changes_of_dir(
+        yield from self._iter_changes_of_dir(
             base_dir=base_dir,
             begin_id=begin_id,
             end_id=end_id,
@@ -148,15 +228,16 @@ class P4Client(object):
             file_ext=file_ext
         )
 
-    def _get_changes_of_dir(
+    def _iter_changes_of_dir(
         self,
         base_dir: str,
         begin_id: str = "",
         end_id: str = "",
         begin_time: str = "",
         end_time: str = "",
-        file_ext: str = ""
-    ) -> list[ChangeList]:
+        file_ext: str = "",
+        page_size: int = CHANGES_PAGE_SIZE,
+    ):
 
         # change id condition cmd string
         begin_id_cmd = begin_id if len(begin_id) > 0 else ""
@@ -167,47 +248,287 @@ class P4Client(object):
             raise ValueError("Invalid begin time: '%s'" % begin_time)
         if len(end_time) > 0 and TIME_STAMP_REGEX.match(end_time) is None:
             raise ValueError("Invalid end time: '%s'" % end_time)
-        if len(begin_time) > 0 and len(end_time) > 0:
-            time_condition_cmd = "@%s,%s" % (begin_time, end_time)
-        elif len(begin_time) > 0:
-            time_condition_cmd = "@%s,@now" % begin_time
-        elif len(end_time) > 0:
-            time_condition_cmd = "@%s" % end_time
-        else:
-            time_condition_cmd = ""
-
-        change_lists = list[ChangeList]()
 
         # base_dir -> base_dir/...
         p4_check_path = os.path.join(base_dir, "...").replace("\\", "/")
 
-        # run p4 command
-        if len(begin_id_cmd) > 0:
-            results = self.p4.run("changes", "-e", begin_id_cmd, "%s%s" % (p4_check_path, time_condition_cmd))
+        # page through submitted changes from new to old, each page is described before the next page is listed
+        # upper bound of the first page is end stamp, then the change before the oldest listed change
+        upper_cmd = end_time if len(end_time) > 0 else ("@%d" % (end_id - 1) if end_id < 0x7fffffff else "@now")
+        listed_num = 0
+        while True:
+            if len(begin_time) > 0:
+                time_condition_cmd = "@%s,%s" % (begin_time, upper_cmd)
+            else:
+                time_condition_cmd = "@%s" % upper_cmd.lstrip("@")
+
+            # run p4 command
+            if len(begin_id_cmd) > 0:
+                results = self.run(
+                    "changes", "-s", "submitted", "-e", begin_id_cmd, "-m", str(page_size),
+                    "%s%s" % (p4_check_path, time_condition_cmd)
+                )
+            else:
+                results = self.run(
+                    "changes", "-s", "submitted", "-m", str(page_size), "%s%s" % (p4_check_path, time_condition_cmd)
+                )
+            has_next_page = len(results) >= page_size
+
+            # total is unknown before the last page, count a full page for the next page
+            change_total = listed_num + len(results) + (page_size if has_next_page else 0)
+
+            # parse results
+            for p4_change_info in results:
+                change_idx = listed_num
+                listed_num += 1
+                change_id = int(p4_change_info["change"])
+                if change_id >= end_id:
+                    yield change_idx, change_total, None
+                    continue
+                change_list = self.get_change_info_by_id(change_id)
+                if change_list is not None:
+                    change_list.path_filter(base_dir)
+                    if len(file_ext) > 0:
+                        change_list.ext_filter(file_ext)
+                if change_list is not None and len(change_list.file_change_list) > 0:
+                    yield change_idx, change_total, change_list
+                else:
+                    yield change_idx, change_total, None
+
+            oldest_change_id = min([int(p4_change_info["change"]) for p4_change_info in results], default=0)
+            if not has_next_page or oldest_change_id <= 1:
+                break
+            upper_cmd = "@%d" % (oldest_change_id - 1)
+
+    # head rev of every file under base_dir before begin stamp, that is the prev rev of files changed in stamp range
+    # return empty dict if begin stamp is empty, range starts from the first change
+    def get_file_revs_before(self, base_dir: str, begin_stamp: str, file_ext: str = "") -> dict[str, int]:
+        if len(begin_stamp) == 0:
+            return dict[str, int]()
+        if begin_stamp.isdigit():
+            if int(begin_stamp) <= 1:
+                return dict[str, int]()
+            revision_cmd = "@%d" % (int(begin_stamp) - 1)
+        elif TIME_STAMP_REGEX.match(begin_stamp) is not None:
+            before_time = (
+                datetime.datetime.strptime(begin_stamp, TIME_STAMP_FORMAT) - datetime.timedelta(seconds=1)
+            ).strftime(TIME_STAMP_FORMAT)
+            if self.change_cache is not None:
+                # same resolution as iter_changes_of_dir
+                revision_cmd = "@%d" % self.get_change_id_of_time(before_time)
+            else:
+                revision_cmd = "@%s" % before_time
+        else:
+            raise ValueError("Invalid begin stamp: '%s'" % begin_stamp)
+
+        p4_check_path = os.path.join(base_dir, "...").replace("\\", "/")
+        with self.p4.at_exception_level(P4.RAISE_ERRORS):
+            # no file before begin stamp is a warning
+            results = self.run("fstat", "-T", "depotFile,headRev", "%s%s" % (p4_check_path, revision_cmd))
+
+        file_revs = dict[str, int]()
+        for p4_file_info in results:
+            if "headRev" in p4_file_info and p4_file_info["depotFile"].endswith(file_ext):
+                file_revs[p4_file_info["depotFile"]] = int(p4_file_info["headRev"])
+        return file_revs
+
+    # head rev and content digest of every file under base_dir at stamp, by one fstat
+    # stamp is resolved like a range of iter_changes_of_dir, a change id stamp is exclusive, a time stamp is
+    # exclusive as begin stamp and inclusive as end stamp, so files are at the prev or curr side of the range
+    # return depot path -> (head rev, digest), files deleted at stamp are not in result, empty stamp means head
+    def get_file_digests(
+        self,
+        base_dir: str,
+        stamp: str = "",
+        file_ext: str = "",
+        begin_flag: bool = False,
+    ) -> dict[str, tuple[int, str]]:
+        if len(stamp) == 0:
+            revision_cmd = ""
+        elif stamp.isdigit():
+            if int(stamp) <= 1:
+                return dict[str, tuple[int, str]]()
+            revision_cmd = "@%d" % (int(stamp) - 1)
+        elif TIME_STAMP_REGEX.match(stamp) is not None:
+            if begin_flag:
+                stamp = (
+                    datetime.datetime.strptime(stamp, TIME_STAMP_FORMAT) - datetime.timedelta(seconds=1)
+                ).strftime(TIME_STAMP_FORMAT)
+            if self.change_cache is not None:
+                # same resolution as iter_changes_of_dir
+                revision_cmd = "@%d" % self.get_change_id_of_time(stamp)
+            else:
+                revision_cmd = "@%s" % stamp
         else:
-            results = self.p4.run("changes", "%s%s" % (p4_check_path, time_condition_cmd))
+            raise ValueError("Invalid stamp: '%s'" % stamp)
+
+        p4_check_path = os.path.join(base_dir, "...").replace("\\", "/")
+        with self.p4.at_exception_level(P4.RAISE_ERRORS):
+            # no file at stamp is a warning, digest is given with -Ol only
+            results = self.run(
+                "fstat", "-Ol", "-T", "depotFile,headRev,headAction,digest", "%s%s" % (p4_check_path, revision_cmd)
+            )
 
-        # parse results
-        for p4_change_info in results:
-            change_id = int(p4_change_info["change"])
-            if change_id >= end_id:
+        file_digests = dict[str, tuple[int, str]]()
+        for p4_file_info in results:
+            if "headRev" not in p4_file_info or "delete" in p4_file_info.get("headAction", ""):
                 continue
-            change_list = self.get_change_info_by_id(change_id)
-            change_list.path_filter(base_dir)
-            if len(file_ext) > 0:
-                change_list.ext_filter(file_ext)
-            if change_list is not None and len(change_list.file_change_list) > 0:
-                change_lists.append(change_list)
+            if p4_file_info["depotFile"].endswith(file_ext):
+                file_digests[p4_file_info["depotFile"]] = (
+                    int(p4_file_info["headRev"]), p4_file_info.get("digest", "")
+                )
+        return file_digests
+
+    # file size of every (depot path, rev id) in bytes, revs without content (e.g. deleted) are not in result
+    def get_file_sizes(self, depot_revs: list[tuple[str, int]]) -> dict[tuple[str, int], int]:
+        file_sizes = dict[tuple[str, int], int]()
+        for spec_begin in range(0, len(depot_revs), FILE_SPECS_PER_COMMAND):
+            file_specs = [
+                "%s#%d" % (depot_path, rev_id)
+                for depot_path, rev_id in depot_revs[spec_begin:spec_begin + FILE_SPECS_PER_COMMAND]
+            ]
+            try:
+                with self.p4.at_exception_level(P4.RAISE_ERRORS):
+                    # deleted rev is a warning
+                    results = self.run("sizes", *file_specs)
+            except P4Exception as e:
+                print("=========Capture an error from P4=========")
+                print(e)
+                continue
+            for p4_file_info in results:
+                if "fileSize" in p4_file_info:
+                    file_sizes[(p4_file_info["depotFile"], int(p4_file_info["rev"]))] = int(p4_file_info["fileSize"])
+        return file_sizes
+
+    # create or update a scratch client rooted at root, depots are mapped to "<root>/<depot>/..."
+    # files are synced into scratch clients instead of user's workspace
+    def save_scratch_client(self, client_name: str, root: str, depots: list[str]):
+        with self.p4.at_exception_level(P4.RAISE_ERRORS):
+            client_spec = self.run("client", "-o", client_name)[0]
+            client_spec["Root"] = root
+            client_spec["Options"] = "allwrite clobber nocompress unlocked nomodtime rmdir"
+            client_spec["View"] = ["//%s/... //%s/%s/..." % (depot, client_name, depot) for depot in depots]
+            self.p4.input = client_spec
+            self.run("client", "-i")
+
+    # run commands of this context with another client
+    @contextlib.contextmanager
+    def use_client(self, client_name: str):
+        workspace_name = self.p4.client
+        self.p4.client = client_name
+        try:
+            yield
+        finally:
+            self.p4.client = workspace_name
+
+    # sync (depot path, rev id) of current client by one command, then resolve local paths by one where
+    # return (depot path, rev id) -> local path of synced files, revs without content (e.g. deleted) are not in result
+    # depot paths should be different, parallel_threads > 1 transfers files in parallel where the server allows
+    def sync_files_of_revs(
+        self,
+        depot_revs: list[tuple[str, int]],
+        parallel_threads: int = 0,
+    ) -> dict[tuple[str, int], str]:
+        if len(depot_revs) == 0:
+            return dict[tuple[str, int], str]()
+        parallel_args = ["--parallel=threads=%d" % parallel_threads] if parallel_threads > 1 else []
+        try:
+            with self.p4.at_exception_level(P4.RAISE_ERRORS):
+                self.run("sync", *parallel_args, *["%s#%d" % (depot_path, rev_id) for depot_path, rev_id in depot_revs])
+                where_results = self.run("where", *[depot_path for depot_path, _ in depot_revs])
+        except P4Exception as e:
+            print("=========Capture an error from P4=========")
+            print(e)
+            return dict[tuple[str, int], str]()
+
+        local_path_map = {p4_where_info["depotFile"]: p4_where_info["path"] for p4_where_info in where_results}
+        local_paths = dict[tuple[str, int], str]()
+        for depot_path, rev_id in depot_revs:
+            local_path = local_path_map.get(depot_path, "")
+            if len(local_path) > 0 and os.path.exists(local_path):
+                local_paths[(depot_path, rev_id)] = local_path
+        if self.throttle is not None:
+            self.throttle.consume_bytes(sum([os.path.getsize(local_path) for local_path in local_paths.values()]))
+        return local_paths
+
+    # print content of rev to local path without any workspace, return False if not printed (e.g. deleted rev)
+    def print_file_of_rev(self, path: str, rev_id: int, local_path: str) -> bool:
+        try:
+            with self.p4.at_exception_level(P4.RAISE_ERRORS):
+                self.run("print", "-q", "-o", local_path, "%s#%d" % (path, rev_id))
+        except P4Exception as e:
+            print("=========Capture an error from P4=========")
+            print(e)
+            return False
+        if not os.path.exists(local_path):
+            return False
+        if self.throttle is not None:
+            self.throttle.consume_bytes(os.path.getsize(local_path))
+        return True
+
+    # remove files synced into scratch client by one command, then delete the client
+    def delete_scratch_client(self, client_name: str):
+        try:
+            with self.p4.at_exception_level(P4.RAISE_ERRORS):
+                with self.use_client(client_name):
+                    self.run("sync", "//%s/...#0" % client_name)
+                self.run("client", "-d", client_name)
+        except P4Exception as e:
+            print("=========Capture an error from P4=========")
+            print(e)
 
-        return change_lists
+    # get id of the latest submitted change on server
+    # counter change is not used, it counts pending changes too, which may be submitted later
+    def get_latest_change_id(self) -> int:
+        results = self.run("changes", "-m", "1", "-s", "submitted")
+        return int(results[0]["change"]) if len(results) > 0 else 0
+
+    # change id of begin or end stamp of a range, same resolution as iter_changes_of_dir with change cache
+    # begin id is inclusive, end id is exclusive, a time stamp is resolved by server, so changes submitted
+    # at or after begin time and at or before end time are in range, empty string if stamp is empty
+    def get_change_id_of_stamp(self, stamp: str, end_flag: bool = False) -> str:
+        if len(stamp) == 0 or stamp.isdigit():
+            return stamp
+        if TIME_STAMP_REGEX.match(stamp) is None:
+            raise ValueError("Invalid stamp: '%s'" % stamp)
+        if end_flag:
+            return str(self.get_change_id_of_time(stamp) + 1)
+        before_time = (
+            datetime.datetime.strptime(stamp, TIME_STAMP_FORMAT) - datetime.timedelta(seconds=1)
+        ).strftime(TIME_STAMP_FORMAT)
+        return str(self.get_change_id_of_time(before_time) + 1)
+
+    # get id of the last submitted change at or before time stamp, 0 if no change
+    def get_change_id_of_time(self, time_stamp: str) -> int:
+        if self.change_cache is not None:
+            change_id = self.change_cache.get_time_stamp_change(time_stamp)
+            if change_id is not None:
+                return change_id
+
+        results = self.run("changes", "-m", "1", "-s", "submitted", "//...@%s" % time_stamp)
+        change_id = int(results[0]["change"]) if len(results) > 0 else 0
+
+        # changes may still be submitted before a recent time stamp
+        stamp_datetime = datetime.datetime.strptime(time_stamp, TIME_STAMP_FORMAT)
+        if self.change_cache is not None and stamp_datetime < datetime.datetime.now() - TIME_STAMP_CACHE_DELAY:
+            self.change_cache.put_time_stamp_change(time_stamp, change_id)
+        return change_id
 
     def get_change_info_by_id(self, change_id: int) -> Union[ChangeList, None]:
+        # submitted change never changes, read it from cache
+        if self.change_cache is not None:
+            p4_change_dict = self.change_cache.get_describe(change_id)
+            if p4_change_dict is not None:
+                return ChangeList(p4_change_dict)
+
         change_list = None
         try:
-            p4_change_dict = self.p4.run("describe", change_id)
+            p4_change_dict = self.run("describe", change_id)
             if type(p4_change_dict) != list or len(p4_change_dict) != 1:
                 raise P4Exception("Invalid p4 change dict for change id: %d" % change_id)
             change_list = ChangeList(p4_change_dict[0])
+            if self.change_cache is not None:
+                self.change_cache.put_describe(p4_change_dict[0])
         except P4Exception as e:
             print("=========Capture an error from P4=========")
             print(e)
@@ -218,11 +539,13 @@ class P4Client(object):
         try:
             with self.p4.at_exception_level(P4.RAISE_ERRORS):
                 if rev_id == -1:
-                    self.p4.run("sync", path)
+                    self.run("sync", path)
                 else:
-                    self.p4.run("sync", "%s#%d" % (path, rev_id))
+                    self.run("sync", "%s#%d" % (path, rev_id))
                 # get local path
-                local_path = self.p4.run("where", path)[0]["path"]
+                local_path = self.run("where", path)[0]["path"]
+            if self.throttle is not None and rev_id != 0 and os.path.exists(local_path):
+                self.throttle.consume_bytes(os.path.getsize(local_path))
             return local_path
         except P4Exception as e:
             print("=========Capture an error from P4=========")
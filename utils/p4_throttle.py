@@ -0,0 +1,224 @@
+# throttle of p4 commands toward one server, shared by all p4 clients of the server in this process
+# - token bucket of commands/sec and bytes/sec
+# - adaptive concurrency: additive increase while healthy, multiplicative decrease on latency growth or server errors
+#   latency is compared with a baseline of the same command, latency of transfer commands depends on file size
+#   and is not compared
+import time
+import threading
+import contextlib
+from typing import Optional
+
+from P4 import P4Exception
+
+
+# lower-case keywords of p4 errors caused by server load or connection, other errors (e.g. no such file) are ignored
+SERVER_ERROR_KEYWORDS = ("connect", "tcp", "timeout", "timed out", "too many", "server", "resource")
+TRANSFER_COMMANDS = ("sync", "print")     # latency grows with transferred bytes, only errors adjust concurrency
+
+
+# rate <= 0 means unlimited
+class TokenBucket(object):
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self.tokens = self.burst
+        self.last_time = time.perf_counter()
+        self.lock = threading.Lock()
+
+    # change rate, tokens over new burst are dropped
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        with self.lock:
+            self.rate = rate
+            self.burst = max(burst if burst is not None else rate, 1.0)
+            self.tokens = min(self.tokens, self.burst)
+
+    # take amount tokens, wait if not enough, return waited seconds
+    # amount larger than burst is allowed and leaves the bucket in debt
+    def acquire(self, amount: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.perf_counter()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            self.tokens -= amount
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+
+# limit of running commands, adjusted by command latency and errors (AIMD)
+class AdaptiveConcurrencyLimiter(object):
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        latency_tolerance: float = 2.0,     # latency over baseline * tolerance is treated as overload
+        backoff_ratio: float = 0.5,
+        backoff_interval: float = 1.0,      # at most one decrease per interval, one overload affects many commands
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.backoff_interval = backoff_interval
+
+        self.limit = float(self.max_limit)
+        self.running_num = 0
+        self.baseline_latencies = dict[str, float]()     # command name -> slow-moving average of healthy latency
+        self.last_backoff_time = 0.0
+        self.condition = threading.Condition()
+
+    # change max limit, current limit is clamped into new range
+    def set_max_limit(self, max_limit: int):
+        with self.condition:
+            self.max_limit = max(1, max_limit)
+            self.min_limit = min(self.min_limit, self.max_limit)
+            self.limit = max(float(self.min_limit), min(self.limit, float(self.max_limit)))
+            self.condition.notify_all()
+
+    # wait for a free slot, return waited seconds
+    def acquire(self) -> float:
+        start_time = time.perf_counter()
+        with self.condition:
+            self.condition.wait_for(lambda: self.running_num < int(self.limit))
+            self.running_num += 1
+        return time.perf_counter() - start_time
+
+    # latency is compared with baseline of command_name, transfer commands are judged by server errors only
+    def release(self, latency: float, server_error_flag: bool, command_name: str = ""):
+        with self.condition:
+            self.running_num -= 1
+            latency_flag = command_name not in TRANSFER_COMMANDS
+            baseline_latency = self.baseline_latencies.get(command_name, 0.0)
+            if server_error_flag or (
+                latency_flag and baseline_latency > 0 and latency > baseline_latency * self.latency_tolerance
+            ):
+                now = time.perf_counter()
+                if now - self.last_backoff_time >= self.backoff_interval:
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+                    self.last_backoff_time = now
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                if latency_flag:
+                    self.baseline_latencies[command_name] = latency if baseline_latency == 0 \
+                        else baseline_latency * 0.95 + latency * 0.05
+            self.condition.notify_all()
+
+
+class P4Throttle(object):
+
+    def __init__(
+        self,
+        max_commands_per_sec: float = 0.0,
+        max_bytes_per_sec: float = 0.0,
+        max_concurrency: int = 8,
+    ):
+        self.max_commands_per_sec = max_commands_per_sec
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.max_concurrency = max_concurrency
+        self.command_bucket = TokenBucket(max_commands_per_sec)
+        self.bytes_bucket = TokenBucket(max_bytes_per_sec)
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+
+        # stats
+        self.stats_lock = threading.Lock()
+        self.start_time = 0.0
+        self.command_num = 0
+        self.byte_num = 0
+        self.server_error_num = 0
+        self.throttle_time = 0.0    # seconds commands waited for throttle, summed over threads
+
+    # change limits, e.g. watch setting is edited, commands already waiting follow new limits after their wait
+    def set_limits(self, max_commands_per_sec: float, max_bytes_per_sec: float, max_concurrency: int):
+        self.max_commands_per_sec = max_commands_per_sec
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.max_concurrency = max_concurrency
+        self.command_bucket.set_rate(max_commands_per_sec)
+        self.bytes_bucket.set_rate(max_bytes_per_sec)
+        self.limiter.set_max_limit(max_concurrency)
+
+    # run one p4 command (e.g. "describe") in this context
+    @contextlib.contextmanager
+    def command(self, command_name: str = ""):
+        wait_time = self.limiter.acquire()
+        try:
+            wait_time += self.command_bucket.acquire()
+        except BaseException:
+            self.limiter.release(0.0, False, command_name)
+            raise
+
+        start_time = time.perf_counter()
+        server_error_flag = False
+        try:
+            yield
+        except P4Exception as e:
+            server_error_flag = is_server_error(e)
+            raise
+        finally:
+            latency = time.perf_counter() - start_time
+            self.limiter.release(latency, server_error_flag, command_name)
+            with self.stats_lock:
+                if self.start_time == 0:
+                    self.start_time = start_time
+                self.command_num += 1
+                self.server_error_num += int(server_error_flag)
+                self.throttle_time += wait_time
+
+    # count transferred bytes, wait if over bytes/sec
+    def consume_bytes(self, byte_num: int):
+        wait_time = self.bytes_bucket.acquire(byte_num)
+        with self.stats_lock:
+            self.byte_num += byte_num
+            self.throttle_time += wait_time
+
+    def get_summary(self) -> str:
+        with self.stats_lock:
+            elapsed_time = max(time.perf_counter() - self.start_time, 1e-6) if self.start_time > 0 else 0.0
+            return "%d commands (%.1f/s), %.1f MB (%.2f MB/s), %d server errors, " \
+                   "throttled %.1fs, concurrency limit %d" % (
+                       self.command_num,
+                       self.command_num / elapsed_time if elapsed_time > 0 else 0.0,
+                       self.byte_num / 1e6,
+                       self.byte_num / 1e6 / elapsed_time if elapsed_time > 0 else 0.0,
+                       self.server_error_num,
+                       self.throttle_time,
+                       int(self.limiter.limit),
+                   )
+
+
+def is_server_error(e: P4Exception) -> bool:
+    message = str(e).lower()
+    return any(keyword in message for keyword in SERVER_ERROR_KEYWORDS)
+
+
+# p4 port -> throttle, so clients of one server share limits
+_throttle_registry = dict[str, P4Throttle]()
+_throttle_registry_lock = threading.Lock()
+
+
+# get shared throttle of server, created with given limits on first call
+# limits differing from the existing throttle are applied to it
+def get_p4_throttle(
+    port: str,
+    max_commands_per_sec: float = 0.0,
+    max_bytes_per_sec: float = 0.0,
+    max_concurrency: int = 8,
+) -> P4Throttle:
+    with _throttle_registry_lock:
+        throttle = _throttle_registry.get(port)
+        if throttle is None:
+            throttle = P4Throttle(
+                max_commands_per_sec=max_commands_per_sec,
+                max_bytes_per_sec=max_bytes_per_sec,
+                max_concurrency=max_concurrency,
+            )
+            _throttle_registry[port] = throttle
+        elif (throttle.max_commands_per_sec, throttle.max_bytes_per_sec, throttle.max_concurrency) != (
+            max_commands_per_sec, max_bytes_per_sec, max_concurrency
+        ):
+            throttle.set_limits(max_commands_per_sec, max_bytes_per_sec, max_concurrency)
+        return throttle
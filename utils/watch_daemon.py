@@ -0,0 +1,149 @@
+# long-running daemon of console mode, checks changes submitted since the last poll
+# this module must not import Qt, like check_runner
+import os
+import json
+import time
+from typing import Optional
+
+from P4 import P4Exception
+
+from utils import check_runner
+from utils.p4 import P4Client
+from utils.watch_setting import WatchSetting, WatchItem
+from utils.diff_checker import DiffChecker, WavMetricsCache
+
+
+DAEMON_STATE_FILE_NAME = "watch_daemon_state.json"
+DEFAULT_POLL_INTERVAL = 30.0
+
+
+# poll latest change id of server, check new changes of every watch item and append findings to result files
+# the p4 connection and wav metrics cache are kept between polls
+class WatchDaemon(object):
+
+    def __init__(self, watch_setting: WatchSetting, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.watch_setting = watch_setting
+        self.poll_interval = poll_interval
+        self.p4_client: Optional[P4Client] = None
+        self.metrics_cache = WavMetricsCache()
+        self.analysis_scheduler = check_runner.create_analysis_scheduler(watch_setting)
+
+        # watch item name -> last checked change id
+        self.state_path = os.path.join(watch_setting.output_dir, DAEMON_STATE_FILE_NAME)
+        self.last_change_ids = dict[str, int]()
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.last_change_ids = {name: int(change_id) for name, change_id in json.load(f).items()}
+
+    def save_state(self):
+        if not os.path.exists(self.watch_setting.output_dir):
+            os.makedirs(self.watch_setting.output_dir)
+        with open(self.state_path, "w") as f:
+            json.dump(self.last_change_ids, f, indent=4)
+
+    # result file of watch item, findings of every poll are appended to it
+    def get_result_path(self, watch_item: WatchItem) -> str:
+        return os.path.join(self.watch_setting.output_dir, "%s_watch.csv" % watch_item.name)
+
+    # poll until interrupted, a failed poll is logged and retried at next poll
+    def run(self):
+        self.load_state()
+        print("[Daemon]Watching %d item(s), poll every %.0fs" % (
+            len(self.watch_setting.watch_item_list), self.poll_interval
+        ))
+        try:
+            while True:
+                poll_start_time = time.perf_counter()
+                try:
+                    if self.p4_client is None:
+                        self.p4_client = check_runner.create_p4_client(self.watch_setting)
+                    self.poll()
+                except P4Exception as e:
+                    print("=========Capture an error from P4=========")
+                    print(e)
+                    self._reconnect()
+                except Exception as e:
+                    print("[Daemon]Poll failed, retry at next poll: %s: %s" % (type(e).__name__, e))
+                time.sleep(max(self.poll_interval - (time.perf_counter() - poll_start_time), 0.0))
+        except KeyboardInterrupt:
+            print("\n[Daemon]Stopped")
+        finally:
+            self.save_state()
+            if self.p4_client is not None and self.p4_client.throttle is not None:
+                print("[P4]%s" % self.p4_client.throttle.get_summary())
+
+    # check changes submitted since last poll, return number of checked files
+    # latest change id is the latest submitted change, pending changes are left to the poll after their submit
+    def poll(self) -> int:
+        latest_change_id = self.p4_client.get_latest_change_id()
+        checked_file_num = 0
+        for watch_item in self.watch_setting.watch_item_list:
+            last_change_id = self.last_change_ids.get(watch_item.name)
+            if last_change_id is None:
+                # new watch item starts from now on
+                print("[Daemon]'%s' starts from change %d" % (watch_item.name, latest_change_id))
+                self.last_change_ids[watch_item.name] = latest_change_id
+                self.save_state()
+                continue
+            if latest_change_id <= last_change_id:
+                continue
+
+            checker = self.check_changes(watch_item, last_change_id + 1, latest_change_id)
+            checked_file_num += len(checker)
+            self.last_change_ids[watch_item.name] = latest_change_id
+            self.save_state()
+
+        return checked_file_num
+
+    # check changes of watch item in [begin_change_id, end_change_id], and append findings to result file
+    def check_changes(self, watch_item: WatchItem, begin_change_id: int, end_change_id: int) -> DiffChecker:
+        check_start_time = time.perf_counter()
+
+        # end stamp is exclusive
+        range_item = WatchItem(
+            name=watch_item.name,
+            path=watch_item.path,
+            prev_stamp=str(begin_change_id),
+            curr_stamp=str(end_change_id + 1),
+        )
+        checker = check_runner.create_checker(
+            watch_item=range_item,
+            p4_client=self.p4_client,
+            check_rules=check_runner.get_check_rules(self.watch_setting.disabled_rules),
+            clean_mode=not self.watch_setting.disable_clean_mode,
+        )
+        checker.set_metrics_cache(self.metrics_cache)
+        checker.set_analysis_scheduler(self.analysis_scheduler)
+        checker.set_scratch_dir(self.watch_setting.scratch_dir, self.watch_setting.p4_parallel_sync_threads)
+        for _ in checker.check(self.p4_client):
+            pass
+
+        log_str = checker.get_log()
+        if len(log_str) > 0:
+            self.append_result(watch_item, begin_change_id, end_change_id, log_str)
+        print("[Daemon]'%s' change %d-%d: %d file(s) checked in %.1fs%s" % (
+            watch_item.name, begin_change_id, end_change_id, len(checker),
+            time.perf_counter() - check_start_time,
+            ", findings appended to '%s'" % self.get_result_path(watch_item) if len(log_str) > 0 else "",
+        ))
+        return checker
+
+    def append_result(self, watch_item: WatchItem, begin_change_id: int, end_change_id: int, log_str: str):
+        if not os.path.exists(self.watch_setting.output_dir):
+            os.makedirs(self.watch_setting.output_dir)
+        with open(self.get_result_path(watch_item), "a") as f:
+            print("[Change %d-%d][%s]" % (
+                begin_change_id, end_change_id, time.strftime("%Y/%m/%d:%H:%M:%S")
+            ), file=f)
+            print(log_str + "\n", file=f)
+
+    def _reconnect(self):
+        if self.p4_client is None:
+            return
+        try:
+            if not self.p4_client.p4.connected():
+                self.p4_client.p4.connect()
+        except P4Exception as e:
+            print("[Daemon]Failed to reconnect, retry at next poll: %s" % e)
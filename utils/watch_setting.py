@@ -8,17 +8,23 @@ class WatchItem(object):
     # path: depot path
     # prev_stamp or curr_stamp:
     # P4 change ID (e.g. 2262400) or time (e.g. 2023/3/16:19:00:00) of previous/current version.
+    # compare_path: depot path of another branch (e.g. "//depot/Release/Audio"), empty to check changes of path
+    # if set, files of compare_path at prev_stamp are compared with files of path at curr_stamp by relative path,
+    # stamps select revs as in range mode: a change ID stamp is exclusive (files before the change),
+    # a time is exclusive as prev_stamp and inclusive as curr_stamp
     def __init__(
         self,
         name: str = "",
         path: str = "",
         prev_stamp: str = "",
         curr_stamp: str = "",
+        compare_path: str = "",
     ):
         self.name: str = name
         self.path: str = path
         self.prev_stamp: str = prev_stamp
         self.curr_stamp: str = curr_stamp
+        self.compare_path: str = compare_path
 
     def to_dict(self) -> OrderedDict:
         od = OrderedDict()
@@ -26,6 +32,7 @@ class WatchItem(object):
         od["path"] = self.path
         od["prev_stamp"] = self.prev_stamp
         od["curr_stamp"] = self.curr_stamp
+        od["compare_path"] = self.compare_path
         return od
 
     def from_dict(self, od: OrderedDict):
@@ -37,12 +44,15 @@ class WatchItem(object):
             self.prev_stamp = od["prev_stamp"]
         if "curr_stamp" in od:
             self.curr_stamp = od["curr_stamp"]
+        if "compare_path" in od:
+            self.compare_path = od["compare_path"]
 
     def update_from(self, sample: "WatchItem"):
         self.name = sample.name
         self.path = sample.path
         self.prev_stamp = sample.prev_stamp
         self.curr_stamp = sample.curr_stamp
+        self.compare_path = sample.compare_path
 
 
 class WatchSetting(object):
@@ -55,6 +65,23 @@ class WatchSetting(object):
         self.p4_server: str = ""
         self.p4_workspace_name: str = ""
         self.output_dir = "results"
+        self.max_concurrent_checks: int = 2
+        # throttle toward p4 server, 0 means unlimited
+        self.p4_max_commands_per_sec: float = 0.0
+        self.p4_max_bytes_per_sec: float = 0.0
+        self.p4_max_concurrency: int = 8
+        # sqlite loudness index built by "index" command, empty to fetch every revision
+        self.loudness_index_path: str = ""
+        # cache of submitted change describes of p4_server, empty to use "change_cache_<port>.db" in output_dir
+        self.change_cache_path: str = ""
+        # parallel analysis of files, 1 to analyse in checking thread
+        self.analysis_worker_num: int = 1
+        self.analysis_memory_budget_mb: float = 2048.0
+        # root dir of scratch clients to prefetch all revs of a check in bulk, empty to sync files one by one
+        self.scratch_dir: str = ""
+        self.p4_parallel_sync_threads: int = 0
+        # names of check rules not run (e.g. "resource_band_energy_diff_rule"), metrics only they need are not computed
+        self.disabled_rules: list[str] = list[str]()
 
     def from_dict(self, od: OrderedDict):
         if "watch_item_list" in od:
@@ -71,6 +98,28 @@ class WatchSetting(object):
             self.p4_workspace_name = od["p4_workspace_name"]
         if "output_dir" in od:
             self.output_dir = od["output_dir"]
+        if "max_concurrent_checks" in od:
+            self.max_concurrent_checks = od["max_concurrent_checks"]
+        if "p4_max_commands_per_sec" in od:
+            self.p4_max_commands_per_sec = od["p4_max_commands_per_sec"]
+        if "p4_max_bytes_per_sec" in od:
+            self.p4_max_bytes_per_sec = od["p4_max_bytes_per_sec"]
+        if "p4_max_concurrency" in od:
+            self.p4_max_concurrency = od["p4_max_concurrency"]
+        if "loudness_index_path" in od:
+            self.loudness_index_path = od["loudness_index_path"]
+        if "change_cache_path" in od:
+            self.change_cache_path = od["change_cache_path"]
+        if "analysis_worker_num" in od:
+            self.analysis_worker_num = od["analysis_worker_num"]
+        if "analysis_memory_budget_mb" in od:
+            self.analysis_memory_budget_mb = od["analysis_memory_budget_mb"]
+        if "scratch_dir" in od:
+            self.scratch_dir = od["scratch_dir"]
+        if "p4_parallel_sync_threads" in od:
+            self.p4_parallel_sync_threads = od["p4_parallel_sync_threads"]
+        if "disabled_rules" in od:
+            self.disabled_rules = od["disabled_rules"]
 
     def to_dict(self) -> OrderedDict:
         od = OrderedDict()
@@ -81,6 +130,17 @@ class WatchSetting(object):
         od["p4_server"] = self.p4_server
         od["p4_workspace_name"] = self.p4_workspace_name
         od["output_dir"] = self.output_dir
+        od["max_concurrent_checks"] = self.max_concurrent_checks
+        od["p4_max_commands_per_sec"] = self.p4_max_commands_per_sec
+        od["p4_max_bytes_per_sec"] = self.p4_max_bytes_per_sec
+        od["p4_max_concurrency"] = self.p4_max_concurrency
+        od["loudness_index_path"] = self.loudness_index_path
+        od["change_cache_path"] = self.change_cache_path
+        od["analysis_worker_num"] = self.analysis_worker_num
+        od["analysis_memory_budget_mb"] = self.analysis_memory_budget_mb
+        od["scratch_dir"] = self.scratch_dir
+        od["p4_parallel_sync_threads"] = self.p4_parallel_sync_threads
+        od["disabled_rules"] = self.disabled_rules
         return od
 
     def from_json(self, path: str):
@@ -1,8 +1,104 @@
+import io
 import numpy as np
 import soundfile as sf
+from typing import Iterable, Optional
 # import pyloudnorm as pyln
 
 
+# metrics of wav, names of metrics other than header are names of WavInfo properties
+METRIC_HEADER = "header"                # available, channels, sr and duration, read without decoding
+METRIC_DBFS = "dBFS"
+METRIC_MAX_DBFS = "max_dBFS"
+METRIC_BAND_ENERGY = "band_energy_dB"
+METRIC_TRUE_PEAK = "true_peak_dB"
+ALL_METRICS = [METRIC_HEADER, METRIC_DBFS, METRIC_MAX_DBFS, METRIC_BAND_ENERGY, METRIC_TRUE_PEAK]
+LEVEL_BLOCK_LENGTH = 65536              # samples reduced at a time for dBFS and max dBFS, bounds temp memory
+
+# octave bands of band energy metric, center frequencies in Hz
+OCTAVE_BAND_CENTERS = [31.5, 63.0, 125.0, 250.0, 500.0, 1000.0, 2000.0, 4000.0, 8000.0, 16000.0]
+BAND_FRAME_LENGTH = 4096
+BAND_HOP_LENGTH = 2048
+BAND_FRAMES_PER_BATCH = 16     # frames of every channel transformed by one rfft call, bounds memory of long files
+
+
+# energy of every octave band in dB, averaged over frames and channels
+# data: (samples, channels), frames are taken as strided views and transformed in batches
+# sum of band powers is about mean square of data, so band dB is on the same scale as dBFS
+def compute_band_energy_dB(data: np.ndarray, sr: int, min_dB: float = -120.0) -> np.ndarray:
+    window = np.hanning(BAND_FRAME_LENGTH)
+    if data.shape[0] < BAND_FRAME_LENGTH:
+        # one zero padded frame, window covers samples only
+        window = np.pad(np.hanning(data.shape[0]), (0, BAND_FRAME_LENGTH - data.shape[0]))
+        data = np.pad(data, ((0, BAND_FRAME_LENGTH - data.shape[0]), (0, 0)))
+
+    # (channels, frames, frame length) view of channel-contiguous samples, frames are not copied
+    samples = np.ascontiguousarray(data.T, dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, BAND_FRAME_LENGTH, axis=-1)[:, ::BAND_HOP_LENGTH]
+    window = window.astype(np.float32)
+    power_spectrum = np.zeros(BAND_FRAME_LENGTH // 2 + 1)
+    for batch_begin in range(0, frames.shape[1], BAND_FRAMES_PER_BATCH):
+        spectrum = np.fft.rfft(frames[:, batch_begin:batch_begin + BAND_FRAMES_PER_BATCH] * window, axis=-1)
+        power_spectrum += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=(0, 1))
+
+    # one-sided spectrum, bins except dc and nyquist stand for two bins of full spectrum
+    power_spectrum[1:-1] *= 2.0
+    power_spectrum /= frames.shape[0] * frames.shape[1] * BAND_FRAME_LENGTH * np.sum(window ** 2)
+
+    # sum bins of every band, bins out of all bands are dropped
+    bin_freqs = np.fft.rfftfreq(BAND_FRAME_LENGTH, 1.0 / sr)
+    band_edges = np.array([OCTAVE_BAND_CENTERS[0] / np.sqrt(2.0)] + [c * np.sqrt(2.0) for c in OCTAVE_BAND_CENTERS])
+    band_idx = np.searchsorted(band_edges, bin_freqs, side="right") - 1
+    in_band = (band_idx >= 0) & (band_idx < len(OCTAVE_BAND_CENTERS))
+    band_power = np.bincount(band_idx[in_band], weights=power_spectrum[in_band], minlength=len(OCTAVE_BAND_CENTERS))
+
+    return np.maximum(10 * np.log10(np.maximum(band_power, 1e-30)), min_dB)
+
+
+# (rms, peak) of every channel (linear) by one pass over blocks of data (samples, channels)
+# every block is copied channel-contiguous, reductions along channels of interleaved samples are much slower
+def compute_levels(data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    sum_squares = np.zeros(data.shape[1])
+    peak = np.zeros(data.shape[1])
+    for block_begin in range(0, data.shape[0], LEVEL_BLOCK_LENGTH):
+        block = np.ascontiguousarray(data[block_begin:block_begin + LEVEL_BLOCK_LENGTH].T)
+        sum_squares += np.einsum("ij,ij->i", block, block)
+        peak = np.maximum(peak, np.maximum(np.max(block, axis=1), -np.min(block, axis=1)))
+    return np.sqrt(sum_squares / max(data.shape[0], 1)), peak
+
+
+# polyphase FIR of 4x oversampling for true peak, ITU-R BS.1770-4 Annex 2, one row per phase
+TRUE_PEAK_PHASE_COEFFS = np.array([
+    [0.0017089843750, 0.0109863281250, -0.0196533203125, 0.0332031250000, -0.0594482421875, 0.1373291015625,
+     0.9721679687500, -0.1022949218750, 0.0476074218750, -0.0266113281250, 0.0148925781250, -0.0083007812500],
+    [-0.0291748046875, 0.0292968750000, -0.0517578125000, 0.0891113281250, -0.1665039062500, 0.4650878906250,
+     0.7797851562500, -0.2003173828125, 0.1015625000000, -0.0582275390625, 0.0330810546875, -0.0189208984375],
+    [-0.0189208984375, 0.0330810546875, -0.0582275390625, 0.1015625000000, -0.2003173828125, 0.7797851562500,
+     0.4650878906250, -0.1665039062500, 0.0891113281250, -0.0517578125000, 0.0292968750000, -0.0291748046875],
+    [-0.0083007812500, 0.0148925781250, -0.0266113281250, 0.0476074218750, -0.1022949218750, 0.9721679687500,
+     0.1373291015625, -0.0594482421875, 0.0332031250000, -0.0196533203125, 0.0109863281250, 0.0017089843750],
+])
+TRUE_PEAK_BLOCK_LENGTH = 65536      # input samples filtered at a time, the 4x signal of a whole file is never kept
+SMALL_WAV_MAX_FRAMES = 65536        # wavs not longer than this are decoded and measured in batches
+
+
+# true peak of every channel (linear), max abs of 4x oversampled data
+# data: (samples, channels), every block of windows is multiplied by all phases at once, (taps, phases) kernel
+# sample_peak: max abs of data if already known
+def compute_true_peak(data: np.ndarray, sample_peak: Optional[np.ndarray] = None) -> np.ndarray:
+    taps = TRUE_PEAK_PHASE_COEFFS.shape[1]
+    kernel = np.ascontiguousarray(TRUE_PEAK_PHASE_COEFFS[:, ::-1].T)
+    # channel-contiguous samples, leading zeros as filter history of the first sample
+    samples = np.pad(np.ascontiguousarray(data.T), ((0, 0), (taps - 1, 0)))
+    true_peak = np.max(np.abs(data), axis=0) if sample_peak is None else sample_peak
+    for block_begin in range(0, data.shape[0], TRUE_PEAK_BLOCK_LENGTH):
+        # (channels, block length, taps) view, block overlaps the previous one by taps - 1 samples
+        windows = np.lib.stride_tricks.sliding_window_view(
+            samples[:, block_begin:block_begin + TRUE_PEAK_BLOCK_LENGTH + taps - 1], taps, axis=-1
+        )
+        true_peak = np.maximum(true_peak, np.max(np.abs(windows @ kernel), axis=(1, 2)))
+    return true_peak
+
+
 class WavInfo(object):
 
     MIN_VOLUME_DB = -120.0
@@ -14,6 +110,11 @@ class WavInfo(object):
         self.available = True
         self.rev_id = -1
         self.depot_path = ""
+        self._dBFS = None
+        self._max_dBFS = None
+        self._band_energy_dB = None
+        self._true_peak_dB = None
+        self.metrics_only = False       # built from metrics or header, or data released, metrics not computed are None
         if len(path) > 0:
             self.data, self.sr = sf.read(path, always_2d=True)
             if self.data.shape[0] == 0:
@@ -23,6 +124,99 @@ class WavInfo(object):
         self.duration = len(self.data) / self.sr
         # self.lufs_meter = pyln.Meter(self.sr)
 
+    # build wav info from decoded data (samples, channels)
+    @classmethod
+    def from_data(cls, data: np.ndarray, sr: int, path: str = "") -> "WavInfo":
+        wav_info = cls()
+        wav_info.path = path
+        wav_info.available = True
+        wav_info.data = data
+        wav_info.sr = sr
+        wav_info.duration = len(data) / sr
+        return wav_info
+
+    # load wav from content of a wav file, e.g. read before the local file is cleaned
+    @classmethod
+    def from_bytes(cls, content: bytes, path: str = "") -> "WavInfo":
+        data, sr = sf.read(io.BytesIO(content), always_2d=True)
+        if data.shape[0] == 0:
+            raise Exception("Wav data is empty.")
+        return cls.from_data(data, sr, path)
+
+    # build wav info from header of a wav file (path or file object) without decoding, only header metrics are got
+    @classmethod
+    def from_header(cls, file, path: str = "") -> "WavInfo":
+        sf_info = sf.info(file)
+        if sf_info.frames == 0:
+            raise Exception("Wav data is empty.")
+        wav_info = cls()
+        wav_info.path = path
+        wav_info.available = True
+        wav_info.sr = sf_info.samplerate
+        wav_info.data = np.zeros((1, sf_info.channels))
+        wav_info.duration = sf_info.frames / sf_info.samplerate
+        wav_info.metrics_only = True
+        return wav_info
+
+    # build wav info from extracted metrics (e.g. loaded from a checker journal), no audio data kept
+    @classmethod
+    def from_metrics(cls, metrics: dict) -> "WavInfo":
+        wav_info = cls()
+        wav_info.available = metrics["available"]
+        wav_info.sr = metrics["sr"]
+        wav_info.data = np.zeros((1, metrics["channels"]))
+        wav_info.duration = metrics["duration"]
+        if metrics.get("dBFS") is not None:
+            wav_info._dBFS = np.array(metrics["dBFS"])
+        if metrics.get("max_dBFS") is not None:
+            wav_info._max_dBFS = np.array(metrics["max_dBFS"])
+        if metrics.get("band_energy_dB") is not None:
+            wav_info._band_energy_dB = np.array(metrics["band_energy_dB"])
+        if metrics.get("true_peak_dB") is not None:
+            wav_info._true_peak_dB = np.array(metrics["true_peak_dB"])
+        wav_info.metrics_only = True
+        return wav_info
+
+    # extracted metrics, can be rebuilt by WavInfo.from_metrics
+    def to_metrics(self) -> dict:
+        return {
+            "available": self.available,
+            "channels": self.channels,
+            "sr": self.sr,
+            "duration": self.duration,
+            "dBFS": None if self.dBFS is None else [round(float(v), 4) for v in self.dBFS],
+            "max_dBFS": None if self.max_dBFS is None else [round(float(v), 4) for v in self.max_dBFS],
+            "band_energy_dB": None if self.band_energy_dB is None
+            else [round(float(v), 4) for v in self.band_energy_dB],
+            "true_peak_dB": None if self.true_peak_dB is None
+            else [round(float(v), 4) for v in self.true_peak_dB],
+        }
+
+    # compute metrics of metric_names from decoded data at once, then release decoded data
+    # dBFS and max dBFS are got by one pass, sample peak is shared with true peak
+    def compute_metrics(self, metric_names: Iterable[str]):
+        if self.metrics_only:
+            return
+        metric_names = set(metric_names)
+        if len(metric_names & {METRIC_DBFS, METRIC_MAX_DBFS, METRIC_TRUE_PEAK}) > 0 and self._max_dBFS is None:
+            rms, peak = compute_levels(self.data)
+            self._dBFS = 20 * np.log10(np.clip(rms, self.eps, None) / 1.0)
+            self._max_dBFS = 20 * np.log10(np.clip(peak, self.eps, None) / 1.0)
+        if METRIC_TRUE_PEAK in metric_names and self.available:
+            self._true_peak_dB = 20 * np.log10(np.clip(
+                compute_true_peak(self.data, 10 ** (self._max_dBFS / 20.0)), self.eps, None
+            ) / 1.0)
+        if METRIC_BAND_ENERGY in metric_names:
+            _ = self.band_energy_dB
+        self.data = np.zeros((1, self.channels))
+        self.metrics_only = True
+
+    # whether metrics of metric_names are got, or can be computed from decoded data
+    def has_metrics(self, metric_names: Iterable[str]) -> bool:
+        if not self.metrics_only or not self.available:
+            return True
+        return all([getattr(self, name) is not None for name in metric_names if name != METRIC_HEADER])
+
     def create_failed_data(self):
         self.available = False
         self.data = np.zeros((1, 1))
@@ -39,14 +233,36 @@ class WavInfo(object):
         return np.clip(np.sqrt(np.mean(np.square(self.data), axis=0)), self.eps, None)
 
     # avg volume of all channels in dB
+    # None if not available, e.g. built from header
     @property
     def dBFS(self) -> np.array:
-        return 20 * np.log10(self.RMS / 1.0)
+        if self._dBFS is None and not self.metrics_only:
+            self._dBFS = 20 * np.log10(self.RMS / 1.0)
+        return self._dBFS
 
     # max dBFS of all channels
+    # None if not available, e.g. built from header
     @property
     def max_dBFS(self) -> np.array:
-        return 20 * np.log10(np.clip(np.max(np.abs(self.data), axis=0), self.eps, None) / 1.0)
+        if self._max_dBFS is None and not self.metrics_only:
+            self._max_dBFS = 20 * np.log10(np.clip(np.max(np.abs(self.data), axis=0), self.eps, None) / 1.0)
+        return self._max_dBFS
+
+    # energy of octave bands in dB, see OCTAVE_BAND_CENTERS
+    # None if not available, e.g. built from metrics without band energy
+    @property
+    def band_energy_dB(self) -> np.array:
+        if self._band_energy_dB is None and self.available and not self.metrics_only:
+            self._band_energy_dB = compute_band_energy_dB(self.data, self.sr, self.MIN_VOLUME_DB)
+        return self._band_energy_dB
+
+    # true peak of all channels in dB (dBTP), not less than max_dBFS
+    # None if not available, e.g. built from metrics without true peak
+    @property
+    def true_peak_dB(self) -> np.array:
+        if self._true_peak_dB is None and self.available and not self.metrics_only:
+            self._true_peak_dB = 20 * np.log10(np.clip(compute_true_peak(self.data), self.eps, None) / 1.0)
+        return self._true_peak_dB
 
     # LUFS, another avg volume meter
     # @property
@@ -58,3 +274,53 @@ class WavInfo(object):
     def channels_dBFS_diff(self) -> float:
         dBFS = self.dBFS
         return np.max(dBFS) - np.min(dBFS)
+
+
+# load small wavs of paths in batch, None for wavs not loaded (longer than SMALL_WAV_MAX_FRAMES or unreadable)
+# wavs with the same channel num are decoded into one concatenated buffer, data of wav infos are views of it
+# dBFS and max dBFS of every (wav, channel) are computed by segmented reductions over the buffer
+def load_small_wavs(paths: list[str]) -> list[Optional[WavInfo]]:
+    wav_infos: list[Optional[WavInfo]] = [None] * len(paths)
+    # channel num -> [(path idx, opened file)], files are opened once, headers are read at opening
+    wav_groups = dict[int, list[tuple[int, sf.SoundFile]]]()
+    for path_idx, path in enumerate(paths):
+        try:
+            sound_file = sf.SoundFile(path)
+        except Exception:
+            continue
+        if 0 < sound_file.frames <= SMALL_WAV_MAX_FRAMES:
+            wav_groups.setdefault(sound_file.channels, []).append((path_idx, sound_file))
+        else:
+            sound_file.close()
+
+    for channels, wav_group in wav_groups.items():
+        frame_nums = np.array([sound_file.frames for _, sound_file in wav_group])
+        offsets = np.concatenate([[0], np.cumsum(frame_nums)[:-1]])
+        buffer = np.zeros((int(np.sum(frame_nums)), channels))
+        loaded = np.zeros(len(wav_group), dtype=bool)
+        for wav_idx, (path_idx, sound_file) in enumerate(wav_group):
+            try:
+                # header frames may be more than decoded frames of a broken file, load it alone then
+                loaded[wav_idx] = len(sound_file.read(
+                    out=buffer[offsets[wav_idx]:offsets[wav_idx] + frame_nums[wav_idx]]
+                )) == frame_nums[wav_idx]
+            except Exception:
+                pass
+            finally:
+                sound_file.close()
+
+        mean_squares = np.add.reduceat(np.square(buffer), offsets, axis=0) / frame_nums[:, None]
+        peaks = np.maximum.reduceat(np.abs(buffer), offsets, axis=0)
+        dBFS = 20 * np.log10(np.clip(np.sqrt(mean_squares), WavInfo.eps, None) / 1.0)
+        max_dBFS = 20 * np.log10(np.clip(peaks, WavInfo.eps, None) / 1.0)
+        for wav_idx, (path_idx, sound_file) in enumerate(wav_group):
+            if not loaded[wav_idx]:
+                continue
+            wav_info = WavInfo.from_data(
+                buffer[offsets[wav_idx]:offsets[wav_idx] + frame_nums[wav_idx]], sound_file.samplerate, paths[path_idx]
+            )
+            wav_info._dBFS = dBFS[wav_idx]
+            wav_info._max_dBFS = max_dBFS[wav_idx]
+            wav_infos[path_idx] = wav_info
+
+    return wav_infos
@@ -0,0 +1,164 @@
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from utils.watch_setting import WatchItem
+from utils.async_task import AsyncTaskThread
+from utils import diff_checker
+from utils import p4
+from .utils.table_view_utils import TableRowModel
+
+
+# checking job of one watch item
+class CheckJob(object):
+
+    STATUS_PENDING = "Pending"
+    STATUS_RUNNING = "Checking"
+    STATUS_CANCELLING = "Cancelling"
+    STATUS_CANCELLED = "Cancelled"
+    STATUS_FAILED = "Failed"
+    STATUS_FINISHED = "Finished"
+
+    def __init__(self, row_model: TableRowModel, watch_item: WatchItem):
+        self.row_model = row_model
+        self.watch_item = watch_item
+        self.status = self.STATUS_PENDING
+
+        # created when job starts, each job has its own p4 connection and checker
+        self.p4_client: Optional[p4.P4Client] = None
+        self.checker: Optional[diff_checker.DiffChecker] = None
+        self.thread: Optional[AsyncTaskThread] = None
+
+        # progress
+        self.progress = 0.0
+        self.start_time = 0.0
+        self.phase = ""             # current phase of job thread, e.g. "Checking changes"
+        self.phase_done = 0
+        self.phase_total = 0
+        self.phase_start_time = 0.0
+        self.phase_start_done = 0      # done num when phase progress is first received
+
+    # update phase progress, return True if a new phase started
+    def update_phase(self, phase: str, done: int, total: int) -> bool:
+        new_phase_flag = phase != self.phase
+        if new_phase_flag:
+            self.phase = phase
+            self.phase_start_time = time.perf_counter()
+            self.phase_start_done = done
+        self.phase_done = done
+        self.phase_total = total
+        return new_phase_flag
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in [self.STATUS_CANCELLED, self.STATUS_FAILED, self.STATUS_FINISHED]
+
+    # status shown in table row, running job shows progress, throughput and ETA of current phase
+    @property
+    def status_text(self) -> str:
+        if self.status != self.STATUS_RUNNING or len(self.phase) == 0:
+            return self.status
+
+        elapsed_time = max(time.perf_counter() - self.phase_start_time, 1e-6)
+        items_per_sec = (self.phase_done - self.phase_start_done) / elapsed_time
+        if items_per_sec > 0:
+            eta_str = time.strftime("%H:%M:%S", time.gmtime((self.phase_total - self.phase_done) / items_per_sec))
+        else:
+            eta_str = "--:--:--"
+        return "%s %s/%s  %.1f/s  ETA %s" % (
+            self.phase, format(self.phase_done, ","), format(self.phase_total, ","), items_per_sec, eta_str
+        )
+
+
+# run up to max_running_num jobs at the same time, others wait in queue
+class CheckJobScheduler(object):
+
+    def __init__(self, max_running_num: int = 1):
+        self.max_running_num = max(1, max_running_num)
+        self.pending_jobs = deque[CheckJob]()
+        self.running_jobs = list[CheckJob]()
+
+        # receive a CheckJob, should create and start job thread
+        self.start_job_delegate: Optional[Callable] = None
+        # receive a CheckJob whose status changed
+        self.job_status_delegate: Optional[Callable] = None
+        # called when no job is pending or running
+        self.all_finished_delegate: Optional[Callable] = None
+
+    @property
+    def is_busy(self) -> bool:
+        return len(self.pending_jobs) > 0 or len(self.running_jobs) > 0
+
+    @property
+    def jobs(self) -> list[CheckJob]:
+        return self.running_jobs + list(self.pending_jobs)
+
+    # find pending or running job of row
+    def find_job(self, row_model: TableRowModel) -> Optional[CheckJob]:
+        for job in self.jobs:
+            if job.row_model is row_model:
+                return job
+        return None
+
+    # add job to queue, return False if the row is already pending or running
+    def submit(self, job: CheckJob) -> bool:
+        if self.find_job(job.row_model) is not None:
+            return False
+        self.pending_jobs.append(job)
+        self._notify_status(job)
+        self.schedule()
+        return True
+
+    # cancel job, pending job is removed, running job stops after its current file
+    def cancel(self, job: CheckJob):
+        if job in self.pending_jobs:
+            self.pending_jobs.remove(job)
+            job.status = CheckJob.STATUS_CANCELLED
+            self._notify_status(job)
+            self._check_all_finished()
+        elif job in self.running_jobs and job.thread is not None:
+            job.status = CheckJob.STATUS_CANCELLING
+            job.thread.cancel()
+            self._notify_status(job)
+
+    def cancel_all(self):
+        for job in self.jobs:
+            self.cancel(job)
+
+    # start pending jobs while running slots are free
+    def schedule(self):
+        while len(self.running_jobs) < self.max_running_num and len(self.pending_jobs) > 0:
+            job = self.pending_jobs.popleft()
+            job.status = CheckJob.STATUS_RUNNING
+            job.start_time = time.perf_counter()
+            self.running_jobs.append(job)
+            try:
+                self.start_job_delegate(job)
+            except Exception as e:
+                print("[CheckJob]Failed to start checking '%s': %s" % (job.watch_item.name, e))
+                self.running_jobs.remove(job)
+                job.status = CheckJob.STATUS_FAILED
+            self._notify_status(job)
+
+        self._check_all_finished()
+
+    # should be called when job thread finished
+    def on_job_finished(self, job: CheckJob):
+        if job in self.running_jobs:
+            self.running_jobs.remove(job)
+        if job.thread is not None and job.thread.cancelled:
+            job.status = CheckJob.STATUS_CANCELLED
+        elif job.thread is not None and job.thread.error is not None:
+            job.status = CheckJob.STATUS_FAILED
+        else:
+            job.status = CheckJob.STATUS_FINISHED
+        self._notify_status(job)
+        self.schedule()
+
+    def _notify_status(self, job: CheckJob):
+        if self.job_status_delegate is not None:
+            self.job_status_delegate(job)
+
+    def _check_all_finished(self):
+        if not self.is_busy and self.all_finished_delegate is not None:
+            self.all_finished_delegate()
@@ -0,0 +1,125 @@
+from PySide6.QtWidgets import QTableView, QLineEdit, QCheckBox, QHBoxLayout
+
+from utils import diff_checker
+from .utils.table_view_utils import TableRowModel, TableWrapper, CachedColumnSortFilterProxyModel
+
+
+RESULT_TABLE_HEADER = [
+    "Watch Item", "Depot Path", "Prev Rev", "Curr Rev", "Prev dBFS", "Curr dBFS",
+    "Prev Max dBFS", "Curr Max dBFS", "Prev Channels", "Curr Channels", "Hit Rules",
+]
+NO_RULE_HIT_NAME = ""
+NO_RULE_HIT_LABEL = "No rule hit"
+
+
+# one checked file, built from a row of MetricsColumnBuilder
+class CheckResultRowModel(TableRowModel):
+
+    def __init__(self, watch_item_name: str, result: dict, rule_labels: dict[str, str]):
+        super(CheckResultRowModel, self).__init__()
+
+        self.result = result
+        self.hit_rules = [name for name in rule_labels if result.get("rule_%s" % name, False)]
+        self._display_data = [
+            watch_item_name,
+            result["path"],
+            result["prev_rev"],
+            result["curr_rev"],
+            self._mean(result["prev_dBFS"]),
+            self._mean(result["curr_dBFS"]),
+            self._mean(result["prev_max_dBFS"]),
+            self._mean(result["curr_max_dBFS"]),
+            result["prev_channels"],
+            result["curr_channels"],
+            ", ".join([rule_labels[name] for name in self.hit_rules]),
+        ]
+
+    @staticmethod
+    def _mean(values: list[float]) -> float:
+        return round(sum(values) / len(values), 2) if len(values) > 0 else 0.0
+
+    @property
+    def display_data(self) -> list[any]:
+        return self._display_data
+
+    @property
+    def hidden_data(self) -> any:
+        return self.result
+
+
+# results table filled while checking, sorted by header click and filtered by path and hit rules
+# rows appended while checking are shown at the end, and sorted into place when a job finishes
+class CheckResultTable(object):
+
+    def __init__(
+        self,
+        table_view: QTableView,
+        path_filter_line_edit: QLineEdit,
+        rule_filter_layout: QHBoxLayout,
+        check_rules: list[diff_checker.CheckRule],
+    ):
+        self.proxy_model = CachedColumnSortFilterProxyModel(table_view.parent())
+        self.proxy_model.row_filter = self.filter_row
+        self.table_wrapper = TableWrapper(table_view, self.proxy_model)
+        self.table_wrapper.set_header(RESULT_TABLE_HEADER)
+        self.table_wrapper.hide_vertical_header()
+        self.table_wrapper.set_column_width(100)
+        self.table_wrapper.set_column_width(500, col=1)
+        self.table_wrapper.enable_sorting()
+
+        # rule name -> label shown in table, e.g. "Resource dBFS diff too large"
+        self.rule_labels = dict[str, str]()
+        for check_rule in check_rules:
+            self.rule_labels[check_rule.name] = check_rule.log_header.split("\n")[0].strip("[]")
+
+        # path filter
+        self.path_filter = ""
+        self.path_filter_line_edit = path_filter_line_edit
+        self.path_filter_line_edit.textChanged.connect(self.on_path_filter_changed)
+
+        # one toggle per rule, rows hitting any enabled rule are shown
+        self.enabled_rules = set[str](list(self.rule_labels.keys()) + [NO_RULE_HIT_NAME])
+        self.rule_filter_check_boxes = list[QCheckBox]()
+        for rule_name, rule_label in list(self.rule_labels.items()) + [(NO_RULE_HIT_NAME, NO_RULE_HIT_LABEL)]:
+            check_box = QCheckBox(rule_label, table_view.parent())
+            check_box.setChecked(True)
+            check_box.toggled.connect(
+                lambda checked, name=rule_name: self.on_rule_filter_toggled(name, checked)
+            )
+            rule_filter_layout.addWidget(check_box)
+            self.rule_filter_check_boxes.append(check_box)
+
+    def clear(self):
+        self.table_wrapper.source_model.clear()
+
+    # append check results of watch item, results are rows of MetricsColumnBuilder
+    def append_results(self, watch_item_name: str, results: list[dict]):
+        self.table_wrapper.append_lines([
+            CheckResultRowModel(watch_item_name, result, self.rule_labels) for result in results
+        ])
+
+    # sort appended rows into place
+    def resort(self):
+        self.proxy_model.resort()
+
+    # return False if row should be hidden
+    def filter_row(self, row: CheckResultRowModel) -> bool:
+        if len(self.path_filter) > 0 and self.path_filter not in row.result["path"].lower():
+            return False
+        if len(row.hit_rules) == 0:
+            return NO_RULE_HIT_NAME in self.enabled_rules
+        for rule_name in row.hit_rules:
+            if rule_name in self.enabled_rules:
+                return True
+        return False
+
+    def on_path_filter_changed(self, text: str):
+        self.path_filter = text.strip().lower()
+        self.proxy_model.refresh_filter()
+
+    def on_rule_filter_toggled(self, rule_name: str, checked: bool):
+        if checked:
+            self.enabled_rules.add(rule_name)
+        else:
+            self.enabled_rules.discard(rule_name)
+        self.proxy_model.refresh_filter()
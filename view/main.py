@@ -1,33 +1,39 @@
 import os
 import time
-from queue import Queue
+import tempfile
+from functools import partial
 from typing import Optional
 
 from PySide6.QtWidgets import QMainWindow
-from PySide6.QtGui import QDesktopServices, QTextCursor
+from PySide6.QtGui import QDesktopServices
 from PySide6.QtCore import QUrl, Qt
 
 from utils.watch_setting import WatchSetting, WatchItem
-from utils import p4
 from utils import diff_checker
-from utils.async_task import AsyncTaskThread
+from utils import check_runner
+from utils.async_task import AsyncTaskThread, TaskProgress
 from .utils.table_view_utils import TableRowModel, TableWrapper
+from .check_job_scheduler import CheckJob, CheckJobScheduler
+from .check_result_table import CheckResultTable
 from .ui.main_window import Ui_MainWindow
 from .watch_item_edit_dialog import WatchItemEditDialog
 
 
-TABLE_HEADER = ["", "Name", "Depot Path", "Prev Stamp (Time or Change ID)", "Curr Stamp (Time or Change ID)"]
+TABLE_HEADER = [
+    "", "Name", "Depot Path", "Prev Stamp (Time or Change ID)", "Curr Stamp (Time or Change ID)", "Status"
+]
 COLUMN_DEFAULT_WIDTH = 150
 
 
 class WatchItemRowModel(TableRowModel):
 
-    TABLE_HEADER = ["", "Name", "Depot Path", "Prev Stamp", "Curr Stamp"]
+    TABLE_HEADER = ["", "Name", "Depot Path", "Prev Stamp", "Curr Stamp", "Status"]
 
     def __init__(self, watch_item: WatchItem):
         super(WatchItemRowModel, self).__init__()
 
         self.watch_item: WatchItem = watch_item
+        self.status: str = ""      # checking status of latest job
 
     @property
     def display_data(self) -> list[any]:
@@ -37,6 +43,7 @@ class WatchItemRowModel(TableRowModel):
             self.watch_item.path,
             self.watch_item.prev_stamp,
             self.watch_item.curr_stamp,
+            self.status,
         ]
 
     @property
@@ -73,9 +80,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.table_wrapper.double_click_row_delegate = self.on_double_click_table_item
         self.watch_item_edit_dialog = None
 
-        # p4 utils
-        self.p4_client = self.create_p4_client(self.watch_setting)
-
         # checker utils
         diff_checker.CLEAN_MODE = not self.watch_setting.disable_clean_mode
 
@@ -83,15 +87,23 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.refresh_output_folder_view()
         self.pushButtonOpenOutput.clicked.connect(self.on_click_open_output_folder)
 
-        # run checker
+        # run checker, every watch item is checked by a job with its own p4 connection
         self.pushButtonCheck.clicked.connect(self.on_click_run_checking)
+        self.pushButtonCancel.clicked.connect(self.on_click_cancel_checking)
         self.on_async_update_progress_bar(1.0)
-        self.checking_queue = Queue()
-        self.current_checker: Optional[diff_checker.DiffChecker] = None
-        self.current_watch_item: Optional[WatchItem] = None
-
-        # console output
-        self.text_edit_replace_last_flag: Optional[bool] = None        # if true, new line will replace last line
+        self.job_scheduler = CheckJobScheduler(self.watch_setting.max_concurrent_checks)
+        self.job_scheduler.start_job_delegate = self.start_check_job
+        self.job_scheduler.job_status_delegate = self.on_job_status_changed
+        self.job_scheduler.all_finished_delegate = self.on_all_checking_thread_finished
+        self.session_jobs = list[CheckJob]()       # jobs submitted since scheduler was idle
+
+        # results of jobs in current session, filled while checking
+        self.result_table = CheckResultTable(
+            table_view=self.tableViewResults,
+            path_filter_line_edit=self.lineEditResultFilter,
+            rule_filter_layout=self.horizontalLayoutRuleFilters,
+            check_rules=check_runner.get_check_rules(self.watch_setting.disabled_rules),
+        )
 
     def init_table(self):
         self.table_wrapper.set_header(TABLE_HEADER)
@@ -102,85 +114,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.table_wrapper.set_column_width(500, col=2)
         self.table_wrapper.set_column_width(250, col=3)
         self.table_wrapper.set_column_width(250, col=4)
+        self.table_wrapper.set_column_width(300, col=5)
 
         # append data
         for watch_item in self.watch_setting.watch_item_list:
             self.table_wrapper.append_line(WatchItemRowModel(watch_item))
 
-    @staticmethod
-    def create_p4_client(watch_setting: WatchSetting) -> p4.P4Client:
-        p4_client = p4.P4Client(
-            port=p4.P4_SERVER if watch_setting.p4_server is None else watch_setting.p4_server,
-            workspace_name=p4.P4_WORKSPACE_NAME
-            if watch_setting.p4_workspace_name is None
-            else watch_setting.p4_workspace_name,
-        )
-        return p4_client
-
-    @staticmethod
-    def get_check_rules() -> list[diff_checker.CheckRule]:
-        return [
-            diff_checker.CheckRule(
-                diff_checker.resource_dBFS_diff_rule,
-                "[Resource dBFS diff too large]\nPrev dBFS,Curr dBFS,Path"
-            ),
-            diff_checker.CheckRule(
-                diff_checker.resource_max_dBFS_diff_rule,
-                "[Resource max dBFS diff too large]\nPrev max dBFS,Curr max dBFS,Path"
-            ),
-            diff_checker.CheckRule(
-                diff_checker.resource_channel_diff_rule,
-                "[Resource channel num changed]\nPrev channel num,Curr channel num,Path"
-            ),
-            diff_checker.CheckRule(
-                diff_checker.resource_changed_rule,
-                "[Resource changed]\nAction,OldRev,NewRev,Path"
-            ),
-        ]
-
-    @staticmethod
-    def create_checker(
-        watch_item: WatchItem,
-        p4_client: p4.P4Client,
-        check_rules: list[diff_checker.CheckRule],
-        clean_mode: bool = False,
-    ) -> diff_checker.DiffChecker:
-        # get all change list
-        change_lists = p4_client.get_changes_of_dir(
-            base_dir=watch_item.path,
-            begin_stamp=watch_item.prev_stamp,
-            end_stamp=watch_item.curr_stamp,
-            file_ext=".wav"
-        )
-        change_lists.sort(key=lambda c: c.id)
-
-        # build checker
-        checker = diff_checker.DiffChecker(clean_mode=clean_mode)
-        checker.add_rules(check_rules)
-        for change_list in change_lists:
-            checker.version_forward(change_list)
-
-        return checker
-
-    @staticmethod
-    def save_checker_result(
-        checker: diff_checker.DiffChecker,
-        watch_item: WatchItem,
-        output_dir: str,
-    ) -> str:
-        # output result
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        output_path = os.path.join(output_dir, "%s_prev_%s_curr_%s.csv" % (
-            watch_item.name,
-            watch_item.prev_stamp.replace(":", "_").replace("/", "_"),
-            watch_item.curr_stamp.replace(":", "_").replace("/", "_"),
-        ))
-        with open(output_path, "w") as f:
-            print(checker.get_log(), file=f)
-
-        return output_path
-
     # refresh line edit of output folder by self.watch_setting
     def refresh_output_folder_view(self):
         self.lineEditOutputPath.setText(os.path.abspath(self.watch_setting.output_dir))
@@ -220,9 +159,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.watch_item_edit_dialog.setWindowModality(Qt.ApplicationModal)
         self.watch_item_edit_dialog.show()
 
-    # remove selected line in table
+    # remove selected line in table, jobs of removed lines are cancelled
     def on_click_remove_selected_path(self):
-        self.table_wrapper.remove_checked_rows()
+        for row in self.table_wrapper.remove_checked_rows():
+            job = self.job_scheduler.find_job(row)
+            if job is not None:
+                self.job_scheduler.cancel(job)
         self.update_watch_setting_by_table()
         self.save_watch_setting()
 
@@ -231,71 +173,111 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             os.makedirs(self.watch_setting.output_dir)
         QDesktopServices.openUrl(QUrl.fromLocalFile(self.watch_setting.output_dir))
 
-    # add item to checking queue, and start checking
+    # add selected items to job queue, items already queued or running are skipped
     def on_click_run_checking(self):
-        # clean checking queue
-        while not self.checking_queue.empty():
-            self.checking_queue.get()
+        if not self.job_scheduler.is_busy:
+            self.session_jobs.clear()
+            self.result_table.clear()
+            self.on_async_update_progress_bar(0.0)
 
-        # add selected items to checking queue
-        rows = self.table_wrapper.get_checked_rows()
-        for row in rows:
+        for row in self.table_wrapper.get_checked_rows():
             row: WatchItemRowModel
-            self.checking_queue.put(row.hidden_data)
-
-        # start checking
-        self.on_async_update_progress_bar(0.0)
-        self.setEnabled(False)      # disable ui
-        self.start_next_checking_thread()
-
-    # start a checking thread from checking queue
-    def start_next_checking_thread(self):
-        if self.checking_queue.empty():
-            self.on_all_checking_thread_finished()
-            return
-
-        # create checker
-        self.current_watch_item: WatchItem = self.checking_queue.get()
-        self.current_checker: diff_checker.DiffChecker = self.create_checker(
-            watch_item=self.current_watch_item,
-            p4_client=self.p4_client,
-            check_rules=self.get_check_rules(),
-        )
-
-        # start checking thread
-        check_thread = AsyncTaskThread(
-            task_worker=self.current_checker.check,
-            task_args=[self.p4_client, True],
-            task_length=len(self.current_checker),
-            on_progress=self.on_async_update_progress_bar,
-            on_task_result=self.on_async_file_checked,
-            on_finish=self.on_curr_checking_thread_finished,
+            watch_item = WatchItem()
+            watch_item.update_from(row.hidden_data)     # edits during checking do not affect the job
+            job = CheckJob(row, watch_item)
+            if self.job_scheduler.submit(job):
+                self.session_jobs.append(job)
+
+    # cancel jobs of selected items
+    def on_click_cancel_checking(self):
+        for row in self.table_wrapper.get_checked_rows():
+            job = self.job_scheduler.find_job(row)
+            if job is not None:
+                self.job_scheduler.cancel(job)
+
+    # start checking thread of job
+    def start_check_job(self, job: CheckJob):
+        job.thread = AsyncTaskThread(
+            task_worker=self.run_check_job,
+            task_args=[job],
+            task_length=0,
+            on_progress=partial(self.on_async_job_progress, job),
+            on_phase_progress=partial(self.on_async_job_phase_progress, job),
+            on_task_result=partial(self.on_async_job_results, job),
+            on_finish=partial(self.on_job_thread_finished, job),
             parent=self
         )
-        check_thread.start()
-        self.print_running_log(
-            "Start checking %s" % self.current_watch_item.path, header="Checking"
-        )
+        job.thread.start()
+        self.print_running_log("Start checking %s" % job.watch_item.path, header="Checking")
+
+    # job task running in checking thread, p4 connection and change listing stay off the ui thread
+    # revs are printed into a dir of the job, concurrent jobs never sync or clean the same workspace files
+    # p4 connection of job is closed when job ends, finished, failed or cancelled
+    def run_check_job(self, job: CheckJob):
+        job.p4_client = check_runner.create_p4_client(self.watch_setting)
+        try:
+            yield from self._run_check_job(job)
+        finally:
+            job.p4_client.disconnect()
+
+    def _run_check_job(self, job: CheckJob):
+        job.checker = diff_checker.DiffChecker(clean_mode=not self.watch_setting.disable_clean_mode)
+        job.checker.add_rules(check_runner.get_check_rules(self.watch_setting.disabled_rules))
+        with tempfile.TemporaryDirectory(prefix="check_job_") as print_dir:
+            job.checker.set_print_dir(print_dir)
+
+            # files of two branches are compared, differing files are listed before checking
+            if len(job.watch_item.compare_path) > 0:
+                yield TaskProgress("Comparing branches", 0, 0)
+                check_runner.load_checker_branch_diff(job.checker, job.watch_item, job.p4_client)
+                for file_idx, _ in job.checker.check(job.p4_client, yield_path_flag=True):
+                    yield job.checker.metrics_builder.get_row(file_idx)
+                    yield TaskProgress("Comparing branches", file_idx + 1, len(job.checker))
+                return
+
+            # list changes and check files while listing, yield result row of every checked file
+            yield TaskProgress("Checking changes", 0, 0)
+            for change_num, change_total, file_idx in check_runner.stream_check_changes(
+                job.checker, job.watch_item, job.p4_client
+            ):
+                if file_idx >= 0:
+                    yield job.checker.metrics_builder.get_row(file_idx)
+                yield TaskProgress("Checking changes", change_num, change_total)
 
     # update progress bar gui
     def on_async_update_progress_bar(self, progress: float):
         self.progressBar.setValue(int(progress * 100))
 
-    # one file checked
-    def on_async_file_checked(self, file_info: list):
-        file_idx = file_info[0]
-        file_path = file_info[1]
-        self.print_running_log(
-            "[%d/%d]%s" % (file_idx + 1, len(self.current_checker), file_path),
-            header="Checking", need_replace=True
-        )
-
-    # one check thread finished
-    def on_curr_checking_thread_finished(self):
-        # output result
-        output_path = self.save_checker_result(
-            checker=self.current_checker,
-            watch_item=self.current_watch_item,
+    # progress of one job changed, progress bar shows the avg of all jobs
+    def on_async_job_progress(self, job: CheckJob, progress: float):
+        job.progress = progress
+        if len(self.session_jobs) > 0:
+            self.on_async_update_progress_bar(
+                sum([1.0 if j.is_done else j.progress for j in self.session_jobs]) / len(self.session_jobs)
+            )
+
+    # phase progress of job changed, show progress, throughput and ETA in its row
+    def on_async_job_phase_progress(self, job: CheckJob, phase: str, done: int, total: int):
+        if job.update_phase(phase, done, total) and phase == "Checking changes":
+            self.print_running_log("Checking changes of %s" % job.watch_item.path, header="Checking")
+        self.on_job_status_changed(job)
+
+    # a batch of files checked in job, append them to result table
+    def on_async_job_results(self, job: CheckJob, results: list[dict]):
+        self.result_table.append_results(job.watch_item.name, results)
+
+    # job thread finished, save result if job is not cancelled
+    def on_job_thread_finished(self, job: CheckJob):
+        if not job.thread.cancelled and job.thread.error is None:
+            self.save_job_result(job)
+        self.result_table.resort()
+        self.job_scheduler.on_job_finished(job)
+
+    # output result of job
+    def save_job_result(self, job: CheckJob):
+        output_path = check_runner.save_checker_result(
+            checker=job.checker,
+            watch_item=job.watch_item,
             output_dir=self.watch_setting.output_dir,
         )
 
@@ -303,16 +285,39 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             "Check result saved to '%s'" % os.path.abspath(output_path),
             header="CheckFinshed"
         )
-
-        # start next checking thread
-        self.start_next_checking_thread()
-
-    # all checking thread finished
+        metrics_path = check_runner.save_checker_metrics(
+            checker=job.checker,
+            watch_item=job.watch_item,
+            output_dir=self.watch_setting.output_dir,
+        )
+        if len(metrics_path) > 0:
+            self.print_running_log(
+                "Metrics saved to '%s'" % os.path.abspath(metrics_path),
+                header="CheckFinshed"
+            )
+
+    # show job status in its row
+    def on_job_status_changed(self, job: CheckJob):
+        job.row_model.status = job.status_text
+        self.table_wrapper.refresh_row(job.row_model)
+        if job.status == CheckJob.STATUS_CANCELLED:
+            self.print_running_log("Cancelled %s" % job.watch_item.path, header="Checking")
+        elif job.status == CheckJob.STATUS_FAILED:
+            self.print_running_log("Failed %s: %s" % (
+                job.watch_item.path, job.thread.error if job.thread is not None else ""
+            ), header="Checking")
+
+    # all checking jobs finished
     def on_all_checking_thread_finished(self):
-        self.current_checker = None
-        self.current_watch_item = None
         self.on_async_update_progress_bar(1.0)
-        self.setEnabled(True)
+        self.print_running_log(check_runner.get_throttle(self.watch_setting).get_summary(), header="P4")
+
+    # stop running jobs before closing
+    def closeEvent(self, event):
+        self.job_scheduler.cancel_all()
+        for job in self.job_scheduler.running_jobs:
+            job.thread.wait()
+        super(MainWindow, self).closeEvent(event)
 
     # print running log to ui
     def print_running_log(
@@ -320,35 +325,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         info: str,
         header: str = "",
         time_stamp: bool = True,
-        need_replace: bool = False,
         to_stdout: bool = True
     ):
         line_str = "[%s][%s]%s" % (
             time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()) if time_stamp else "",
             header, info
         )
-        cursor = self.textEdit.textCursor()
-        if need_replace:
-            if self.text_edit_replace_last_flag:
-                # last line need replace
-                cursor.select(QTextCursor.LineUnderCursor)
-                cursor.removeSelectedText()
-            elif self.text_edit_replace_last_flag == False:
-                self.textEdit.insertPlainText("\n")
-        else:
-            # if not empty, add a new line
-            if self.text_edit_replace_last_flag is not None:
-                self.textEdit.insertPlainText("\n")
-        cursor.movePosition(QTextCursor.End)
-        self.textEdit.insertPlainText(line_str)
-        self.textEdit.ensureCursorVisible()
+        # append only, old lines are dropped by maximumBlockCount of the widget
+        self.textEdit.appendPlainText(line_str)
 
         if to_stdout:
-            if need_replace:
-                print("\r" + line_str, end="")
-            else:
-                if self.text_edit_replace_last_flag:
-                    print("")
-                print(line_str)
-
-        self.text_edit_replace_last_flag = need_replace
+            print(line_str)
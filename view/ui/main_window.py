@@ -16,15 +16,15 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
 from PySide6.QtWidgets import (QApplication, QCheckBox, QHBoxLayout, QHeaderView,
-    QLabel, QLineEdit, QMainWindow, QProgressBar,
-    QPushButton, QSizePolicy, QSpacerItem, QTableView,
-    QTextEdit, QVBoxLayout, QWidget)
+    QLabel, QLineEdit, QMainWindow, QPlainTextEdit,
+    QProgressBar, QPushButton, QSizePolicy, QSpacerItem,
+    QTableView, QVBoxLayout, QWidget)
 
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
         if not MainWindow.objectName():
             MainWindow.setObjectName(u"MainWindow")
-        MainWindow.resize(1234, 749)
+        MainWindow.resize(1234, 949)
         self.centralwidget = QWidget(MainWindow)
         self.centralwidget.setObjectName(u"centralwidget")
         self.verticalLayout_2 = QVBoxLayout(self.centralwidget)
@@ -130,18 +130,58 @@ class Ui_MainWindow(object):
 
         self.horizontalLayout_3.addWidget(self.pushButtonCheck)
 
+        self.pushButtonCancel = QPushButton(self.centralwidget)
+        self.pushButtonCancel.setObjectName(u"pushButtonCancel")
+        self.pushButtonCancel.setMinimumSize(QSize(200, 0))
+        self.pushButtonCancel.setFont(font1)
+
+        self.horizontalLayout_3.addWidget(self.pushButtonCancel)
+
 
         self.verticalLayout.addLayout(self.horizontalLayout_3)
 
+        self.horizontalLayout_5 = QHBoxLayout()
+        self.horizontalLayout_5.setObjectName(u"horizontalLayout_5")
+        self.label_3 = QLabel(self.centralwidget)
+        self.label_3.setObjectName(u"label_3")
+        self.label_3.setFont(font1)
+
+        self.horizontalLayout_5.addWidget(self.label_3)
+
+        self.lineEditResultFilter = QLineEdit(self.centralwidget)
+        self.lineEditResultFilter.setObjectName(u"lineEditResultFilter")
+        self.lineEditResultFilter.setMinimumSize(QSize(300, 0))
+        self.lineEditResultFilter.setFont(font1)
+
+        self.horizontalLayout_5.addWidget(self.lineEditResultFilter)
+
+        self.horizontalLayoutRuleFilters = QHBoxLayout()
+        self.horizontalLayoutRuleFilters.setObjectName(u"horizontalLayoutRuleFilters")
+
+        self.horizontalLayout_5.addLayout(self.horizontalLayoutRuleFilters)
+
+        self.horizontalSpacer_4 = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
+
+        self.horizontalLayout_5.addItem(self.horizontalSpacer_4)
+
+
+        self.verticalLayout.addLayout(self.horizontalLayout_5)
+
+        self.tableViewResults = QTableView(self.centralwidget)
+        self.tableViewResults.setObjectName(u"tableViewResults")
+
+        self.verticalLayout.addWidget(self.tableViewResults)
+
 
         self.verticalLayout_2.addLayout(self.verticalLayout)
 
-        self.textEdit = QTextEdit(self.centralwidget)
+        self.textEdit = QPlainTextEdit(self.centralwidget)
         self.textEdit.setObjectName(u"textEdit")
         self.textEdit.setMinimumSize(QSize(0, 200))
         self.textEdit.setMaximumSize(QSize(16777215, 200))
         self.textEdit.setFont(font1)
         self.textEdit.setTextInteractionFlags(Qt.TextSelectableByKeyboard|Qt.TextSelectableByMouse)
+        self.textEdit.setMaximumBlockCount(1000)
 
         self.verticalLayout_2.addWidget(self.textEdit)
 
@@ -161,5 +201,8 @@ class Ui_MainWindow(object):
         self.label_2.setText(QCoreApplication.translate("MainWindow", u"Output Folder", None))
         self.pushButtonOpenOutput.setText(QCoreApplication.translate("MainWindow", u"Open Output Folder", None))
         self.pushButtonCheck.setText(QCoreApplication.translate("MainWindow", u"Check Selected Path(s)", None))
+        self.pushButtonCancel.setText(QCoreApplication.translate("MainWindow", u"Cancel Selected", None))
+        self.label_3.setText(QCoreApplication.translate("MainWindow", u"Results", None))
+        self.lineEditResultFilter.setPlaceholderText(QCoreApplication.translate("MainWindow", u"Filter by depot path", None))
     # retranslateUi
 
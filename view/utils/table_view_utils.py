@@ -1,13 +1,23 @@
 import re
 import os
 from abc import abstractmethod
-from typing import Union
+from typing import Callable, Optional, Union
 
 from PySide6 import QtGui
 from PySide6.QtGui import QFont
 from PySide6.QtWidgets import QItemDelegate, QStyleOptionViewItem, \
     QWidget, QTableView, QPushButton, QHBoxLayout, QHeaderView, QMenu
-from PySide6.QtCore import Qt, QAbstractTableModel, QSortFilterProxyModel, QModelIndex
+from PySide6.QtCore import Qt, QAbstractTableModel, QAbstractProxyModel, QModelIndex
+
+
+# enum values used per cell, resolved once (attribute lookup on Qt is slow)
+DISPLAY_ROLE = Qt.ItemDataRole.DisplayRole
+CHECK_STATE_ROLE = Qt.ItemDataRole.CheckStateRole
+CHECKED = Qt.CheckState.Checked
+UNCHECKED = Qt.CheckState.Unchecked
+ITEM_IS_SELECTABLE = Qt.ItemFlag.ItemIsSelectable
+ITEM_IS_ENABLED = Qt.ItemFlag.ItemIsEnabled
+ITEM_IS_USER_CHECKABLE = Qt.ItemFlag.ItemIsUserCheckable
 
 
 class TableRowModel(object):
@@ -22,6 +32,9 @@ class TableRowModel(object):
         # these col indexes will always be enabled
         self.always_enable_cols: list[int] = list[int]()
 
+        # display_data cached for table model, call invalidate after display_data changed
+        self._display_data_cache: Optional[list[any]] = None
+
     # things to be show in table, len == table_cols
     @property
     @abstractmethod
@@ -34,11 +47,23 @@ class TableRowModel(object):
     def hidden_data(self) -> any:
         raise NotImplementedError()
 
+    # display_data built once until invalidated
+    @property
+    def cached_display_data(self) -> list[any]:
+        if self._display_data_cache is None:
+            self._display_data_cache = self.display_data
+        return self._display_data_cache
+
+    # drop cached display_data
+    def invalidate(self) -> None:
+        self._display_data_cache = None
+
     def __getitem__(self, idx: int) -> any:
-        return self.display_data[idx]
+        return self.cached_display_data[idx]
 
     def __setitem__(self, idx: int, value: any) -> None:
         self.display_data[idx] = value
+        self.invalidate()
 
 
 class TableModel(QAbstractTableModel):
@@ -56,31 +81,57 @@ class TableModel(QAbstractTableModel):
 
     @raw_data.setter
     def raw_data(self, rows: list[TableRowModel]) -> None:
+        self.beginResetModel()
         self._rows = rows
+        self.endResetModel()
 
     # 清空数据
     def clear(self) -> None:
+        self.beginResetModel()
         self._rows.clear()
+        self.endResetModel()
+
+    # append rows, only the new rows are inserted into views
+    def append_rows(self, rows: list[TableRowModel]) -> None:
+        if len(rows) == 0:
+            return
+        first_row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+    # emit dataChanged of rows in [first_row, last_row], cached display data of them is dropped
+    def rows_changed(self, first_row: int, last_row: int, first_col: int = 0, last_col: int = -1) -> None:
+        if last_row < first_row:
+            return
+        for row in range(first_row, last_row + 1):
+            self._rows[row].invalidate()
+        self.dataChanged.emit(
+            self.index(first_row, first_col),
+            self.index(last_row, self.columnCount() - 1 if last_col < 0 else last_col)
+        )
 
     # override super.data
     # get data by index (row, col)
     def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> any:
-        row = index.row()
-        col = index.column()
-        value = self._rows[row][col]
-        if role == Qt.DisplayRole:
-            if type(value) == bool:
+        if role != DISPLAY_ROLE and role != CHECK_STATE_ROLE:
+            return None
+
+        value = self._rows[index.row()].cached_display_data[index.column()]
+        value_type = type(value)
+        if role == DISPLAY_ROLE:
+            if value_type == bool:
                 # bool value should be set as a checkbox
                 return None
-            elif type(value) == float and str(value)[::-1].find(".") > 2:
-                # float type with given precision
+            elif value_type == float and value != round(value, 2):
+                # float type with more than 2 decimals, show with given precision
                 return "%.4f" % value
             else:
                 # other type (int, str, ...) return raw value
                 return value
-        elif role == Qt.CheckStateRole and type(value) == bool:
+        elif value_type == bool:
             # bool value should be set as a checkbox
-            return Qt.CheckState.Checked if self._rows[row][col] else Qt.CheckState.Unchecked
+            return CHECKED if value else UNCHECKED
 
     # override super.setData
     # set value at index (row, col)
@@ -91,10 +142,11 @@ class TableModel(QAbstractTableModel):
 
         row = index.row()
 
-        if role == Qt.CheckStateRole:
+        if role == CHECK_STATE_ROLE:
             # check state change
             self._rows[row].checked = not self._rows[row].checked
-            # self.dataChanged.emit(index, index, [role])
+            self._rows[row].invalidate()
+            self.dataChanged.emit(index, index, [role])
             return True
 
         return False
@@ -119,50 +171,230 @@ class TableModel(QAbstractTableModel):
     def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
         return len(self._header)
 
-    # TODO: sort will cause errors on cols with widgets
-    # def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
-    #     self.layoutAboutToBeChanged.emit()
-    #     self.view_index_list.sort(
-    #         key=lambda model_idx: self.raw_data[model_idx][column],
-    #         reverse=(order != Qt.AscendingOrder)
-    #     )
-    #     self.layoutChanged.emit()
-    #     self.dataChanged.emit(QModelIndex(), QModelIndex())
-
     # override super.flags
     # return flags of index (row, col)
     def flags(self, index: QModelIndex) -> Qt.ItemFlags:
         if not index.isValid():
             return super().flags(index)
 
-        row = index.row()
+        row_model = self._rows[index.row()]
         col = index.column()
 
         # selectable & enable
-        flags = Qt.ItemIsSelectable
-        if self._rows[row].enable:
-            flags |= Qt.ItemIsEnabled
+        flags = ITEM_IS_SELECTABLE
+        if row_model.enable:
+            flags |= ITEM_IS_ENABLED
 
         # cols that always enabled
-        if self._rows[row].always_enable_cols is not None and col in self._rows[row].always_enable_cols:
-            flags |= Qt.ItemIsEnabled
+        if row_model.always_enable_cols is not None and col in row_model.always_enable_cols:
+            flags |= ITEM_IS_ENABLED
 
         # checkbox for bool cell
-        if type(self._rows[row][col]) == bool:
-            flags |= Qt.ItemIsUserCheckable
+        if type(row_model.cached_display_data[col]) == bool:
+            flags |= ITEM_IS_USER_CHECKABLE
 
         return flags
 
 
+# sort and filter rows of TableModel, source rows are never moved
+# proxy row -> source row mapping is kept here, built by filtering rows with row_filter and sorting them
+# sort keys are read from column arrays cached on first use, and sorted in one python sort call
+# instead of calling lessThan (and TableModel.data) per compare.
+# rows appended after sorting stay at the end until resort is called.
+# cached values are dropped when source rows are reset, moved or changed (TableModel.rows_changed),
+# call refresh_filter if values read by row_filter are changed
+class CachedColumnSortFilterProxyModel(QAbstractProxyModel):
+
+    def __init__(self, parent=None):
+        super(CachedColumnSortFilterProxyModel, self).__init__(parent)
+
+        # col -> raw values of all source rows
+        self._column_cache = dict[int, list]()
+        self._sort_column = -1
+        self._sort_order = Qt.AscendingOrder
+
+        # proxy row -> source row, and source row -> proxy row (-1 if filtered out)
+        self._source_rows = list[int]()
+        self._proxy_rows = list[int]()
+
+        # source indexes of persistent indexes during layout change
+        self._layout_source_indexes = list[QModelIndex]()
+
+        # receive a TableRowModel, return False if row should be hidden
+        self.row_filter: Optional[Callable[[TableRowModel], bool]] = None
+
+    def setSourceModel(self, source_model: TableModel) -> None:
+        self.beginResetModel()
+        super().setSourceModel(source_model)
+        source_model.modelAboutToBeReset.connect(self._on_source_about_to_reset)
+        source_model.modelReset.connect(self._on_source_reset)
+        source_model.layoutAboutToBeChanged.connect(self._begin_layout_change)
+        source_model.layoutChanged.connect(self._on_source_layout_changed)
+        source_model.rowsInserted.connect(self._on_source_rows_inserted)
+        source_model.rowsAboutToBeRemoved.connect(self._on_source_about_to_reset)
+        source_model.rowsRemoved.connect(self._on_source_reset)
+        source_model.dataChanged.connect(self._on_source_data_changed)
+        source_model.headerDataChanged.connect(self.headerDataChanged)
+        self._column_cache.clear()
+        self._build_rows()
+        self.endResetModel()
+
+    def clear_cache(self, *args):
+        self._column_cache.clear()
+
+    # get cached column, extended lazily with rows appended to source model
+    def _get_column(self, col: int) -> list:
+        column = self._column_cache.setdefault(col, list())
+        rows = self.sourceModel().raw_data
+        if len(column) < len(rows):
+            column.extend([rows[row_idx][col] for row_idx in range(len(column), len(rows))])
+        return column
+
+    # build row mapping, source rows accepted by row_filter in sort order
+    def _build_rows(self):
+        rows = self.sourceModel().raw_data
+        source_rows = range(len(rows)) if self.row_filter is None else [
+            row_idx for row_idx in range(len(rows)) if self.row_filter(rows[row_idx])
+        ]
+        if self._sort_column >= 0:
+            key_column = self._get_column(self._sort_column)
+            source_rows = sorted(
+                source_rows, key=key_column.__getitem__, reverse=(self._sort_order == Qt.DescendingOrder)
+            )
+        self._source_rows = list(source_rows)
+        self._proxy_rows = [-1] * len(rows)
+        for proxy_row, source_row in enumerate(self._source_rows):
+            self._proxy_rows[source_row] = proxy_row
+
+    # persistent indexes (e.g. selection) follow their source rows through layout change
+    def _begin_layout_change(self):
+        self.layoutAboutToBeChanged.emit()
+        self._layout_source_indexes = [self.mapToSource(index) for index in self.persistentIndexList()]
+
+    def _end_layout_change(self):
+        self._build_rows()
+        self.changePersistentIndexList(
+            self.persistentIndexList(), [self.mapFromSource(index) for index in self._layout_source_indexes]
+        )
+        self._layout_source_indexes = list[QModelIndex]()
+        self.layoutChanged.emit()
+
+    def _on_source_about_to_reset(self, *args):
+        self.beginResetModel()
+
+    def _on_source_reset(self, *args):
+        self._column_cache.clear()
+        self._build_rows()
+        self.endResetModel()
+
+    # source rows may be moved
+    def _on_source_layout_changed(self, *args):
+        self._column_cache.clear()
+        self._end_layout_change()
+
+    # rows appended to source are appended to proxy rows if accepted, others are rebuilt
+    def _on_source_rows_inserted(self, parent: QModelIndex, first_row: int, last_row: int):
+        rows = self.sourceModel().raw_data
+        if first_row != len(self._proxy_rows):
+            self.beginResetModel()
+            self._on_source_reset()
+            return
+        new_source_rows = [
+            row_idx for row_idx in range(first_row, last_row + 1)
+            if self.row_filter is None or self.row_filter(rows[row_idx])
+        ]
+        self._proxy_rows.extend([-1] * (last_row + 1 - first_row))
+        if len(new_source_rows) == 0:
+            return
+        first_proxy_row = len(self._source_rows)
+        self.beginInsertRows(QModelIndex(), first_proxy_row, first_proxy_row + len(new_source_rows) - 1)
+        for proxy_row, source_row in enumerate(new_source_rows, first_proxy_row):
+            self._proxy_rows[source_row] = proxy_row
+        self._source_rows.extend(new_source_rows)
+        self.endInsertRows()
+
+    # cached values of changed rows are read again, changed rows are not resorted or filtered again
+    def _on_source_data_changed(self, top_left: QModelIndex, bottom_right: QModelIndex, roles: list[int] = ()):
+        rows = self.sourceModel().raw_data
+        source_rows = range(top_left.row(), bottom_right.row() + 1)
+        for col, column in self._column_cache.items():
+            for row_idx in source_rows:
+                if row_idx < len(column):
+                    column[row_idx] = rows[row_idx][col]
+        proxy_rows = [self._proxy_rows[row_idx] for row_idx in source_rows if self._proxy_rows[row_idx] >= 0]
+        if len(proxy_rows) > 0:
+            self.dataChanged.emit(
+                self.index(min(proxy_rows), top_left.column()),
+                self.index(max(proxy_rows), bottom_right.column()),
+                roles,
+            )
+
+    # override super.mapToSource
+    def mapToSource(self, proxy_index: QModelIndex) -> QModelIndex:
+        if not proxy_index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self._source_rows[proxy_index.row()], proxy_index.column())
+
+    # override super.mapFromSource
+    def mapFromSource(self, source_index: QModelIndex) -> QModelIndex:
+        if not source_index.isValid() or source_index.row() >= len(self._proxy_rows):
+            return QModelIndex()
+        proxy_row = self._proxy_rows[source_index.row()]
+        return self.index(proxy_row, source_index.column()) if proxy_row >= 0 else QModelIndex()
+
+    # override super.index
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if parent.isValid() or not (0 <= row < len(self._source_rows) and 0 <= column < self.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    # override super.parent, rows of table have no parent
+    def parent(self, index: QModelIndex = QModelIndex()) -> QModelIndex:
+        return QModelIndex()
+
+    # override super.rowCount
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._source_rows)
+
+    # override super.columnCount
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.sourceModel().columnCount()
+
+    # override super.headerData, header sections are not mapped, so header is shown without rows
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> any:
+        return self.sourceModel().headerData(section, orientation, role)
+
+    # override super.sort
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
+        self._sort_column = column
+        self._sort_order = order
+        self._begin_layout_change()
+        self._end_layout_change()
+
+    # sort again with last sort column, e.g. after rows appended
+    def resort(self):
+        self.sort(self._sort_column, self._sort_order)
+
+    # row_filter changed, filter all rows again
+    def refresh_filter(self):
+        self._begin_layout_change()
+        self._end_layout_change()
+
+
 class TableWrapper(object):
 
-    def __init__(self, table_view: QTableView):
+    def __init__(self, table_view: QTableView, proxy_model: Optional[QAbstractProxyModel] = None):
         # set table view and model
         self.table_view = table_view
         self.source_model = TableModel(table_view.parent())
 
-        # connect table_model to table_view
-        self.table_view.setModel(self.source_model)
+        # connect table_model to table_view, through proxy model if given
+        self.proxy_model = proxy_model
+        if self.proxy_model is not None:
+            self.proxy_model.setSourceModel(self.source_model)
+            self.table_view.setModel(self.proxy_model)
+        else:
+            self.table_view.setModel(self.source_model)
 
         # init table setting
         self.init_table_setting()
@@ -215,38 +447,40 @@ class TableWrapper(object):
         return self.source_model.raw_data
 
     # insert line data
-    # update_view = False: the table will not be updated immediately, self.refresh_view should be called later
+    # update_view = False: the table will not be updated immediately, self.reset_view should be called later
     def append_line(self, row_data: TableRowModel, update_view=True) -> None:
         if update_view:
-            self.source_model.layoutAboutToBeChanged.emit()
+            self.source_model.append_rows([row_data])
+        else:
+            self.source_model.raw_data.append(row_data)
 
-        self.source_model.raw_data.append(row_data)
+    # refresh view after rows data changed in place
+    def refresh_view(self):
+        self.source_model.rows_changed(0, self.source_model.rowCount() - 1)
 
-        # refresh view
-        if update_view:
-            row = self.source_model.rowCount()
-            col = self.source_model.columnCount()
-            self.source_model.layoutChanged.emit()
-            self.source_model.dataChanged.emit(
-                self.source_model.createIndex(row, 0),
-                self.source_model.createIndex(row, col - 1)
-            )
+    # insert lines data, only new rows are updated in view
+    def append_lines(self, rows_data: list[TableRowModel]) -> None:
+        self.source_model.append_rows(rows_data)
 
-    # refresh view
-    def refresh_view(self):
-        self.source_model.layoutAboutToBeChanged.emit()
-        self.source_model.layoutChanged.emit()
-        self.source_model.dataChanged.emit(
-            self.source_model.createIndex(0, 0),
-            self.source_model.createIndex(
-                self.source_model.rowCount() - 1, self.source_model.columnCount() - 1
-            )
-        )
+    # enable sorting by clicking header, proxy model is required
+    def enable_sorting(self, enable=True):
+        self.table_view.setSortingEnabled(enable)
+
+    # refresh view of one row, do nothing if row is not in table
+    def refresh_row(self, row_data: TableRowModel):
+        for row_idx, row in enumerate(self.model_rows):
+            if row is row_data:
+                self.source_model.rows_changed(row_idx, row_idx)
+                return
+
+    # reset view after rows added or removed without TableModel methods
+    def reset_view(self):
+        self.source_model.beginResetModel()
+        self.source_model.endResetModel()
 
     # clear table data
     def clear(self):
         self.source_model.clear()
-        self.refresh_view()
 
     # check all rows
     def select_all_rows(self, checked: bool = True):
@@ -280,12 +514,13 @@ class TableWrapper(object):
                 unchecked_rows.append(row)
 
         self.source_model.raw_data = unchecked_rows
-        self.refresh_view()
 
         return checked_rows
 
     # double click event
     def on_double_click(self, index: QModelIndex):
+        if self.proxy_model is not None:
+            index = self.proxy_model.mapToSource(index)
         row_model = self.model_rows[index.row()]
 
         if self.double_click_row_delegate is not None: